@@ -569,95 +569,94 @@ class CreateDepreciationWizard(models.TransientModel):
         change_default=True,
         default=lambda self: self.env.company)
 
-    def _get_voucher_line(self, Asset, cost_depreciation, vouch_obj):
-        ''' 借：累计折旧 '''
-        res = {}
-        if Asset.account_depreciation.id not in res:
-            res[Asset.account_depreciation.id] = {'debit': 0}
-        val = res[Asset.account_depreciation.id]
-        val.update({'debit': val.get('debit') + cost_depreciation,
-                    'voucher_id': vouch_obj.id,
-                    'account_id': Asset.account_depreciation.id,
-                    'name': '固定资产折旧',
-                    })
-
-        ''' 贷：费用科目 '''
-        if Asset.account_accumulated_depreciation.id not in res:
-            res[Asset.account_accumulated_depreciation.id] = {'credit': 0}
-            val = res[Asset.account_accumulated_depreciation.id]
-            val.update({'credit': val.get('credit') + cost_depreciation,
-                        'voucher_id': vouch_obj.id,
-                        'account_id': Asset.account_accumulated_depreciation.id,
-                        'name': '固定资产折旧',
-                        })
-        return res
-
-    def _generate_asset_line(self, Asset, cost_depreciation, total):
-        '''生成折旧明细行'''
-        AssetLine = self.env['asset.line'].create({
-            'date': self.date,
-            'order_id': Asset.id,
-            'period_id': self.period_id.id,
-            'cost_depreciation': cost_depreciation,
-            'name': Asset.name,
-            'code': Asset.code,
-            # 未提折旧：原值 - 已提折旧 - 本期折旧
-            'no_depreciation': Asset.surplus_value - total - cost_depreciation,
-        })
-        return AssetLine
+    def _get_depreciation_assets(self):
+        """
+        一条分组查询取出本期需要折旧的固定资产及其累计已提折旧
+        入账期间早于本期、本期还没有折旧过的已确认资产
+        :return: [(资产, 累计已提折旧)] 按资产编号排序
+        """
+        assets = self.env['asset'].search([('no_depreciation', '=', False),           # 提折旧的
+                                           ('state', '=', 'done'),                    # 已确认
+                                           ('period_id', '!=', self.period_id.id)])   # 从入账下月开始
+        if not assets:
+            return []
+        self.env['asset.line'].flush(['order_id', 'period_id', 'cost_depreciation'])
+        self.env['asset'].flush(['period_id'])
+        self.env.cr.execute('''
+            SELECT asset.id, COALESCE(SUM(line.cost_depreciation), 0)
+            FROM asset
+            JOIN finance_period asset_period ON asset_period.id = asset.period_id
+            LEFT JOIN asset_line line ON line.order_id = asset.id
+            WHERE asset.id IN %s
+              AND (asset_period.year::int, asset_period.month::int) < (%s, %s)
+            GROUP BY asset.id
+            HAVING NOT BOOL_OR(COALESCE(line.period_id = %s, FALSE))
+        ''', (tuple(assets.ids), int(self.period_id.year), int(self.period_id.month),
+              self.period_id.id))
+        totals = dict(self.env.cr.fetchall())
+        return [(asset, totals[asset.id]) for asset in assets if asset.id in totals]
+
+    def compute_depreciation(self):
+        """
+        计算本期折旧，不写入数据库，可用于预览
+        :return: {'asset_lines': 折旧明细行, 'voucher_lines': 按科目汇总的凭证行,
+                  'finished_asset_ids': 本期提完折旧的资产}
+        """
+        self.ensure_one()
+        asset_lines = []
+        finished_asset_ids = []
+        debit_amounts, credit_amounts = {}, {}
+        for Asset, depreciated in self._get_depreciation_assets():
+            # 本月折旧
+            cost_depreciation = Asset.cost_depreciation
+            # 累计折旧
+            total = depreciated + Asset.depreciation_value
+            # 最后一次折旧
+            if Asset.surplus_value <= (total + cost_depreciation):
+                cost_depreciation = Asset.surplus_value - total
+                finished_asset_ids.append(Asset.id)
+            # 借：累计折旧  贷：费用科目
+            debit_account_id = Asset.account_depreciation.id
+            credit_account_id = Asset.account_accumulated_depreciation.id
+            debit_amounts[debit_account_id] = debit_amounts.get(debit_account_id, 0) + cost_depreciation
+            credit_amounts[credit_account_id] = credit_amounts.get(credit_account_id, 0) + cost_depreciation
+            # 折旧明细行
+            asset_lines.append({
+                'date': self.date,
+                'order_id': Asset.id,
+                'period_id': self.period_id.id,
+                'cost_depreciation': cost_depreciation,
+                'name': Asset.name,
+                'code': Asset.code,
+                # 未提折旧：原值 - 已提折旧 - 本期折旧
+                'no_depreciation': Asset.surplus_value - total - cost_depreciation,
+            })
+        voucher_lines = [{'account_id': account_id, 'debit': amount, 'name': '固定资产折旧'}
+                         for account_id, amount in debit_amounts.items()]
+        voucher_lines += [{'account_id': account_id, 'credit': amount, 'name': '固定资产折旧'}
+                          for account_id, amount in credit_amounts.items()]
+        return {
+            'asset_lines': asset_lines,
+            'voucher_lines': voucher_lines,
+            'finished_asset_ids': finished_asset_ids,
+        }
 
     def create_depreciation(selfs):
         ''' 资产折旧，生成凭证和折旧明细'''
         for self in selfs:
-            vouch_obj = self.env['voucher'].create({'date': self.date})
-            res = []
-            asset_line_id_list = []
-            for Asset in self.env['asset'].search([('no_depreciation', '=', False),           # 提折旧的
-                                                ('state', '=', 'done'),                    # 已确认
-                                                ('period_id', '!=', self.period_id.id)]):  # 从入账下月开始
-                # 本期间没有折旧过，本期间晚于固定资产入账期间
-                if self.period_id not in [line.period_id for line in Asset.line_ids] and \
-                        self.env['finance.period'].period_compare(self.period_id, Asset.period_id) > 0:
-                    # 本月折旧
-                    cost_depreciation = Asset.cost_depreciation
-                    # 累计折旧
-                    total = sum(
-                        line.cost_depreciation for line in Asset.line_ids) + Asset.depreciation_value
-                    # 最后一次折旧
-                    if Asset.surplus_value <= (total + cost_depreciation):
-                        cost_depreciation = Asset.surplus_value - total
-                        Asset.no_depreciation = 1
-                    # 构造凭证明细行字典
-                    res.append(self._get_voucher_line(
-                        Asset, cost_depreciation, vouch_obj))
-
-                    # 生成折旧明细行
-                    asset_line_row = self._generate_asset_line(
-                        Asset, cost_depreciation, total)
-                    asset_line_id_list.append(asset_line_row.id)
-            # 构造凭证明细行字典
-            debit_line_dict, credit_line_dict = {}, {}
-            for i in range(len(res)):
-                for account_id, val in res[i].items():
-                    # 生成借方凭证明细
-                    if 'debit' in list(val.keys()):
-                        if account_id not in debit_line_dict:
-                            debit_line_dict[account_id] = val
-                        else:
-                            debit_line_dict[account_id]['debit'] += val['debit']
-                    # 生成贷方凭证明细
-                    if 'credit' in list(val.keys()):
-                        if account_id not in credit_line_dict:
-                            credit_line_dict[account_id] = val
-                        else:
-                            credit_line_dict[account_id]['credit'] += val['credit']
-            line_dict = dict(list(debit_line_dict.items()) + list(credit_line_dict.items()))
-            for account_id, val in line_dict.items():
-                self.env['voucher.line'].create(dict(val, account_id=account_id)) # 创建凭证行
-
+            res = self.compute_depreciation()
             # 没有凭证行则报错
-            if not vouch_obj.line_ids:
+            if not res['voucher_lines']:
                 raise UserError('本期没有需要折旧的固定资产。')
+            # 提完折旧的资产以后不再折旧
+            self.env['asset'].browse(res['finished_asset_ids']).write({'no_depreciation': True})
+            # 生成折旧明细行
+            asset_line_rows = self.env['asset.line'].create(res['asset_lines'])
+            # 生成凭证
+            self.env['voucher'].create({
+                'date': self.date,
+                'line_ids': [(0, 0, line) for line in res['voucher_lines']],
+            })
             #vouch_obj.voucher_done()
 
             # 界面转到本月折旧明细
@@ -668,7 +667,7 @@ class CreateDepreciationWizard(models.TransientModel):
                 'views': [(view.id, 'tree')],
                 'res_model': 'asset.line',
                 'type': 'ir.actions.act_window',
-                'domain': [('id', 'in', asset_line_id_list)]
+                'domain': [('id', 'in', asset_line_rows.ids)]
             }
 
 
@@ -286,6 +286,25 @@ class TestDepreciationWizard(TransactionCase):
         wizard.create_depreciation()
 
 
+    def test_compute_depreciation_preview(self):
+        ''' 预览折旧不生成折旧明细和凭证，确认后本期不再重复折旧 '''
+        asset_2 = self.asset.copy()
+        asset_2.asset_done()
+        self.asset.asset_done()
+        wizard = self.env['create.depreciation.wizard'].create({'date': '2016-05-01'})
+        line_count = self.env['asset.line'].search_count([])
+        res = wizard.compute_depreciation()
+        self.assertEqual(self.env['asset.line'].search_count([]), line_count)
+        self.assertTrue({self.asset.id, asset_2.id} <=
+                        {l['order_id'] for l in res['asset_lines']})
+        self.assertAlmostEqual(sum(l.get('debit', 0) for l in res['voucher_lines']),
+                               sum(l.get('credit', 0) for l in res['voucher_lines']))
+        wizard.create_depreciation()
+        self.assertEqual(self.env['asset.line'].search_count([]),
+                         line_count + len(res['asset_lines']))
+        self.assertFalse(wizard.compute_depreciation()['asset_lines'])
+
+
 class TestVoucher(TransactionCase):
 
     def setUp(self):
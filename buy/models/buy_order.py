@@ -77,22 +77,53 @@ class BuyOrder(models.Model):
         '''获取默认调入仓库'''
         return self._default_warehouse_dest_impl()
 
-    def _get_paid_amount(selfs):
-        '''计算购货订单付款/退款状态'''
-        for self in selfs:
-            if not self.invoice_by_receipt: # 分期付款时
-                money_invoices = self.env['money.invoice'].search([
-                    ('name', '=', self.name),
-                    ('state', '=', 'done')])
-                self.paid_amount = sum([invoice.reconciled for invoice in money_invoices])
-            else:
-                receipts = self.env['buy.receipt'].search([('order_id', '=', self.id)])
-                # 购货订单上输入预付款时
-                money_order_rows = self.env['money.order'].search([('buy_id', '=', self.id),
-                                                                ('reconciled', '=', 0),
-                                                                ('state', '=', 'done')])
-                self.paid_amount = sum([receipt.invoice_id.reconciled for receipt in receipts]) +\
-                    sum([order_row.amount for order_row in money_order_rows])
+    def _get_paid_amount(self):
+        '''计算购货订单付款/退款状态，整批订单对每张关联表只汇总一次'''
+        for order in self:
+            order.paid_amount = 0
+        orders = self.filtered('id')
+        if not orders:
+            return
+        self.env['money.invoice'].flush(['name', 'state', 'reconciled'])
+        self.env['buy.receipt'].flush(['order_id', 'invoice_id'])
+        self.env['money.order'].flush(['buy_id', 'reconciled', 'state', 'amount'])
+        cr = self.env.cr
+
+        by_plan = orders.filtered(lambda o: not o.invoice_by_receipt)  # 分期付款时
+        if by_plan:
+            cr.execute('''
+                SELECT name, COALESCE(SUM(reconciled), 0)
+                  FROM money_invoice
+                 WHERE name IN %s
+                   AND state = 'done'
+              GROUP BY name
+            ''', (tuple(by_plan.mapped('name')),))
+            invoice_paid = dict(cr.fetchall())
+            for order in by_plan:
+                order.paid_amount = invoice_paid.get(order.name, 0)
+
+        by_receipt = orders - by_plan
+        if by_receipt:
+            cr.execute('''
+                SELECT r.order_id, COALESCE(SUM(mi.reconciled), 0)
+                  FROM buy_receipt r
+                  JOIN money_invoice mi ON mi.id = r.invoice_id
+                 WHERE r.order_id IN %s
+              GROUP BY r.order_id
+            ''', (tuple(by_receipt.ids),))
+            receipt_paid = dict(cr.fetchall())
+            # 购货订单上输入预付款时
+            cr.execute('''
+                SELECT buy_id, COALESCE(SUM(amount), 0)
+                  FROM money_order
+                 WHERE buy_id IN %s
+                   AND reconciled = 0
+                   AND state = 'done'
+              GROUP BY buy_id
+            ''', (tuple(by_receipt.ids),))
+            prepaid = dict(cr.fetchall())
+            for order in by_receipt:
+                order.paid_amount = receipt_paid.get(order.id, 0) + prepaid.get(order.id, 0)
 
     @api.depends('receipt_ids')
     def _compute_receipt(self):
@@ -102,10 +133,16 @@ class BuyOrder(models.Model):
 
     @api.depends('receipt_ids')
     def _compute_invoice(self):
+        # 分期付款生成的结算单以订单号为前置单据编号，整批订单一次查出
+        names = [name for name in self.mapped('name') if name]
+        invoice_ids = {}
+        if names:
+            for invoice in self.env['money.invoice'].search_read(
+                    [('name', 'in', names)], ['name']):
+                invoice_ids.setdefault(invoice['name'], []).append(invoice['id'])
         for order in self:
-            money_invoices = self.env['money.invoice'].search([
-                ('name', '=', order.name)])
-            order.invoice_ids = not money_invoices and order.receipt_ids.mapped('invoice_id') or money_invoices + order.receipt_ids.mapped('invoice_id')
+            money_invoices = self.env['money.invoice'].browse(invoice_ids.get(order.name, []))
+            order.invoice_ids = money_invoices + order.receipt_ids.mapped('invoice_id')
             order.invoice_count = len(order.invoice_ids.ids)
 
     @api.depends('partner_id')
@@ -267,8 +304,10 @@ class BuyOrder(models.Model):
     @api.onchange('partner_id')
     def onchange_partner_id(self):
         if self.partner_id:
+            tax_rates = self.env['goods'].get_tax_rates(
+                self.line_ids.mapped('goods_id').ids, self.partner_id, 'buy')
             for line in self.line_ids:
-                line.tax_rate = line.goods_id.get_tax_rate(line.goods_id, self.partner_id, 'buy')
+                line.tax_rate = tax_rates.get(line.goods_id.id)
             self.contact = self.partner_id.main_contact
 
     def _get_vals(self):
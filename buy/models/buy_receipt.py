@@ -1,7 +1,7 @@
 
 from odoo import fields, models, api
 
-from odoo.exceptions import UserError
+from odoo.exceptions import UserError, ValidationError
 import datetime
 from odoo.tools import float_compare, float_is_zero
 
@@ -130,8 +130,10 @@ class BuyReceipt(models.Model):
     @api.onchange('partner_id')
     def onchange_partner_id(self):
         if self.partner_id:
+            tax_rates = self.env['goods'].get_tax_rates(
+                self.line_in_ids.mapped('goods_id').ids, self.partner_id, 'buy')
             for line in self.line_in_ids:
-                line.tax_rate = line.goods_id.get_tax_rate(line.goods_id, self.partner_id, 'buy')
+                line.tax_rate = tax_rates.get(line.goods_id.id)
 
     def get_move_origin(self, vals):
         return self._name + (self.env.context.get('is_return') and
@@ -302,8 +304,8 @@ class BuyReceipt(models.Model):
         })
         return money_order
 
-    def _create_voucher_line(self, account_id, debit, credit, voucher_id, goods_id, goods_qty, partner_id):
-        '''返回voucher line'''
+    def _prepare_voucher_line(self, account_id, debit, credit, goods_id, goods_qty, partner_id):
+        '''返回voucher line的数据'''
         rate_silent = currency_amount = 0
         currency = self.currency_id != self.env.user.company_id.currency_id and self.currency_id.id or False
         if self.currency_id and self.currency_id != self.env.user.company_id.currency_id:
@@ -312,64 +314,91 @@ class BuyReceipt(models.Model):
             currency_amount = debit or credit
             debit = debit * (rate_silent or 1)
             credit = credit * (rate_silent or 1)
-        voucher = self.env['voucher.line'].create({
+        return {
             'name': '%s %s' % (self.name, self.note or ''),
             'account_id': account_id and account_id.id,
             'partner_id': partner_id and partner_id.id,
             'debit': debit,
             'credit': credit,
-            'voucher_id': voucher_id and voucher_id.id,
             'goods_id': goods_id and goods_id.id,
             'goods_qty': goods_qty,
             'currency_id': currency,
             'currency_amount': currency_amount,
             'rate_silent': rate_silent,
-        })
+        }
+
+    def _create_voucher_line(self, account_id, debit, credit, voucher_id, goods_id, goods_qty, partner_id):
+        '''返回voucher line'''
+        vals = self._prepare_voucher_line(account_id, debit, credit, goods_id, goods_qty, partner_id)
+        vals['voucher_id'] = voucher_id and voucher_id.id
+        voucher = self.env['voucher.line'].create(vals)
         return voucher
 
-    def create_voucher(self):
+    def _get_voucher_line_vals(self):
         '''
-        借： 商品分类对应的会计科目 一般是库存商品
-        贷：类型为支出的类别对应的会计科目 一般是材料采购
-
-        当一张入库单有多个商品的时候，按对应科目汇总生成多个借方凭证行。
-
-        采购退货单生成的金额为负
+        入库单/退货单入库凭证的明细行
+        借方按商品逐行生成，贷方为借方合计，退货单金额为负
         '''
         self.ensure_one()
-        vouch_id = self.env['voucher'].create({'date': self.date, 'ref': '%s,%s' % (self._name, self.id)})
-
+        line_vals = []
         sum_amount = 0
         if not self.is_return:
             for line in self.line_in_ids:
                 if line.amount:
                     # 借方明细
-                    self._create_voucher_line(line.goods_id.category_id.account_id,
-                                              line.amount, 0, vouch_id, line.goods_id, line.goods_qty, False)
+                    line_vals.append(self._prepare_voucher_line(
+                        line.goods_id.category_id.account_id, line.amount, 0, line.goods_id, line.goods_qty, False))
                 sum_amount += line.amount
 
             if sum_amount:
                 # 贷方明细
-                self._create_voucher_line(self.buy_move_id.finance_category_id.account_id,
-                                          0, sum_amount, vouch_id, False, 0, self.partner_id)
+                line_vals.append(self._prepare_voucher_line(
+                    self.buy_move_id.finance_category_id.account_id, 0, sum_amount, False, 0, self.partner_id))
         if self.is_return:
             for line in self.line_out_ids:
                 if line.amount:
                     # 借方明细
-                    self._create_voucher_line(line.goods_id.category_id.account_id,
-                                              -line.amount, 0, vouch_id, line.goods_id, line.goods_qty, False)
+                    line_vals.append(self._prepare_voucher_line(
+                        line.goods_id.category_id.account_id, -line.amount, 0, line.goods_id, line.goods_qty, False))
                     sum_amount += line.amount
 
             if sum_amount:
                 # 贷方明细
-                self._create_voucher_line(self.buy_move_id.finance_category_id.account_id,
-                                          0, -sum_amount, vouch_id, False, 0, self.partner_id)
+                line_vals.append(self._prepare_voucher_line(
+                    self.buy_move_id.finance_category_id.account_id, 0, -sum_amount, False, 0, self.partner_id))
+        return line_vals
 
-        if len(vouch_id.line_ids) > 0:
-            vouch_id.voucher_done()
-            return vouch_id
-        else:
-            vouch_id.unlink()
+    def _create_vouchers(self):
+        '''
+        一次创建多张入库单/退货单的入库凭证并确认
+        :return: {入库单id: 凭证}
+        '''
+        vals_list = []
+        record_ids = []
+        for record in self:
+            line_vals = record._get_voucher_line_vals()
+            if line_vals:
+                vals_list.append({
+                    'date': record.date,
+                    'ref': '%s,%s' % (record._name, record.id),
+                    'line_ids': [(0, 0, vals) for vals in line_vals],
+                })
+                record_ids.append(record.id)
+        vouchers = self.env['voucher'].create(vals_list)
+        vouchers.voucher_done()
+        return dict(zip(record_ids, vouchers))
+
+    def create_voucher(self):
+        '''
+        借： 商品分类对应的会计科目 一般是库存商品
+        贷：类型为支出的类别对应的会计科目 一般是材料采购
+
+        当一张入库单有多个商品的时候，按对应科目汇总生成多个借方凭证行。
+
+        采购退货单生成的金额为负
+        '''
+        self.ensure_one()
+        return self._create_vouchers().get(self.id)
 
     def buy_receipt_done(self):
         '''审核采购入库单/退货单，更新本单的付款状态/退款状态，并生成结算单和付款单'''
@@ -409,6 +438,93 @@ class BuyReceipt(models.Model):
                 return True
             return self.order_id.buy_generate_receipt()
 
+    def _check_receipt_done_batch(self, errors):
+        '''
+        批量审核前逐张检查，强制一物一码商品的序列号在本批次内也不能重复
+        :param errors: {单据编号: 错误信息}，不能审核的单据记入其中
+        :return: 可以审核的单据
+        '''
+        batch_one_list = set()
+        todo = self.browse()
+        for record in self:
+            try:
+                record._wrong_receipt_done()
+                lots = set((line.goods_id.id, line.lot) for line in record.line_in_ids
+                           if line.goods_id.force_batch_one)
+                if lots & batch_one_list:
+                    raise UserError('本批次其他入库单已存在相同序列号的商品！\n 序列号列表为%s' %
+                                    [lot[1] for lot in lots & batch_one_list])
+                batch_one_list |= lots
+            except UserError as e:
+                errors[record.name] = e.args and e.args[0] or str(e)
+                continue
+            todo |= record
+        return todo
+
+    def _receipt_done_batch(self):
+        '''
+        整批审核：出入库一次完成，入库凭证一次创建，同一购货订单只生成分单一次
+        '''
+        self.mapped('buy_move_id').approve_order()
+        vouchers = self._create_vouchers()
+        orders = {}
+        for record in self:
+            record._line_qty_write()
+            invoice_id = record._receipt_make_invoice()
+            record._buy_amount_to_invoice()
+            money_order = False
+            if record.payment:
+                flag = not record.is_return and 1 or -1
+                amount = flag * record.amount
+                this_reconcile = flag * record.payment
+                money_order = record._make_payment(invoice_id, amount, this_reconcile)
+
+            voucher = vouchers.get(record.id)
+            record.write({
+                'voucher_id': voucher and voucher.id,
+                'invoice_id': invoice_id and invoice_id.id,
+                'money_order_id': money_order and money_order.id,
+                'state': 'done',
+            })
+            if record.order_id:
+                orders[record.order_id] = record
+
+        for order, record in orders.items():
+            # 生成分拆单，如果已退货也已退款，不生成新的分单
+            if not record.modifying and not (record.is_return and record.payment):
+                order.buy_generate_receipt()
+
+    def buy_receipt_done_batch(self):
+        '''
+        批量审核采购入库单/退货单
+        先整批审核，整批失败时逐张在各自的保存点中审核，出错的单据不影响其他单据
+        :return: {'done': 审核成功的单据, 'errors': {单据编号: 错误信息}}
+        '''
+        errors = {}
+        todo = self._check_receipt_done_batch(errors)
+        done = self.browse()
+        if not todo:
+            return {'done': done, 'errors': errors}
+        try:
+            with self.env.cr.savepoint():
+                todo._receipt_done_batch()
+                self.flush()
+            done = todo
+        except (UserError, ValidationError):
+            self.env.clear()
+            for record in todo:
+                try:
+                    with self.env.cr.savepoint():
+                        record.buy_receipt_done()
+                        self.flush()
+                    if record.state != 'done':
+                        raise UserError('单据未审核，请单独审核该单据')
+                    done |= record
+                except (UserError, ValidationError) as e:
+                    self.env.clear()
+                    errors[record.name] = e.args and e.args[0] or str(e)
+        return {'done': done, 'errors': errors}
+
     def buy_receipt_draft(self):
         '''反审核采购入库单/退货单，更新本单的付款状态/退款状态，并删除生成的结算单、付款单及凭证'''
         self.ensure_one()
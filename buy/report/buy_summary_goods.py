@@ -8,6 +8,8 @@ class BuySummaryGoods(models.Model):
     _name = 'buy.summary.goods'
     _inherit = 'report.base'
     _description = '采购汇总表（按商品）'
+    _order = 'goods_code ASC'
+    _sql_pushdown = True
 
     id_lists = fields.Text('移动明细行id列表')
     goods_categ = fields.Char('商品类别')
@@ -115,10 +117,6 @@ class BuySummaryGoods(models.Model):
             context.get('warehouse_dest_id')[0] or '',
         }
 
-    def _compute_order(self, result, order):
-        order = order or 'goods_code ASC'
-        return super(BuySummaryGoods, self)._compute_order(result, order)
-
     def collect_data_by_sql(self, sql_type='out'):
         collection = self.execute_sql(sql_type='out')
         return collection
@@ -8,6 +8,8 @@ class BuySummaryPartner(models.Model):
     _name = 'buy.summary.partner'
     _inherit = 'report.base'
     _description = '采购汇总表（按供应商）'
+    _order = 'partner ASC'
+    _sql_pushdown = True
 
     id_lists = fields.Text('移动明细行id列表')
     date = fields.Date('日期')
@@ -117,10 +119,6 @@ class BuySummaryPartner(models.Model):
             context.get('warehouse_dest_id')[0] or '',
         }
 
-    def _compute_order(self, result, order):
-        order = order or 'partner ASC'
-        return super(BuySummaryPartner, self)._compute_order(result, order)
-
     def collect_data_by_sql(self, sql_type='out'):
         collection = self.execute_sql(sql_type='out')
 
@@ -39,6 +39,23 @@ class TestBuyOrder(TransactionCase):
         # 生成的发票未核销，已付金额为0
         self.assertTrue(self.order.paid_amount == 0)
 
+    def test_get_paid_amount_batch(self):
+        ''' 测试：多张购货订单一起计算已付金额 '''
+        self.order.buy_order_done()
+        receipt = self.env['buy.receipt'].search([('order_id', '=', self.order.id)])
+        receipt.payment = 1
+        receipt.bank_account_id = self.env.ref('core.comm').id
+        receipt.buy_receipt_done()
+        money = self.env['money.order'].search([('buy_id', '=', self.order.id)])
+        money.money_order_done()
+        order_plan = self.env.ref('buy.buy_order_1_same')
+        order_plan.invoice_by_receipt = False
+        orders = self.order | order_plan
+        orders.invalidate_cache(['paid_amount', 'invoice_ids', 'invoice_count'])
+        self.assertEqual(orders.mapped('paid_amount'), [1, 0])
+        self.assertEqual(orders.mapped('invoice_count'), [1, 0])
+        self.assertEqual(self.order.invoice_ids, receipt.invoice_id)
+
     def test_onchange_discount_rate(self):
         ''' 优惠率改变时，改变优惠金额，成交金额也改变'''
         amount_before = self.order.amount
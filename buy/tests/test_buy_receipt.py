@@ -30,6 +30,19 @@ class TestBuyReceipt(TransactionCase):
         self.receipt.discount_amount = 5
         self.assertTrue(self.receipt.amount == 580)
 
+    def test_buy_receipt_done_batch(self):
+        '''批量审核入库单，出错的单据不影响其他单据'''
+        receipt_2 = self.receipt.copy()
+        receipt_3 = self.receipt.copy()
+        receipt_3.payment = receipt_3.amount + 100
+        receipt_3.bank_account_id = self.bank_account
+        receipts = self.receipt | receipt_2 | receipt_3
+        result = receipts.buy_receipt_done_batch()
+        self.assertEqual(result['done'], self.receipt | receipt_2)
+        self.assertEqual(list(result['errors']), [receipt_3.name])
+        self.assertEqual(set((self.receipt | receipt_2).mapped('state')), {'done'})
+        self.assertEqual(receipt_3.state, 'draft')
+
     def test_get_buy_money_state(self):
         '''测试返回付款状态'''
         self.receipt.buy_receipt_done()
@@ -275,6 +275,15 @@ class TestGoodsWizard(TransactionCase):
         new_results = summary_goods.with_context(new_context).search_read(
             domain=[])
 
+    def test_goods_report_sql_pushdown(self):
+        '''测试采购汇总表（按商品）在数据库中分页、计数'''
+        summary_goods = self.env['buy.summary.goods'].create({})
+        context = self.goods_wizard.button_ok().get('context')
+        summary_goods = summary_goods.with_context(context)
+        results = summary_goods.search_read(domain=[], limit=None)
+        self.assertEqual(summary_goods.search_read(domain=[], limit=1), results[:1])
+        self.assertEqual(summary_goods.search_count([]), len(results))
+
     def test_view_detail(self):
         '''采购汇总表（按商品）  查看明细按钮'''
         # 先创建采购明细表
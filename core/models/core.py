@@ -1,6 +1,6 @@
 
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 from odoo.exceptions import UserError
 
 
@@ -23,19 +23,24 @@ models.BaseModel._read_group_process_groupby = _read_group_process_groupby
 
 
 # 单据自动编号，避免在所有单据对象上重载
+# 编码与模型名相同的 ir.sequence 即为该模型登记的自动编号，
+# 没有登记编号的模型（如凭证行、向导）只做一次缓存查找，不再逐行取序号
 
 create_original = models.BaseModel.create
 
 
-@api.model
+@api.model_create_multi
 @api.returns('self', lambda value: value.id)
-def create(self, vals):
-    if not self._name.split('.')[0] in ['mail', 'ir', 'res'] and not vals.get('name'):
-        next_name = self.env['ir.sequence'].next_by_code(self._name)
-        if next_name:
-            vals.update({'name': next_name})
-    record_id = create_original(self, vals)
-    return record_id
+def create(self, vals_list):
+    if not self._name.split('.')[0] in ['mail', 'ir', 'res']:
+        no_name_vals = [vals for vals in vals_list if not vals.get('name')]
+        if no_name_vals and self.env['ir.sequence'].get_sequence_id_by_code(self._name):
+            next_names = self.env['ir.sequence'].next_by_code_batch(
+                self._name, len(no_name_vals))
+            for vals, next_name in zip(no_name_vals, next_names):
+                if next_name:
+                    vals.update({'name': next_name})
+    return create_original(self, vals_list)
 
 
 models.BaseModel.create = create
@@ -47,17 +52,64 @@ unlink_original = models.BaseModel.unlink
 
 
 def unlink(self):
-    for record in self:
-        if 'state' in [item[0] for item in record._fields.items()]:
-            if record.state == 'done':
-                raise UserError('不能删除已确认的单据！')
+    if 'state' in self._fields and 'done' in self.mapped('state'):
+        raise UserError('不能删除已确认的单据！')
 
-        unlink_original(record)
+    return unlink_original(self)
 
 
 models.BaseModel.unlink = unlink
 
 
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @tools.ormcache('code', 'company_id')
+    def _get_sequence_id_by_code(self, code, company_id):
+        '''缓存编码到序列的对应关系，优先取当前公司的序列'''
+        seq = self.sudo().search([('code', '=', code),
+                                  ('company_id', 'in', [company_id, False])],
+                                 order='company_id', limit=1)
+        return seq.id or False
+
+    @api.model
+    def get_sequence_id_by_code(self, code):
+        return self._get_sequence_id_by_code(code, self.env.company.id)
+
+    @api.model
+    def next_by_code_batch(self, sequence_code, count, sequence_date=None):
+        '''
+        一次取 count 个序号，返回序号列表，找不到序列时返回 [False, ...]
+        普通序列用一条 nextval 语句取出所有序号，其他情况逐个调用 _next
+        '''
+        self.check_access_rights('read')
+        seq_id = self.get_sequence_id_by_code(sequence_code)
+        if not seq_id or count <= 0:
+            return [False] * count
+        seq = self.browse(seq_id)
+        if seq.implementation == 'standard' and not seq.use_date_range:
+            self.env.cr.execute(
+                "SELECT nextval('ir_sequence_%03d') FROM generate_series(1, %%s)" % seq.id,
+                (count,))
+            return [seq.get_next_char(number_next)
+                    for number_next, in self.env.cr.fetchall()]
+        return [seq._next(sequence_date=sequence_date) for _ in range(count)]
+
+    @api.model
+    def create(self, values):
+        self.clear_caches()
+        return super(IrSequence, self).create(values)
+
+    def write(self, values):
+        if 'code' in values or 'company_id' in values or 'active' in values:
+            self.clear_caches()
+        return super(IrSequence, self).write(values)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(IrSequence, self).unlink()
+
+
 class BaseModelExtend(models.AbstractModel):
     _name = 'basemodel.extend'
     _description = 'extend base model'
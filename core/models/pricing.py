@@ -1,5 +1,8 @@
 
-from odoo import api, fields, models
+import bisect
+from datetime import datetime
+
+from odoo import api, fields, models, tools
 from odoo.exceptions import UserError
 
 
@@ -132,6 +135,95 @@ class Pricing(models.Model):
                     'message': message})
         return res
 
+    def get_condition_keys(self, partner, warehouse, goods):
+        """
+        返回与 get_condition 顺序一致的索引键
+        :return: [(客户类别, 仓库, 商品, 商品类别), ...]
+        """
+        c_category = partner.c_category_id.id or False
+        goods_category = goods.category_id.id or False
+        return [
+            (c_category, warehouse.id, goods.id, False),
+            (c_category, warehouse.id, False, goods_category),
+            (c_category, warehouse.id, False, False),
+            (False, warehouse.id, goods.id, False),
+            (False, warehouse.id, False, goods_category),
+            (False, warehouse.id, False, False),
+            (c_category, False, goods.id, False),
+            (c_category, False, False, goods_category),
+            (c_category, False, False, False),
+            (False, False, False, False),
+        ]
+
+    @tools.ormcache('company_id')
+    def _get_pricing_index(self, company_id):
+        """
+        按公司构建启用的价格策略索引
+        :return: {(客户类别, 仓库, 商品, 商品类别): (开始日期列表, [(开始日期, 终止日期, 策略id)])}
+        索引中的记录按开始日期排序，取数时先二分找到开始日期不晚于指定日期的记录，再比较终止日期
+        """
+        self.env.cr.execute("""
+            SELECT id, c_category_id, warehouse_id, goods_id, goods_category_id,
+                   active_date, deactive_date
+            FROM pricing
+            WHERE active = TRUE
+              AND (company_id = %s OR company_id IS NULL)
+            ORDER BY active_date, id
+        """, (company_id,))
+        buckets = {}
+        for (pricing_id, c_category_id, warehouse_id, goods_id, goods_category_id,
+             active_date, deactive_date) in self.env.cr.fetchall():
+            key = (c_category_id or False, warehouse_id or False,
+                   goods_id or False, goods_category_id or False)
+            buckets.setdefault(key, []).append(
+                (active_date, deactive_date, pricing_id))
+        return {key: (tuple(row[0] for row in rows), tuple(rows))
+                for key, rows in buckets.items()}
+
+    def _to_pricing_date(self, date):
+        '''将传入的日期统一转换为 date 类型，支持 20160101 这种整数写法'''
+        if not date:
+            return False
+        if isinstance(date, int):
+            return datetime.strptime(str(date), '%Y%m%d').date()
+        return fields.Date.to_date(date)
+
+    def _lookup_pricing_ids(self, index, key, date):
+        '''在索引中找出指定键下有效期包含 date 的价格策略 id'''
+        bucket = index.get(key)
+        if not bucket:
+            return []
+        starts, rows = bucket
+        pos = bisect.bisect_right(starts, date)
+        return [pricing_id for active_date, deactive_date, pricing_id in rows[:pos]
+                if deactive_date >= date]
+
+    def _resolve_pricing(self, index, partner, warehouse, goods, date):
+        '''按优先级在索引中查找价格策略，返回策略 id 或 False'''
+        date = self._to_pricing_date(date)
+        if not date:
+            return False
+        keys = self.get_condition_keys(partner, warehouse, goods)
+        for i, key in enumerate(keys):
+            pricing_ids = self._lookup_pricing_ids(index, key, date)
+            if len(pricing_ids) == 1:
+                return pricing_ids[0]
+            if len(pricing_ids) > 1:
+                args = {'partner': partner,
+                        'warehouse': warehouse,
+                        'goods': goods,
+                        'date': date}
+                raise UserError(self.get_condition(args)[i]['message'])
+        return False
+
+    def _check_pricing_args(self, partner, warehouse, goods):
+        if not partner:
+            raise UserError('请先输入客户')
+        if not warehouse:
+            raise UserError('请先输入仓库')
+        if not goods:
+            raise UserError('请先输入商品')
+
     @api.model
     def get_pricing_id(self, partner, warehouse, goods, date):
         '''传入客户，仓库，商品，日期，返回合适的价格策略，如果找到两条以上符合的规则，则报错
@@ -147,30 +239,49 @@ class Pricing(models.Model):
         10. 所有商品
         11. 可能还是找不到有效期内的，返回 False
         '''
-        if not partner:
-            raise UserError('请先输入客户')
-        if not warehouse:
-            raise UserError('请先输入仓库')
-        if not goods:
-            raise UserError('请先输入商品')
-        args = {'partner': partner,
-                'warehouse': warehouse,
-                'goods': goods,
-                'date': date}
-        res = self.get_condition(args)
-
-        sum = 0
-        for value in res:
-            Pricing = self.search(value['domain'])
-            sum += len(Pricing)
-            if len(Pricing) == 1:
-                return Pricing
-            if len(Pricing) > 1:
-                raise UserError(value['message'])
-
+        self._check_pricing_args(partner, warehouse, goods)
+        self.flush()
+        index = self._get_pricing_index(self.env.company.id)
+        pricing_id = self._resolve_pricing(index, partner, warehouse, goods, date)
         # 如果日期范围内没有适用的价格策略，则返回空
-        if sum == 0:
-            return False
+        return pricing_id and self.browse(pricing_id) or False
+
+    @api.model
+    def get_pricing_ids(self, items):
+        '''批量取价格策略
+        :param items: [(客户, 仓库, 商品, 日期), ...]
+        :return: 与 items 顺序一致的价格策略列表，找不到的位置为 False
+        '''
+        self.flush()
+        index = self._get_pricing_index(self.env.company.id)
+        res = []
+        for partner, warehouse, goods, date in items:
+            self._check_pricing_args(partner, warehouse, goods)
+            pricing_id = self._resolve_pricing(
+                index, partner, warehouse, goods, date)
+            res.append(pricing_id and self.browse(pricing_id) or False)
+        return res
+
+    @api.model
+    def get_discount_rates(self, items):
+        '''批量取折扣率，找不到价格策略时折扣率为 0
+        :param items: [(客户, 仓库, 商品, 日期), ...]
+        '''
+        return [pricing and pricing.discount_rate or 0
+                for pricing in self.get_pricing_ids(items)]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(Pricing, self).create(vals_list)
+
+    def write(self, vals):
+        self.clear_caches()
+        return super(Pricing, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(Pricing, self).unlink()
 
     name = fields.Char('描述', help='描述!')
     warehouse_id = fields.Many2one('warehouse',
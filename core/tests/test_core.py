@@ -121,3 +121,32 @@ class TestResCompany(TransactionCase):
         # 邮箱格式不正确，报错
         with self.assertRaises(UserError):
             company.email = 'gooderp'
+
+
+class TestAutoName(TransactionCase):
+
+    def test_create_batch_name(self):
+        ''' 登记了自动编号的模型批量创建时一次取出所有编号 '''
+        self.env['ir.sequence'].create({
+            'name': '可选值',
+            'code': 'core.value',
+            'prefix': 'CV',
+            'padding': 3,
+        })
+        values = self.env['core.value'].create([
+            {'type': 'goods_brand'},
+            {'type': 'goods_brand'},
+            {'type': 'goods_brand', 'name': 'keep'},
+        ])
+        self.assertEqual(len(set(values.mapped('name'))), 3)
+        self.assertTrue(values[0].name.startswith('CV'))
+        self.assertEqual(values[2].name, 'keep')
+        self.assertEqual(
+            len(self.env['ir.sequence'].next_by_code_batch('core.value', 2)), 2)
+
+        # 未登记编号的模型不取编号
+        self.assertFalse(
+            self.env['ir.sequence'].get_sequence_id_by_code('core.category'))
+        self.assertEqual(
+            self.env['ir.sequence'].next_by_code_batch('core.category', 2),
+            [False, False])
@@ -73,30 +73,139 @@ class CreateBalanceSheetWizard(models.TransientModel):
     period_id = fields.Many2one('finance.period', string='会计期间', domain=_default_period_domain,
                                 default=_default_period_id, help='用来设定报表的期间')
 
-    def compute_balance(self, parameter_str, period_id, compute_field_list):
-        """根据所填写的 科目的code 和计算的字段 进行计算对应的资产值"""
-        if parameter_str:
-            parameter_str_list = parameter_str.split('~')
-            subject_vals = []
-            if len(parameter_str_list) == 1:
-                subject_ids = self.env['finance.account'].search(
-                    [('code', '=', parameter_str_list[0]), ('account_type', '!=', 'view')])
+    def _get_formula_accounts(self):
+        """一次取出所有非视图科目，供公式编译使用 {科目id: 科目信息}"""
+        return {account['id']: account for account in self.env['finance.account'].search_read(
+            [('account_type', '!=', 'view')], ['code', 'costs_types', 'balance_directions'])}
+
+    def _compile_formula_term(self, term, accounts, compiled):
+        """
+        把一段科目范围（如 1001~1012999999 或 1001）编译为科目id列表，
+        同一段公式只编译一次
+        """
+        if term not in compiled:
+            term_list = term.split('~')
+            if len(term_list) == 1:
+                compiled[term] = [account_id for account_id, account in accounts.items()
+                                  if account['code'] == term_list[0]]
             else:
-                subject_ids = self.env['finance.account'].search(
-                    [('code', '>=', parameter_str_list[0]), ('code', '<=', parameter_str_list[1]),
-                     ('account_type', '!=', 'view')])
-            trial_balances = self.env['trial.balance'].search([('subject_name_id', 'in', [
-                subject.id for subject in subject_ids]), ('period_id', '=', period_id.id)])
-            for trial_balance in trial_balances:
+                compiled[term] = [account_id for account_id, account in accounts.items()
+                                  if term_list[0] <= (account['code'] or '') <= term_list[1]]
+        return compiled[term]
+
+    def _compile_formula(self, formula, accounts, compiled):
+        """把以 ; 分隔的公式编译为各段的科目id列表"""
+        if not formula:
+            return []
+        return [self._compile_formula_term(term, accounts, compiled)
+                for term in formula.split(';') if term]
+
+    def _load_formula_trial_balances(self, periods, account_ids):
+        """一次取出各期间公式引用到的科目余额表 {(期间id, 科目id): 科目余额表行}"""
+        res = {}
+        if not account_ids:
+            return res
+        for trial_balance in self.env['trial.balance'].search_read(
+                [('period_id', 'in', periods.ids),
+                 ('subject_name_id', 'in', list(account_ids))],
+                ['period_id', 'subject_name_id',
+                 'year_init_debit', 'year_init_credit',
+                 'ending_balance_debit', 'ending_balance_credit',
+                 'cumulative_occurrence_debit', 'cumulative_occurrence_credit',
+                 'current_occurrence_debit', 'current_occurrence_credit']):
+            res.setdefault((trial_balance['period_id'][0],
+                            trial_balance['subject_name_id'][0]), []).append(trial_balance)
+        return res
+
+    def _eval_balance_term(self, account_ids, accounts, trial_balances, period_id, compute_field_list):
+        """根据科目的类别计算一段科目范围的资产负债表金额"""
+        subject_vals = []
+        for account_id in account_ids:
+            costs_types = accounts[account_id]['costs_types']
+            for trial_balance in trial_balances.get((period_id, account_id), []):
                 # 根据参数code 对应的科目的 方向 进行不同的操作
-                #  trial_balance.subject_name_id.costs_types == 'assets'解决：累计折旧 余额记贷方
-                if trial_balance.subject_name_id.costs_types == 'assets' or trial_balance.subject_name_id.costs_types == 'cost':
+                #  costs_types == 'assets'解决：累计折旧 余额记贷方
+                if costs_types in ('assets', 'cost'):
                     subject_vals.append(
                         trial_balance[compute_field_list[0]] - trial_balance[compute_field_list[1]])
-                elif trial_balance.subject_name_id.costs_types == 'debt' or trial_balance.subject_name_id.costs_types == 'equity':
+                elif costs_types in ('debt', 'equity'):
                     subject_vals.append(
                         trial_balance[compute_field_list[1]] - trial_balance[compute_field_list[0]])
-            return sum(subject_vals)
+        return sum(subject_vals)
+
+    def _eval_profit_term(self, account_ids, accounts, trial_balances, period_id, compute_field_list):
+        """根据科目的借贷方向计算一段科目范围的利润表金额"""
+        directions = {accounts[account_id]['balance_directions'] for account_id in account_ids}
+        subject_vals_in = []
+        subject_vals_out = []
+        for account_id in account_ids:
+            direction = accounts[account_id]['balance_directions']
+            for trial_balance in trial_balances.get((period_id, account_id), []):
+                if direction == 'in':
+                    subject_vals_in.append(trial_balance[compute_field_list[0]])
+                elif direction == 'out':
+                    subject_vals_out.append(trial_balance[compute_field_list[1]])
+        if 'in' in directions and 'out' in directions:  # 方向有借且有贷
+            return sum(subject_vals_out) - sum(subject_vals_in)
+        if subject_vals_in:
+            return sum(subject_vals_in)
+        return sum(subject_vals_out)
+
+    def compute_statement_values(self, periods):
+        """
+        资产负债表和利润表模板的公式只编译一次，科目余额表按期间一次取出，在内存中计算所有行
+        :param periods: 需要计算的期间，多个期间可以一次算出
+        :return: {'balance.sheet': {期间id: {模板行id: 值}}, 'profit.statement': {...}}
+        """
+        accounts = self._get_formula_accounts()
+        compiled = {}
+        balance_lines = self.env['balance.sheet'].search([])
+        profit_lines = self.env['profit.statement'].search([])
+        balance_formulas = {line.id: (self._compile_formula(line.balance_formula, accounts, compiled),
+                                      self._compile_formula(line.balance_two_formula, accounts, compiled))
+                            for line in balance_lines}
+        profit_formulas = {line.id: self._compile_formula(line.occurrence_balance_formula, accounts, compiled)
+                           for line in profit_lines}
+        account_ids = set()
+        for account_list in compiled.values():
+            account_ids.update(account_list)
+        trial_balances = self._load_formula_trial_balances(periods, account_ids)
+
+        year_begain_field = ['year_init_debit', 'year_init_credit']
+        current_period_field = ['ending_balance_debit', 'ending_balance_credit']
+        profit_year_field = ['cumulative_occurrence_debit', 'cumulative_occurrence_credit']
+        profit_current_field = ['current_occurrence_debit', 'current_occurrence_credit']
+        res = {'balance.sheet': {}, 'profit.statement': {}}
+        for period in periods:
+            def balance(terms, fields):
+                return sum(self._eval_balance_term(term, accounts, trial_balances, period.id, fields)
+                           for term in terms)
+
+            def profit(terms, fields):
+                return sum(self._eval_profit_term(term, accounts, trial_balances, period.id, fields)
+                           for term in terms)
+
+            res['balance.sheet'][period.id] = {
+                line_id: {'beginning_balance': balance(terms, year_begain_field),
+                          'ending_balance': balance(terms, current_period_field),
+                          'beginning_balance_two': balance(terms_two, year_begain_field),
+                          'ending_balance_two': balance(terms_two, current_period_field)}
+                for line_id, (terms, terms_two) in balance_formulas.items()}
+            res['profit.statement'][period.id] = {
+                line_id: {'cumulative_occurrence_balance': profit(terms, profit_year_field),
+                          'current_occurrence_balance': profit(terms, profit_current_field)}
+                for line_id, terms in profit_formulas.items()}
+        return res
+
+    def compute_balance(self, parameter_str, period_id, compute_field_list):
+        """根据所填写的 科目的code 和计算的字段 进行计算对应的资产值"""
+        if parameter_str:
+            accounts = self._get_formula_accounts()
+            account_ids = self._compile_formula_term(parameter_str, accounts, {})
+            trial_balances = self._load_formula_trial_balances(period_id, account_ids)
+            return self._eval_balance_term(account_ids, accounts, trial_balances,
+                                           period_id.id, compute_field_list)
+        return 0
 
     def deal_with_balance_formula(self, balance_formula, period_id, year_begain_field):
         if balance_formula:
@@ -106,16 +215,9 @@ class CreateBalanceSheetWizard(models.TransientModel):
             return_vals = 0
         return return_vals
 
-    def balance_sheet_create(self, balance_sheet_obj, year_begain_field, current_period_field):
-        balance_sheet_obj.write(
-            {'beginning_balance': self.deal_with_balance_formula(balance_sheet_obj.balance_formula,
-                                                                      self.period_id, year_begain_field),
-             'ending_balance': self.deal_with_balance_formula(balance_sheet_obj.balance_formula,
-                                                                   self.period_id, current_period_field),
-             'beginning_balance_two': self.deal_with_balance_formula(balance_sheet_obj.balance_two_formula,
-                                                                     self.period_id, year_begain_field),
-             'ending_balance_two': self.deal_with_balance_formula(balance_sheet_obj.balance_two_formula,
-                                                                  self.period_id, current_period_field)})
+    def _write_statement_values(self, model, period_values):
+        for line in self.env[model].search([]):
+            line.write(period_values.get(line.id, {}))
 
     def create_balance_sheet(self):
         """ 资产负债表的创建 """
@@ -123,13 +225,9 @@ class CreateBalanceSheetWizard(models.TransientModel):
             {'period_id': self.period_id.id})
         balance_wizard.create_trial_balance()
         view_id = self.env.ref('finance.balance_sheet_tree_wizard').id
+        values = self.compute_statement_values(self.period_id)
+        self._write_statement_values('balance.sheet', values['balance.sheet'][self.period_id.id])
         balance_sheet_objs = self.env['balance.sheet'].search([])
-        year_begain_field = ['year_init_debit', 'year_init_credit']
-        current_period_field = [
-            'ending_balance_debit', 'ending_balance_credit']
-        for balance_sheet_obj in balance_sheet_objs:
-            self.balance_sheet_create(
-                balance_sheet_obj, year_begain_field, current_period_field)
         force_company = self._context.get('force_company')
         if not force_company:
             force_company = self.env.user.company_id.id
@@ -169,23 +267,13 @@ class CreateBalanceSheetWizard(models.TransientModel):
             {'period_id': self.period_id.id})
         balance_wizard.create_trial_balance()
         view_id = self.env.ref('finance.profit_statement_tree').id
+        values = self.compute_statement_values(self.period_id)
+        self._write_statement_values('profit.statement', values['profit.statement'][self.period_id.id])
         balance_sheet_objs = self.env['profit.statement'].search([])
-        year_begain_field = ['cumulative_occurrence_debit',
-                             'cumulative_occurrence_credit']
-        current_period_field = [
-            'current_occurrence_debit', 'current_occurrence_credit']
-        for balance_sheet_obj in balance_sheet_objs:
-            balance_sheet_obj.write({'cumulative_occurrence_balance': self.deal_with_profit_formula(
-                balance_sheet_obj.occurrence_balance_formula, self.period_id, year_begain_field),
-                'current_occurrence_balance': self.compute_profit(
-                    balance_sheet_obj.occurrence_balance_formula, self.period_id,
-                    current_period_field)})
         force_company = self._context.get('force_company')
         if not force_company:
             force_company = self.env.user.company_id.id
         company_row = self.env['res.company'].browse(force_company)
-        days = calendar.monthrange(
-            int(self.period_id.year), int(self.period_id.month))[1]
         attachment_information = '编制单位：' + company_row.name + ',' + self.period_id.year \
                                  + '年' + self.period_id.month + '月' + ',' + '单位：元'
         domain = [('id', 'in', [balance_sheet_obj.id for balance_sheet_obj in balance_sheet_objs])]
@@ -205,40 +293,12 @@ class CreateBalanceSheetWizard(models.TransientModel):
     def compute_profit(self, parameter_str, period_id, compute_field_list):
         """ 根据传进来的 的科目的code 进行利润表的计算 """
         if parameter_str:
-            parameter_str_list = parameter_str.split('~')
-            subject_vals_in = []
-            subject_vals_out = []
-            total_sum = 0
-            sign_in = False
-            sign_out = False
-            if len(parameter_str_list) == 1:
-                subject_ids = self.env['finance.account'].search(
-                    [('code', '=', parameter_str_list[0]), ('account_type', '!=', 'view')])
-            else:
-                subject_ids = self.env['finance.account'].search(
-                    [('code', '>=', parameter_str_list[0]), ('code', '<=', parameter_str_list[1]),
-                     ('account_type', '!=', 'view')])
-            if subject_ids:  # 本行计算科目借贷方向
-                for line in subject_ids:
-                    if line.balance_directions == 'in':
-                        sign_in = True
-                    if line.balance_directions == 'out':
-                        sign_out = True
-            trial_balances = self.env['trial.balance'].search([('subject_name_id', 'in', [
-                subject.id for subject in subject_ids]), ('period_id', '=', period_id.id)])
-            for trial_balance in trial_balances:
-                if trial_balance.subject_name_id.balance_directions == 'in':
-                    subject_vals_in.append(trial_balance[compute_field_list[0]])
-                elif trial_balance.subject_name_id.balance_directions == 'out':
-                    subject_vals_out.append(trial_balance[compute_field_list[1]])
-                if sign_out and sign_in:  # 方向有借且有贷
-                    total_sum = sum(subject_vals_out) - sum(subject_vals_in)
-                else:
-                    if subject_vals_in:
-                        total_sum = sum(subject_vals_in)
-                    else:
-                        total_sum = sum(subject_vals_out)
-            return total_sum
+            accounts = self._get_formula_accounts()
+            account_ids = self._compile_formula_term(parameter_str, accounts, {})
+            trial_balances = self._load_formula_trial_balances(period_id, account_ids)
+            return self._eval_profit_term(account_ids, accounts, trial_balances,
+                                          period_id.id, compute_field_list)
+        return 0
 
 
 class ProfitStatement(models.Model):
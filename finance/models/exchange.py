@@ -1,15 +1,111 @@
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 from odoo.exceptions import UserError
 
+# 取币别在某日期(含)之前最近一条汇率，公司专属汇率优先于通用汇率，没有汇率时为 1.0
+RATE_QUERY = """
+    SELECT q.currency_id, q.date,
+           COALESCE((SELECT r.rate FROM res_currency_rate r
+                      WHERE r.currency_id = q.currency_id
+                        AND r.name <= q.date
+                        AND (r.company_id IS NULL OR r.company_id = %s)
+                   ORDER BY r.company_id, r.name DESC
+                      LIMIT 1), 1.0)
+      FROM unnest(%s::int[], %s::date[]) AS q(currency_id, date)
+"""
+
 
 class Currency(models.Model):
     _inherit = 'res.currency'
 
+    def _query_rates(self, company_id, keys):
+        '''
+        一条 SQL 取出多个 (币别id, 日期) 的汇率
+        :return: {(币别id, 日期): 汇率}
+        '''
+        self.env['res.currency.rate'].flush(
+            ['rate', 'name', 'currency_id', 'company_id'])
+        self.env.cr.execute(RATE_QUERY, (company_id,
+                                         [currency_id for currency_id, date in keys],
+                                         [date for currency_id, date in keys]))
+        return {(currency_id, date): rate
+                for currency_id, date, rate in self.env.cr.fetchall()}
+
+    @tools.ormcache('company_id', 'currency_id', 'date')
+    def _get_rate(self, company_id, currency_id, date):
+        '''缓存 (公司, 币别, 日期) 的汇率，res.currency.rate 变动时清空'''
+        return self._query_rates(company_id, [(currency_id, date)])[(currency_id, date)]
+
+    @api.model
+    def get_rates_silent(self, pairs):
+        '''
+        批量取汇率，所有 (币别, 日期) 只查一次库
+        :param pairs: [(日期, 币别id), ...]，日期为空时取今天
+        :return: {(币别id, 日期): 汇率}，取该日期(含)之前最近一条 res.currency.rate 上的汇率，
+                 公司专属汇率优先于通用汇率，没有汇率时为 1.0；币别为空时为 0
+        '''
+        today = fields.Date.context_today(self)
+        res = {}
+        keys = set()
+        for date, currency_id in pairs:
+            date = fields.Date.to_date(date) or today
+            if currency_id:
+                keys.add((currency_id, date))
+            else:
+                res[(currency_id, date)] = 0
+        if keys:
+            res.update(self._query_rates(self.env.company.id, sorted(keys)))
+        return res
+
+    @api.model
     def get_rate_silent(self, date, currency_id):
-        currency = self.env['res.currency'].search([('id', '=', currency_id)])
-        rate = currency.rate
-        return rate
+        '''取币别在某日期的汇率，同一币别同一日期只查一次库'''
+        if not currency_id:
+            return 0
+        date = fields.Date.to_date(date) or fields.Date.context_today(self)
+        if getattr(self.env.cr, '_currency_rate_dirty', False):
+            # 本事务改过汇率，改动可能随保存点回滚，不能读写跨事务的缓存
+            return self._query_rates(self.env.company.id, [(currency_id, date)])[(currency_id, date)]
+        return self._get_rate(self.env.company.id, currency_id, date)
+
+
+class CurrencyRate(models.Model):
+    _inherit = 'res.currency.rate'
+
+    def _invalidate_rate_cache(self):
+        '''
+        汇率变动时清空汇率缓存，并在本事务提交或回滚前不再使用缓存
+        提交后再清空一次，丢弃其他事务在此期间缓存的旧汇率
+        '''
+        currency_obj = self.env['res.currency']
+        currency_obj.clear_caches()
+        cr = self.env.cr
+        if getattr(cr, '_currency_rate_dirty', False):
+            return
+
+        def on_commit():
+            cr._currency_rate_dirty = False
+            currency_obj.clear_caches()
+
+        def on_rollback():
+            cr._currency_rate_dirty = False
+
+        cr._currency_rate_dirty = True
+        cr.after('commit', on_commit)
+        cr.after('rollback', on_rollback)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self._invalidate_rate_cache()
+        return super(CurrencyRate, self).create(vals_list)
+
+    def write(self, vals):
+        self._invalidate_rate_cache()
+        return super(CurrencyRate, self).write(vals)
+
+    def unlink(self):
+        self._invalidate_rate_cache()
+        return super(CurrencyRate, self).unlink()
 
 
 class CreateExchangeWizard(models.TransientModel):
@@ -170,12 +266,16 @@ class CreateExchangeWizard(models.TransientModel):
         vouch_obj = self.env['voucher'].create({'date': self.date})
         '''只有外币＋期末需要调汇的科目才会能生成调汇凭证的明细行'''
         vals = {}
-        for account_id in self.env['finance.account'].search([
+        accounts = self.env['finance.account'].search([
             ('currency_id', '!=', self.env.user.company_id.currency_id.id),
             ('currency_id', '!=', False),
-                ('exchange', '=', True)]):
-            rate_silent = self.env['res.currency'].get_rate_silent(
-                self.date, account_id.currency_id.id) or 0
+            ('exchange', '=', True)])
+        # 一次取出所有调汇科目币别在记账日期的汇率
+        rates = self.env['res.currency'].get_rates_silent(
+            [(self.date, currency_id) for currency_id in accounts.mapped('currency_id').ids])
+        for account_id in accounts:
+            rate_silent = rates.get(
+                (account_id.currency_id.id, self.date)) or 0
             vals.update({'account_id': account_id.id,
                          'account': account_id,
                          'vouch_obj_id': vouch_obj.id,
@@ -124,6 +124,7 @@ class Voucher(models.Model):
 
             v.state = 'done'
             if v.is_checkout:   # 月结凭证不做反转
+                self.env['finance.account.balance'].update_balance(v.line_ids)
                 return True
             for line in v.line_ids:
                 if line.account_id.costs_types == 'out' and line.credit:
@@ -134,6 +135,8 @@ class Voucher(models.Model):
                     # 收入类科目只能在贷方记账,比如退款给客户的情况
                     line.credit = -line.debit
                     line.debit = 0
+            # 科目期间发生额按凭证行增量更新
+            self.env['finance.account.balance'].update_balance(v.line_ids)
 
     def voucher_can_be_draft(self):
         for v in self:
@@ -149,6 +152,7 @@ class Voucher(models.Model):
                 raise UserError('%s期 会计期间已结账！不能撤销确认' % v.period_id.name)
 
             v.state = 'draft'
+            self.env['finance.account.balance'].update_balance(v.line_ids, sign=-1)
 
     @api.depends('line_ids')
     def _compute_amount(self):
@@ -550,62 +554,24 @@ class FinanceAccount(models.Model):
     def compute_balance(self):
         """
         计算会计科目的当前余额
+        上级科目按下级科目汇总，均取自科目期间发生额
         :return:
         """
+        balances = self.env['finance.account.balance'].get_account_balance(
+            self.filtered(lambda a: isinstance(a.id, int)))
         for record in self:
-            # 上级科目按下级科目汇总 
-            if record.account_type == 'view':
-                lines = self.env['voucher.line'].search(
-                    [('account_id', 'child_of', record.id),
-                     ('voucher_id.state', '=', 'done')])
-                record.debit = sum((line.debit ) for line in lines)
-                record.credit = sum((line.credit ) for line in lines)
-                record.balance = record.debit - record.credit
-
-            # 下级科目按记账凭证计算
-            else:
-                record.debit = sum(record.voucher_line_ids.filtered(lambda self: self.state == 'done').mapped('debit'))
-                record.credit = sum(record.voucher_line_ids.filtered(lambda self: self.state == 'done').mapped('credit'))
-                record.balance = record.debit - record.credit
+            record.debit, record.credit = balances.get(record.id, (0, 0))
+            record.balance = record.debit - record.credit
 
     
     def get_balance(self, period_id=False):
         ''' 科目当前或某期间的借方、贷方、差额 '''
         self.ensure_one()
-        domain =[]
-        data = {}
-        period = self.env['finance.period']
-        if period_id :
-            domain.append( ('period_id', '=', period_id))
-
-
-        if self.account_type == 'view':
-            domain.extend([('account_id', 'child_of', self.id), ('voucher_id.state', '=', 'done')])
-            lines = self.env['voucher.line'].search(domain) 
-
-            debit = sum((line.debit ) for line in lines)
-            credit = sum((line.credit ) for line in lines)
-            balance = self.debit - self.credit
-
-            data.update( {'debit': debit, 'credit':credit , 'balance':balance})
-
-        # 下级科目按记账凭证计算
-        else:
-            if period_id:
-                period = self.env['finance.period'].browse(period_id)
-
-            if period:
-                debit = sum(self.voucher_line_ids.filtered(lambda self: self.period_id==period and self.state == 'done').mapped('debit'))
-                credit = sum(self.voucher_line_ids.filtered(lambda self: self.period_id==period and self.state == 'done').mapped('credit'))
-                balance = self.debit - self.credit
-            else:
-                debit = sum(self.voucher_line_ids.filtered(lambda self: self.state == 'done').mapped('debit'))
-                credit = sum(self.voucher_line_ids.filtered(lambda self: self.state == 'done').mapped('credit'))
-                balance = self.debit - self.credit
+        debit, credit = self.env['finance.account.balance'].get_account_balance(
+            self, period_id).get(self.id, (0, 0))
+        balance = self.debit - self.credit
 
-            data.update( {'debit': debit, 'credit':credit , 'balance':balance})
-
-        return data
+        return {'debit': debit, 'credit': credit, 'balance': balance}
 
     name = fields.Char('名称', required="1")
     code = fields.Char('编码', required="1")
@@ -786,6 +752,104 @@ class FinanceAccount(models.Model):
             'context': dict(self.env.context, active_id=self.id, active_ids=[self.id], modify_from_webclient=False),
         }
 
+class FinanceAccountBalance(models.Model):
+    '''科目期间发生额，凭证确认、撤销确认时增量更新'''
+    _name = 'finance.account.balance'
+    _description = '科目期间发生额'
+
+    account_id = fields.Many2one('finance.account', '会计科目', required=True,
+                                 index=True, ondelete='cascade', readonly=True)
+    period_id = fields.Many2one('finance.period', '会计期间', required=True,
+                                index=True, ondelete='cascade', readonly=True)
+    debit = fields.Float('借方', digits='Amount', readonly=True)
+    credit = fields.Float('贷方', digits='Amount', readonly=True)
+
+    _sql_constraints = [
+        ('account_period_uniq', 'unique(account_id, period_id)', '科目期间发生额不能重复'),
+    ]
+
+    def init(self):
+        self._cr.execute('SELECT 1 FROM finance_account_balance LIMIT 1')
+        if not self._cr.fetchone():
+            self.rebuild_balance()
+
+    @api.model
+    def update_balance(self, lines, sign=1):
+        '''
+        按 科目、期间 累加凭证行的借贷方金额
+        :param lines: 凭证行
+        :param sign: 1 凭证确认，-1 凭证撤销确认
+        '''
+        totals = {}
+        for line in lines:
+            key = (line.account_id.id, line.voucher_id.period_id.id)
+            total = totals.setdefault(key, [0, 0])
+            total[0] += sign * line.debit
+            total[1] += sign * line.credit
+        for (account_id, period_id), (debit, credit) in totals.items():
+            if not account_id or not period_id:
+                continue
+            self.env.cr.execute('''
+                INSERT INTO finance_account_balance
+                    (account_id, period_id, debit, credit, create_uid,
+                     create_date, write_uid, write_date)
+                VALUES (%s, %s, %s, %s, %s, now() at time zone 'UTC',
+                        %s, now() at time zone 'UTC')
+                ON CONFLICT (account_id, period_id)
+                DO UPDATE SET debit = finance_account_balance.debit + EXCLUDED.debit,
+                              credit = finance_account_balance.credit + EXCLUDED.credit,
+                              write_uid = EXCLUDED.write_uid,
+                              write_date = EXCLUDED.write_date
+            ''', (account_id, period_id, debit, credit, self.env.uid, self.env.uid))
+        if totals:
+            self.invalidate_cache()
+
+    @api.model
+    def rebuild_balance(self):
+        ''' 根据已确认凭证的凭证行重建科目期间发生额 '''
+        self.env['voucher.line'].flush()
+        self.env.cr.execute('DELETE FROM finance_account_balance')
+        self.env.cr.execute('''
+            INSERT INTO finance_account_balance
+                (account_id, period_id, debit, credit, create_uid,
+                 create_date, write_uid, write_date)
+            SELECT vol.account_id, vo.period_id,
+                   sum(vol.debit), sum(vol.credit),
+                   %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+            FROM voucher_line vol
+            JOIN voucher vo ON vo.id = vol.voucher_id
+            WHERE vo.state = 'done'
+              AND vo.period_id IS NOT NULL
+            GROUP BY vol.account_id, vo.period_id
+        ''', (self.env.uid, self.env.uid))
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def get_account_balance(self, accounts, period_id=False):
+        '''
+        取科目（含上级科目按下级科目汇总）的借方、贷方合计
+        :param accounts: 会计科目
+        :param period_id: 会计期间id，为空时取所有期间
+        :return: {科目id: (借方, 贷方)}
+        '''
+        if not accounts:
+            return {}
+        self.env['finance.account'].flush(['parent_path'])
+        self.env.cr.execute('''
+            SELECT acc.id, sum(bal.debit), sum(bal.credit)
+            FROM finance_account acc
+            JOIN finance_account child
+                 ON child.parent_path LIKE acc.parent_path || '%%'
+            JOIN finance_account_balance bal ON bal.account_id = child.id
+            WHERE acc.id IN %s
+              AND (%s IS NULL OR bal.period_id = %s)
+            GROUP BY acc.id
+        ''', (tuple(accounts.ids), period_id or None, period_id or None))
+        return {account_id: (debit or 0, credit or 0)
+                for account_id, debit, credit in self.env.cr.fetchall()}
+
+
 class WizardAccountAddChild(models.TransientModel):
     """ 向导，用于新增下级科目.
 
@@ -1024,6 +1088,22 @@ class Dupont(models.Model):
     kpi = fields.Char('指标')
     val = fields.Float('值', digits='Amount')
 
+    @api.model
+    def fill_missing(self):
+        '''为所有已结账但还没有财务指标的期间计算指标，已有指标的期间不再重复计算'''
+        self.flush(['period_id'])
+        self.env['finance.period'].flush(['is_closed'])
+        self.env.cr.execute('''
+            SELECT period.id
+            FROM finance_period period
+            WHERE period.is_closed = TRUE
+              AND NOT EXISTS (SELECT 1 FROM dupont WHERE dupont.period_id = period.id)
+        ''')
+        for period_id in self.env['finance.period'].browse(
+                [row[0] for row in self.env.cr.fetchall()]):
+            self.fill(period_id)
+        return True
+
     @api.model
     def fill(self, period_id):
 
@@ -39,6 +39,7 @@ class MonthProductCost(models.Model):
             period_id)
         # 每个产品最多取两行，一个本月出库，一个本月入库
         # 如果一个产品在本月没有出入库记录，则不生成发出成本记录
+        self.env['wh.move.line'].flush()
         self.env.cr.execute('''
             SELECT line.goods_id as goods_id,
                    line.type as type,
@@ -48,37 +49,51 @@ class MonthProductCost(models.Model):
             LEFT JOIN warehouse wh_dest ON line.warehouse_dest_id = wh_dest.id
             LEFT JOIN warehouse wh ON line.warehouse_id = wh.id
             WHERE  line.state = 'done'
-              AND line.date >= '%s'
-              AND line.date <= '%s'
+              AND line.date >= %s
+              AND line.date <= %s
               AND ((wh_dest.type='stock'AND wh.type!='stock') OR
                 (wh_dest.type!='stock' AND wh.type='stock'))
             GROUP BY line.goods_id,line.type
-        ''' % (date_range[0], date_range[1]))
+        ''', (date_range[0], date_range[1]))
         return self.env.cr.dictfetchall()
 
     
+    def get_last_period_remaining(self, period_id, goods_ids):
+        """
+        :param period_id: 传入当前所需的期间，根据这个期间找到对应的上一个期间
+        :param goods_ids: 一次取出这些商品在上一期间对应的 month.product.cost 记录
+        :return: {商品id: (上一期间的剩余数量, 剩余数量成本)}
+        """
+        if not goods_ids:
+            return {}
+        self.flush()
+        # 查找 离输入期间最近的 对应产品的发出成本行
+        self.env.cr.execute('''
+            SELECT DISTINCT ON (goods_id)
+                   goods_id,
+                   current_period_remaining_qty,
+                   current_period_remaining_cost
+            FROM month_product_cost
+            WHERE period_id < %s
+              AND goods_id IN %s
+            ORDER BY goods_id, id DESC
+        ''', (period_id.id, tuple(goods_ids)))
+        return {goods_id: (qty or 0, cost or 0)
+                for goods_id, qty, cost in self.env.cr.fetchall()}
+
     def get_goods_last_period_remaining_qty(self, period_id, goods_id):
         """
         :param period_id: 传入当前所需的期间，根据这个期间找到对应的上一个期间
         :param goods_id: 出入 goods 精确找到 上一期间 对应的 month.product.cost 记录
         :return: 让上一期间的 剩余数量，和剩余数量成本 以字典 形式返回
         """
-        last_period_remaining_qty = 0
-        last_period_remaining_cost = 0
-
-        # 查找 离输入期间最近的 对应产品的发出成本行
-        last_month_product_cost_row = self.search([('period_id.id', '<', period_id.id),
-                                                   ('goods_id', '=', goods_id)], limit=1, order='id desc')
-        if last_month_product_cost_row:
-            last_period_remaining_qty = last_month_product_cost_row.current_period_remaining_qty
-            last_period_remaining_cost = last_month_product_cost_row.current_period_remaining_cost
-
+        qty, cost = self.get_last_period_remaining(
+            period_id, [goods_id]).get(goods_id, (0, 0))
         return {
-            'last_period_remaining_qty': last_period_remaining_qty,
-            'last_period_remaining_cost': last_period_remaining_cost
+            'last_period_remaining_qty': qty,
+            'last_period_remaining_cost': cost
         }
 
-    
     def fill_in_out(self, dcit_goods):
         """
       填充产品的本月出库入库数量和成本
@@ -107,12 +122,11 @@ class MonthProductCost(models.Model):
                 'current_period_remaining_cost': sum_goods_cost
                 }
 
-    def _get_cost_method(self, goods_id):
+    def _get_cost_method(self, goods):
         '''
         批次管理的产品使用个别计价
         先取产品的计价方式，再取公司上的计价方式
         '''
-        goods = self.env['goods'].browse(goods_id)
         if goods.using_batch:
             return 'fifo'
         if goods.cost_method:
@@ -120,12 +134,14 @@ class MonthProductCost(models.Model):
         else:
             return self.env.user.company_id.cost_method
 
-    
-    def compute_balance_price(self, data_dict):
+    def compute_balance_price(self, data_dict, goods=None):
         """
 可以用其他算法计算发出成本
         """
-        cost_method = self._get_cost_method(data_dict.get("goods_id"))
+        if goods is None:
+            goods = self.env['goods'].browse(data_dict.get("goods_id"))
+        cost_method = self._get_cost_method(goods)
+        month_cost = 0
         if cost_method == 'average':
             # 本月该商品的结存单价 = （上月该商品的成本余额 + 本月入库成本 ）/ (上月数量余额 + 本月入库数量)
             # 则本月发出成本 = 结存单价 * 发出数量
@@ -139,28 +155,41 @@ class MonthProductCost(models.Model):
             month_cost = data_dict.get("current_period_out_cost", 0)
         if cost_method == 'std':
             # 定额成本
-            goods = self.env['goods'].browse(data_dict.get("goods_id"))
-            month_cost =  goods.price * \
+            month_cost = goods.price * \
                 data_dict.get("current_period_out_qty", 0)
         return round(month_cost, 2)
 
-    
+    def get_real_out_costs(self, period_id, goods_ids):
+        """
+        一次算出当期各商品在库存商品科目（所有商品类别涉及的科目）的贷方金额合计
+        :return: {商品id: 贷方金额合计}
+        """
+        if not goods_ids:
+            return {}
+        self.env['voucher.line'].flush(['goods_id', 'credit', 'voucher_id'])
+        self.env['voucher'].flush(['period_id'])
+        self.env.cr.execute('''
+            SELECT line.goods_id, SUM(line.credit)
+            FROM voucher_line line
+            JOIN voucher ON voucher.id = line.voucher_id
+            WHERE voucher.period_id = %s
+              AND line.credit > 0
+              AND line.goods_id IN %s
+            GROUP BY line.goods_id
+        ''', (period_id.id, tuple(goods_ids)))
+        return dict(self.env.cr.fetchall())
+
     def compute_real_out_cost(self, data_dict, period_id):
         """
         计算当期库存商品科目（所有商品类别涉及的科目）贷方金额合计
         """
-        line = self.env['voucher.line'].search([
-            ('goods_id', '=', data_dict.get('goods_id')),
-            ('voucher_id.period_id', '=', period_id.id),
-            ('credit', '>', 0)
-        ])
-        cost = sum(l.credit for l in line)
-        return cost
+        goods_id = data_dict.get('goods_id')
+        return self.get_real_out_costs(period_id, [goods_id]).get(goods_id, 0)
 
-    
     def create_month_product_cost_voucher(self, period_id, date, month_product_cost_dict):
         """
         月底成本结转生成的凭证，算出借贷方金额后，借贷方金额全部减去本期间库存商品科目（所有商品类别涉及的科目）贷方金额合计
+        发出成本行和凭证行都在循环外一次创建
         :param period_id:
         :param date:
         :param month_product_cost_dict:
@@ -170,28 +199,32 @@ class MonthProductCost(models.Model):
         voucher_line_data_list = []
         account_row = self.env.ref('finance.account_cost')
         all_balance_price = 0
-        for create_vals in list(month_product_cost_dict.values()):
-            goods_row = self.env['goods'].browse(create_vals.get('goods_id'))
+        goods_ids = list(month_product_cost_dict.keys())
+        goods_rows = {goods.id: goods for goods in self.env['goods'].browse(goods_ids)}
+        real_out_costs = self.get_real_out_costs(period_id, goods_ids)  # 发出时已结转的实际成本
+        create_vals_list = []
+        for goods_id, create_vals in month_product_cost_dict.items():
+            goods_row = goods_rows[goods_id]
             current_period_out_cost = self.compute_balance_price(
-                create_vals)   # 当期加权平均成本
-            real_out_cost = self.compute_real_out_cost(
-                create_vals, period_id)  # 发出时已结转的实际成本
+                create_vals, goods_row)   # 当期加权平均成本
 
-            diff_cost = current_period_out_cost - real_out_cost  # 两者之差
+            diff_cost = current_period_out_cost - real_out_costs.get(goods_id, 0)  # 两者之差
             if not float_is_zero(diff_cost,2):  # 贷方
                 voucher_line_data = {'name': '发出成本', 'credit': diff_cost,
                                      'account_id': goods_row.category_id.account_id.id,
-                                     'goods_id': create_vals.get('goods_id'),
+                                     'goods_id': goods_id,
                                      'goods_qty': create_vals.get('current_period_out_qty')}
-                voucher_line_data_list.append([0, 0, voucher_line_data.copy()])
+                voucher_line_data_list.append([0, 0, voucher_line_data])
                 all_balance_price += diff_cost
-            # 创建 发出成本
+            # 发出成本
             create_vals.update({'current_period_out_cost': current_period_out_cost,
                                 'current_period_remaining_cost': create_vals.get('period_begin_cost', 0) +
                                 create_vals.get('current_period_in_cost', 0) -
                                 current_period_out_cost
                                 })
-            self.create(create_vals)
+            create_vals_list.append(create_vals)
+        if create_vals_list:
+            self.create(create_vals_list)
 
         if all_balance_price != 0:  # 借方
             voucher_line_data_list.append(
@@ -202,38 +235,31 @@ class MonthProductCost(models.Model):
                                                      'is_checkout': True})
             voucher_id.voucher_done()
 
-    
     def data_structure(self, list_dict_data, period_id):
         """
         把 list_dict_data 按产品合并成 month_product_cost_dict，并填充期初、期末
         """
+        goods_ids = list({dict_goods.get('goods_id') for dict_goods in list_dict_data})
+        last_remaining = self.get_last_period_remaining(period_id, goods_ids)
         month_product_cost_dict = {}
         for dict_goods in list_dict_data:
-            period_begin_qty_cost = self.get_goods_last_period_remaining_qty(
-                period_id, dict_goods.get('goods_id'))
-            vals = {}
-            if dict_goods.get('goods_id') not in month_product_cost_dict:
-                vals = {'goods_id': dict_goods.get('goods_id'), 'period_id': period_id.id,
-                        'period_begin_qty': period_begin_qty_cost.get('last_period_remaining_qty', 0),
-                        'period_begin_cost': period_begin_qty_cost.get('last_period_remaining_cost', 0)}
-                vals.update(self.fill_in_out(dict_goods))
-                month_product_cost_dict.update(
-                    {dict_goods.get('goods_id'): vals.copy()})
-                month_product_cost_dict.get(dict_goods.get('goods_id')).update(self.month_remaining_qty_cost(
-                    month_product_cost_dict.get(dict_goods.get('goods_id'))))
-            else:
-                vals.update(self.fill_in_out(dict_goods))
-                month_product_cost_dict.get(
-                    dict_goods.get('goods_id')).update(vals.copy())
-                month_product_cost_dict.get(dict_goods.get('goods_id')).update(self.month_remaining_qty_cost(
-                    month_product_cost_dict.get(dict_goods.get('goods_id'))))
+            goods_id = dict_goods.get('goods_id')
+            if goods_id not in month_product_cost_dict:
+                period_begin_qty, period_begin_cost = last_remaining.get(goods_id, (0, 0))
+                month_product_cost_dict[goods_id] = {
+                    'goods_id': goods_id, 'period_id': period_id.id,
+                    'period_begin_qty': period_begin_qty,
+                    'period_begin_cost': period_begin_cost}
+            vals = month_product_cost_dict[goods_id]
+            vals.update(self.fill_in_out(dict_goods))
+            vals.update(self.month_remaining_qty_cost(vals))
 
         return month_product_cost_dict
 
-    
     def generate_issue_cost(self, period_id, date):
         """
         生成成本的凭证
+        期初结存、本期出入库、凭证贷方合计各用一条分组查询取出，再按商品计算
         :param period_id:
         :return:
         """
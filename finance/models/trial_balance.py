@@ -3,6 +3,13 @@ from odoo.exceptions import UserError
 from math import fabs
 import copy
 
+# 科目余额表中需要按科目树汇总的金额字段
+TRIAL_BALANCE_AMOUNT_FIELDS = [
+    'initial_balance_debit', 'initial_balance_credit',
+    'current_occurrence_debit', 'current_occurrence_credit',
+    'ending_balance_debit', 'ending_balance_credit',
+    'cumulative_occurrence_debit', 'cumulative_occurrence_credit',
+]
 
 
 class TrialBalance(models.Model):
@@ -375,31 +382,74 @@ class CreateTrialBalanceWizard(models.TransientModel):
     def get_period_balance(self, period_id):
         """取出本期发生额
             返回结果是 科目 借 贷
+            末级科目取科目期间发生额，上级科目在内存中按科目树汇总下级科目
          """
-        # sql = '''select vol.account_id as account_id,
-        #             sum(vol.debit) as debit,
-        #             sum(vol.credit) as credit
-        #          from voucher as vo
-        #          left join voucher_line as vol
-        #          on vo.id = vol.voucher_id
-        #          where vo.period_id=%s
-        #          group by vol.account_id'''
-        # self.env.cr.execute(sql, (period_id,))
-        # return self.env.cr.dictfetchall()
         self.ensure_one()
+        self.env['finance.account.balance'].flush()
+        self.env.cr.execute('''
+            SELECT account_id, debit, credit
+            FROM finance_account_balance
+            WHERE period_id = %s
+        ''', (period_id,))
+        account_amounts = {row['account_id']: row for row in self.env.cr.dictfetchall()}
+
+        totals = self.rollup_account_amounts(
+            account_amounts, ['debit', 'credit'])
         data = []
         for account in self.env['finance.account'].search([]):
-            account_balance = account.get_balance(period_id)
-            data.append( {
-                'account_id':account.id,
-                'debit': account_balance.get('debit'),
-                'credit': account_balance.get('credit'),
-                'balance': account_balance.get('balance')
-                })
+            amount = totals.get(account.id, {})
+            debit = amount.get('debit', 0) or 0
+            credit = amount.get('credit', 0) or 0
+            data.append({
+                'account_id': account.id,
+                'debit': debit,
+                'credit': credit,
+                'balance': debit - credit,
+            })
 
         return data
 
-    
+    @api.model
+    def get_account_tree(self):
+        """ 一次查询取出科目树 {科目id: (上级科目id, 科目类型)} """
+        self.env['finance.account'].flush(['parent_id', 'account_type'])
+        self.env.cr.execute(
+            'SELECT id, parent_id, account_type FROM finance_account')
+        return {account_id: (parent_id, account_type)
+                for account_id, parent_id, account_type in self.env.cr.fetchall()}
+
+    @api.model
+    def rollup_account_amounts(self, account_amounts, field_list, account_tree=None):
+        """
+        把末级科目的金额逐级汇总到上级科目
+        :param account_amounts: {末级科目id: {字段: 金额}}
+        :param field_list: 需要汇总的字段
+        :return: {科目id: {字段: 金额}}，包含末级科目和所有上级科目
+        """
+        account_tree = account_tree or self.get_account_tree()
+        totals = {}
+        for account_id, amount in account_amounts.items():
+            if account_tree.get(account_id, (False, 'normal'))[1] != 'normal':
+                continue
+            current_id = account_id
+            while current_id:
+                total = totals.setdefault(current_id, dict.fromkeys(field_list, 0))
+                for field in field_list:
+                    total[field] += amount.get(field, 0) or 0
+                current_id = account_tree.get(current_id, (False,))[0]
+        return totals
+
+    def rollup_trial_balance_dict(self, trial_balance_dict):
+        """ 科目余额表 上级科目的金额 按末级科目重新汇总 """
+        account_tree = self.get_account_tree()
+        totals = self.rollup_account_amounts(
+            trial_balance_dict, TRIAL_BALANCE_AMOUNT_FIELDS, account_tree)
+        for account_id, vals in trial_balance_dict.items():
+            if account_tree.get(account_id, (False, 'normal'))[1] == 'view':
+                vals.update(totals.get(
+                    account_id, dict.fromkeys(TRIAL_BALANCE_AMOUNT_FIELDS, 0)))
+        return trial_balance_dict
+
     def create_trial_balance(self):
         """ \
             生成科目余额表 \
@@ -407,85 +457,56 @@ class CreateTrialBalanceWizard(models.TransientModel):
             2.判断如果所选的区间的 前一个期间没有关闭则报错
             3.如果上一个区间不存在则报错
         """
-        trial_balance_objs = self.env['trial.balance'].search(
+        trial_balance_obj = self.env['trial.balance']
+        trial_balance_objs = trial_balance_obj.search(
             [('period_id', '=', self.period_id.id)])
-        trial_balance_ids = [
-            trial_balance_row.id for trial_balance_row in trial_balance_objs]
+        trial_balance_ids = trial_balance_objs.ids
+        period_id = self.period_id.id
+        last_period = self.compute_last_period_id(self.period_id)
         if not self.period_id.is_closed:
             trial_balance_objs.unlink()
-            last_period = self.compute_last_period_id(self.period_id)
             if last_period:
                 if not last_period.is_closed:
                     raise UserError('期间%s未结账，无法取到%s期期初余额' % (last_period.name, self.period_id.name))
-            period_id = self.period_id.id
             current_occurrence_dic_list = self.get_period_balance(period_id)
             trial_balance_dict = {}
             """把本期发生额的数量填写到  准备好的dict 中 """
             for current_occurrence in current_occurrence_dic_list:
-                account = self.env['finance.account'].browse(
-                    current_occurrence.get('account_id'))
-                ending_balance_debit = ending_balance_credit = 0
-                this_debit = current_occurrence.get('debit', 0) or 0
-                this_credit = current_occurrence.get('credit', 0) or 0
-                if account.balance_directions == 'in':
-                    ending_balance_debit = this_debit - this_credit
-                else:
-                    ending_balance_credit = this_credit - this_debit
-                account_dict = {'period_id': period_id,
-                                'current_occurrence_debit': this_debit,
-                                'current_occurrence_credit': this_credit,
-                                'subject_code': account.code,
-                                'initial_balance_credit': 0,
-                                'initial_balance_debit': 0,
-                                'ending_balance_debit': ending_balance_debit,
-                                'ending_balance_credit': ending_balance_credit,
-                                'cumulative_occurrence_debit': this_debit,
-                                'cumulative_occurrence_credit': this_credit,
-                                'subject_name_id': account.id}
-                trial_balance_dict[account.id] = account_dict
+                trial_balance_dict[current_occurrence.get('account_id')] = \
+                    self._prepare_account_dict(current_occurrence, period_id)
             trial_balance_dict.update(self.construct_trial_balance_dict(
                 trial_balance_dict, last_period))
-            trial_balance_ids = [self.env['trial.balance'].create(vals).id for (key, vals) in
-                                 list(trial_balance_dict.items())]
+            # 对 科目余额表 上下级 数据在内存中汇总后一次创建
+            self.rollup_trial_balance_dict(trial_balance_dict)
+            trial_balance_ids = trial_balance_obj.create(
+                list(trial_balance_dict.values())).ids
 
         else:
             # 更新 科目余额表， 将新出现的 科目加入到 科目余额表
             trial_balance_dict = {}
-            period_id = self.period_id.id
-            last_period = self.compute_last_period_id(self.period_id)
             current_occurrence_dic_list = self.get_period_balance(period_id)
-            exist_trial_balanace_accounts = self.env['trial.balance'].search([('period_id', '=',
-                                                                               period_id)]).mapped('subject_name_id')
+            exist_trial_balance_dict = {
+                item['subject_name_id'][0]: item for item in
+                trial_balance_objs.read(TRIAL_BALANCE_AMOUNT_FIELDS + ['subject_name_id'])
+                if item['subject_name_id']}
             for current_occurrence in current_occurrence_dic_list:
-                account = self.env['finance.account'].browse(current_occurrence.get('account_id'))
-                if account not in exist_trial_balanace_accounts:
-                    trial_balance_dict[account.id] = self._prepare_account_dict(current_occurrence, period_id)
+                account_id = current_occurrence.get('account_id')
+                if account_id not in exist_trial_balance_dict:
+                    trial_balance_dict[account_id] = self._prepare_account_dict(current_occurrence, period_id)
 
             trial_balance_dict.update(self.construct_trial_balance_dict(trial_balance_dict, last_period))
-
-            for (key, vals) in list(trial_balance_dict.items()):
-                if key not in exist_trial_balanace_accounts.ids:
-                    trial_balance_ids.extend(self.env['trial.balance'].create(vals).ids)
-
-        # 对 科目余额表 上下级 数据重新计算
-        for trial_item in self.env['trial.balance'].search([('account_type', '=', 'view'),('period_id','=',self.period_id.id)], order='level desc'):
-            parent_account_id = trial_item.subject_name_id
-            child_account_ids = self.env['finance.account'].search( [('id', 'child_of', parent_account_id.id),('account_type','=', 'normal')])
-            child_trial_items = self.env['trial.balance'].search([('subject_name_id', 'in', child_account_ids.ids),('period_id','=',self.period_id.id)])
-            trial_item.write(
-                {
-                    "year_init_debit": sum(child_trial_items.mapped("year_init_debit")),
-                    "year_init_credit": sum(child_trial_items.mapped("year_init_credit")),
-                    "initial_balance_debit": sum(child_trial_items.mapped("initial_balance_debit")),
-                    "initial_balance_credit": sum(child_trial_items.mapped("initial_balance_credit")),
-                    "current_occurrence_debit": sum(child_trial_items.mapped("current_occurrence_debit")),
-                    "current_occurrence_credit": sum(child_trial_items.mapped("current_occurrence_credit")),
-                    "ending_balance_debit": sum(child_trial_items.mapped("ending_balance_debit")),
-                    "ending_balance_credit": sum(child_trial_items.mapped("ending_balance_credit")),
-                    "cumulative_occurrence_debit": sum(child_trial_items.mapped("cumulative_occurrence_debit")),
-                    "cumulative_occurrence_credit": sum(child_trial_items.mapped("cumulative_occurrence_credit")),
-                }
-            )
+            new_trial_balance_dict = {key: vals for (key, vals) in trial_balance_dict.items()
+                                      if key not in exist_trial_balance_dict}
+
+            # 对 科目余额表 上下级 数据重新计算
+            all_trial_balance_dict = dict(exist_trial_balance_dict)
+            all_trial_balance_dict.update(new_trial_balance_dict)
+            self.rollup_trial_balance_dict(all_trial_balance_dict)
+            trial_balance_ids.extend(trial_balance_obj.create(
+                list(new_trial_balance_dict.values())).ids)
+            for trial_item in trial_balance_objs.filtered(lambda t: t.account_type == 'view'):
+                vals = all_trial_balance_dict[trial_item.subject_name_id.id]
+                trial_item.write({field: vals[field] for field in TRIAL_BALANCE_AMOUNT_FIELDS})
 
         view_id = self.env.ref('finance.trial_balance_tree').id
         if self.period_id == self.period_id.get_init_period():
@@ -661,28 +682,26 @@ class CreateVouchersSummaryWizard(models.TransientModel):
     
     def get_initial_balance(self, period, account_row):
         """取得期初余额"""
-        vals_dict = {}
         if period:
             period_id = period.id
         else:
             period_id = False
-        initial_balance_credit = 0
-        initial_balance_debit = 0
         trial_balance_obj = self.env['trial.balance'].search(
             [('period_id', '=', period_id), ('subject_name_id', '=', account_row.id)])
-        if trial_balance_obj:
-            initial_balance_credit = trial_balance_obj.ending_balance_credit
-            initial_balance_debit = trial_balance_obj.ending_balance_debit
+        return self._get_initial_balance_vals(account_row, trial_balance_obj[:1])
+
+    def _get_initial_balance_vals(self, account_row, trial_balance):
+        """根据上期科目余额表行（可以是 read 出来的字典）生成期初余额行"""
+        initial_balance_credit = trial_balance and trial_balance['ending_balance_credit'] or 0
+        initial_balance_debit = trial_balance and trial_balance['ending_balance_debit'] or 0
         direction_tuple = self.judgment_lending(
             0, initial_balance_credit, initial_balance_debit)
-        vals_dict.update({
+        return {
             'date': False,
             'direction': direction_tuple[0],
             'balance': fabs(direction_tuple[1]),
-            'summary': account_row.code + ' ' + account_row.name + ":" + '期初余额'})
-        return vals_dict
+            'summary': account_row.code + ' ' + account_row.name + ":" + '期初余额'}
 
-    
     def judgment_lending(self, balance, balance_credit, balance_debit):
         """根据明细账的借贷 金额 判断出本条记录的余额 及方向，balance 为上一条记录余额
             传入参数 余额 ,贷方,借方
@@ -703,45 +722,35 @@ class CreateVouchersSummaryWizard(models.TransientModel):
         :param period 期间 subject_name 科目object
         return: [本期合计dict,本年合计dict ]
         """
-        vals_dict = {}
         trial_balance_obj = self.env['trial.balance'].search(
             [('period_id', '=', period.id), ('subject_name_id', '=', subject_name.id)])
-        if trial_balance_obj:
-            cumulative_occurrence_credit = trial_balance_obj.cumulative_occurrence_credit
-            cumulative_occurrence_debit = trial_balance_obj.cumulative_occurrence_debit
-            current_occurrence_credit = trial_balance_obj.current_occurrence_credit
-            current_occurrence_debit = trial_balance_obj.current_occurrence_debit
-            ending_balance_debit = trial_balance_obj.ending_balance_debit
-            ending_balance_credit = trial_balance_obj.ending_balance_credit
-        else:
-            cumulative_occurrence_credit = 0
-            cumulative_occurrence_debit = 0
-            current_occurrence_credit = 0
-            current_occurrence_debit = 0
-            ending_balance_debit = 0
-            ending_balance_credit = 0
-        # direction_tuple = self.judgment_lending(0, cumulative_occurrence_credit, cumulative_occurrence_debit)
+        return self._get_year_balance_vals(period, subject_name, trial_balance_obj[:1])
+
+    def _get_year_balance_vals(self, period, subject_name, trial_balance):
+        """根据本期科目余额表行（可以是 read 出来的字典）生成本期合计和本年累计行"""
+        def amount(field):
+            return trial_balance and trial_balance[field] or 0
+
         direction_tuple_period = self.judgment_lending(
-            0, ending_balance_credit, ending_balance_debit)
+            0, amount('ending_balance_credit'), amount('ending_balance_debit'))
         period_vals = {
             'date': False,
             'direction': direction_tuple_period[0],
             'period_id': period.id,
-            'credit': current_occurrence_credit,
-            'debit': current_occurrence_debit,
+            'credit': amount('current_occurrence_credit'),
+            'debit': amount('current_occurrence_debit'),
             'balance': fabs(direction_tuple_period[1]),
             'summary': subject_name.code + ' ' + subject_name.name + ":" + '本期合计'}
-        vals_dict.update({
+        vals_dict = {
             'date': False,
             'direction': direction_tuple_period[0],
             'balance': fabs(direction_tuple_period[1]),
             'period_id': False,
-            'debit': cumulative_occurrence_debit,
-            'credit': cumulative_occurrence_credit,
-            'summary': subject_name.code + ' ' + subject_name.name + ":" + '本年累计'})
+            'debit': amount('cumulative_occurrence_debit'),
+            'credit': amount('cumulative_occurrence_credit'),
+            'summary': subject_name.code + ' ' + subject_name.name + ":" + '本年累计'}
         return [period_vals, vals_dict]
 
-    
     def get_current_occurrence_amount(self, period, subject_name):
         """计算出 本期的科目的 voucher_line的明细记录 """
         child_ids = self.env['finance.account'].search([('id','child_of',subject_name.id)])
@@ -844,69 +853,221 @@ class CreateVouchersSummaryWizard(models.TransientModel):
         return [current_occurrence, initial_balance_new]
 
     
-    def create_vouchers_summary(self):
-        """创建出根据所选期间范围内的 明细帐记录"""
-        last_period = self.env['create.trial.balance.wizard'].compute_last_period_id(
-            self.period_begin_id)
-        if last_period:
-            if not last_period.is_closed:
-                raise UserError('期间%s未结账，无法取到%s期初余额' %
-                                (last_period.name, self.period_begin_id.name))
-        # period_end = self.env['create.trial.balance.wizard'].compute_next_period_id(self.period_end_id)
-        vouchers_summary_ids = []
+    def _get_ledger_periods(self):
+        """开始期间到结束期间的期间列表，没有下一期间时提前结束"""
+        periods = []
+        period = self.period_begin_id
+        while period:
+            periods.append(period)
+            if period.id == self.period_end_id.id:
+                break
+            period = self.env['create.trial.balance.wizard'].compute_next_period_id(
+                period)
+        return periods
+
+    def _get_ledger_accounts(self):
+        """科目范围内的科目及其所有下级科目"""
         subject_ids = self.env['finance.account'].search([('code', '>=', self.subject_name_id.code),
                                                           ('code', '<=', self.subject_name_end_id.code)])
-        account_ids = []
-        for subject_id in subject_ids:
-            child_subject_ids = self.env['finance.account'].search([('id', 'child_of', subject_id.id)])
-            account_ids.extend(child_subject_ids)
+        return self.env['finance.account'].search([('id', 'child_of', subject_ids.ids)])
 
-        new_account_ids =[]
+    def _load_ledger_data(self, accounts, periods, last_period):
+        """
+        一次取出生成明细账/总账需要的数据
+        :return: dict
+            trial_balances: {(期间id, 科目id): 科目余额表行}
+            lines: {(科目id, 期间id): [凭证明细]}
+            amounts: {期间id: {科目id: {'debit', 'credit'}}} 已按科目树汇总到上级科目
+            year_periods: {未结账期间id: 本年该期间及之前的期间}
+            init_period: 系统启用期间
+        """
+        period_obj = self.env['finance.period']
+        init_period = period_obj.get_init_period()
+        period_ids = {period.id for period in periods}
+        # 未结账期间的本年累计需要本年度该期间之前各期间的发生额
+        year_periods = {}
+        amount_period_ids = set(period_ids)
+        for period in periods:
+            if not period.is_closed:
+                year_periods[period.id] = period_obj.search(
+                    [('year', '=', str(period.year))]).filtered(
+                    lambda p: int(p.month) <= int(period.month))
+                amount_period_ids.update(year_periods[period.id].ids)
+
+        tb_period_ids = set(period_ids) | set(last_period.ids) | set(init_period.ids)
+        trial_balances = {}
+        for tb in self.env['trial.balance'].search_read(
+                [('period_id', 'in', list(tb_period_ids)),
+                 ('subject_name_id', 'in', accounts.ids)],
+                ['period_id', 'subject_name_id',
+                 'ending_balance_debit', 'ending_balance_credit',
+                 'current_occurrence_debit', 'current_occurrence_credit',
+                 'cumulative_occurrence_debit', 'cumulative_occurrence_credit',
+                 'year_init_debit', 'year_init_credit']):
+            trial_balances.setdefault(
+                (tb['period_id'][0], tb['subject_name_id'][0]), tb)
+
+        # 所有科目、所有期间的凭证明细按 科目、期间、凭证号 顺序一次取出，边读边汇总
+        self.env['voucher'].flush(['state', 'period_id', 'name', 'date'])
+        self.env['voucher.line'].flush(['voucher_id', 'account_id', 'debit', 'credit', 'name'])
+        self.env.cr.execute('''
+            SELECT vol.account_id, vo.period_id, vo.date AS date, vo.id AS voucher_id,
+                   COALESCE(vol.debit, 0) AS debit, COALESCE(vol.credit, 0) AS credit,
+                   vol.name AS summary
+            FROM voucher AS vo
+            JOIN voucher_line AS vol ON vo.id = vol.voucher_id
+            WHERE vo.state = 'done'
+              AND vo.period_id IN %s
+              AND vol.account_id IN %s
+            ORDER BY vol.account_id, vo.period_id, vo.name, vol.id
+        ''', (tuple(amount_period_ids), tuple(accounts.ids)))
+        lines = {}
+        leaf_amounts = {}
+        while True:
+            rows = self.env.cr.dictfetchmany(2000)
+            if not rows:
+                break
+            for row in rows:
+                account_id = row.pop('account_id')
+                period_id = row['period_id']
+                if period_id in period_ids:
+                    lines.setdefault((account_id, period_id), []).append(row)
+                amount = leaf_amounts.setdefault(period_id, {}).setdefault(
+                    account_id, {'debit': 0, 'credit': 0})
+                amount['debit'] += row['debit']
+                amount['credit'] += row['credit']
+
+        trial_wizard = self.env['create.trial.balance.wizard']
+        account_tree = trial_wizard.get_account_tree()
+        amounts = {period_id: trial_wizard.rollup_account_amounts(
+                       period_amounts, ['debit', 'credit'], account_tree)
+                   for period_id, period_amounts in leaf_amounts.items()}
+        return {
+            'trial_balances': trial_balances,
+            'lines': lines,
+            'amounts': amounts,
+            'year_periods': year_periods,
+            'init_period': init_period,
+        }
 
-        for account in account_ids:
-            if account not in new_account_ids:
-                new_account_ids.append(account)
+    def _get_detail_vals(self, initial_balance, rows):
+        """本期凭证明细，余额从期初余额开始逐行累计"""
+        balance = initial_balance['balance']
+        if initial_balance['direction'] == '贷':
+            balance = -balance
+        res = []
+        for row in rows:
+            direction, balance = self.judgment_lending(
+                balance, row['credit'], row['debit'])
+            vals = dict(row)
+            vals.update({'direction': direction, 'balance': fabs(balance)})
+            res.append(vals)
+        return res
 
-        for account_line in new_account_ids:
+    def _get_unclose_year_balance_vals(self, initial_balance, period, account, data):
+        """未结账期间的本期合计和本年累计，发生额取已汇总到上级科目的金额"""
+        empty = {'debit': 0, 'credit': 0}
+        current = data['amounts'].get(period.id, {}).get(account.id, empty)
+        year_balance_debit = year_balance_credit = 0
+        for line_period in data['year_periods'][period.id]:
+            amount = data['amounts'].get(line_period.id, {}).get(account.id, empty)
+            year_balance_debit += amount['debit']
+            year_balance_credit += amount['credit']
+        init_period = data['init_period']
+        if init_period and init_period in data['year_periods'][period.id]:
+            trial_balance = data['trial_balances'].get((init_period.id, account.id))
+            if trial_balance:
+                year_balance_debit -= trial_balance['year_init_debit']
+                year_balance_credit -= trial_balance['year_init_credit']
+
+        balance = initial_balance['balance']
+        if initial_balance['direction'] != '借':
+            balance = -balance
+        direction, balance = self.judgment_lending(
+            balance, current['credit'], current['debit'])
+        summary = account.code + ' ' + account.name + ":"
+        return [{
+            'date': False,
+            'direction': direction,
+            'balance': fabs(balance),
+            'debit': current['debit'],
+            'credit': current['credit'],
+            'period_id': period.id,
+            'summary': summary + '本期合计'
+        }, {
+            'date': False,
+            'direction': direction,
+            'balance': abs(balance),
+            'debit': year_balance_debit,
+            'credit': year_balance_credit,
+            'period_id': False,
+            'summary': summary + '本年累计'
+        }]
+
+    def _iter_ledger_vals(self, last_period, general=False):
+        """
+        按 科目 × 期间 顺序逐行生成明细账（general 为真时为总账）的数据，
+        可直接用于批量创建，也可以直接输出
+        明细账每个科目：期初余额（仅第一个期间） 本期明细 本期合计 本年累计
+        总账每个期间：期初余额 本期合计 本年累计
+        """
+        accounts = self._get_ledger_accounts()
+        periods = self._get_ledger_periods()
+        if not accounts or not periods:
+            return
+        data = self._load_ledger_data(accounts, periods, last_period)
+        trial_balances = data['trial_balances']
+        for account in accounts:
             local_last_period = last_period
-            local_currcy_period = self.period_begin_id
-            break_flag = True
-            init = 1
-            while break_flag:
+            init = True
+            for period in periods:
+                initial_balance = self._get_initial_balance_vals(
+                    account, trial_balances.get((local_last_period.id, account.id)))
                 create_vals = []
-                initial_balance = self.get_initial_balance(
-                    local_last_period, account_line)  # 取上期间期初余额
-                if init:
+                if general or init:
                     create_vals.append(initial_balance)  # 期初
-                    init = 0
-                occurrence_amount = self.get_current_occurrence_amount(
-                    local_currcy_period, account_line)  # 本期明细
-                create_vals += occurrence_amount
-                if local_currcy_period.is_closed:
-                    cumulative_year_occurrence = self.get_year_balance(
-                        local_currcy_period, account_line)  # 本期合计 本年累计
+                    init = False
+                if not general:
+                    create_vals += self._get_detail_vals(
+                        initial_balance, data['lines'].get((account.id, period.id), []))  # 本期明细
+                if period.is_closed:
+                    cumulative_year_occurrence = self._get_year_balance_vals(
+                        period, account, trial_balances.get((period.id, account.id)))  # 本期合计 本年累计
                 else:
-                    cumulative_year_occurrence = self.get_unclose_year_balance(copy.deepcopy(initial_balance),
-                                                                               local_currcy_period, account_line)
+                    cumulative_year_occurrence = self._get_unclose_year_balance_vals(
+                        initial_balance, period, account, data)
                 create_vals += cumulative_year_occurrence
-                if local_currcy_period.id == self.period_end_id.id:
-                    break_flag = False
-                local_last_period = local_currcy_period
-                local_currcy_period = self.env['create.trial.balance.wizard'].compute_next_period_id(
-                    local_currcy_period)
-                if not local_currcy_period:  # 无下一期间，退出循环。
-                    break_flag = False
-                # # 无发生额不显示
-                # if self.no_occurred and len(occurrence_amount) == 0:
-                #     continue
-                # 无余额不显示
-                if cumulative_year_occurrence[0].get('credit') == 0 \
-                        and cumulative_year_occurrence[0].get('debit') == 0 \
-                        and cumulative_year_occurrence[0].get('balance') == 0 :
+                local_last_period = period
+                period_total, year_total = cumulative_year_occurrence
+                if general:
+                    # 无余额不显示
+                    if self.no_balance \
+                            and period_total.get('credit') == 0 \
+                            and period_total.get('debit') == 0 \
+                            and year_total.get('credit') == 0 \
+                            and year_total.get('debit') == 0:
+                        continue
+                    for vals in create_vals:
+                        vals.pop('date', None)
+                elif period_total.get('credit') == 0 \
+                        and period_total.get('debit') == 0 \
+                        and period_total.get('balance') == 0:
+                    # 无余额不显示
                     continue
-                for vals in create_vals:  # create_vals 值顺序为：期初余额  本期明细  本期本年累计
-                    vouchers_summary_ids.append(
-                        (self.env['vouchers.summary'].create(vals)).id)
+                for vals in create_vals:
+                    yield vals
+
+    def create_vouchers_summary(self):
+        """创建出根据所选期间范围内的 明细帐记录"""
+        last_period = self.env['create.trial.balance.wizard'].compute_last_period_id(
+            self.period_begin_id)
+        if last_period:
+            if not last_period.is_closed:
+                raise UserError('期间%s未结账，无法取到%s期初余额' %
+                                (last_period.name, self.period_begin_id.name))
+        # create_vals 值顺序为：期初余额  本期明细  本期本年累计
+        vouchers_summary_ids = self.env['vouchers.summary'].create(
+            list(self._iter_ledger_vals(last_period))).ids
         view_id = self.env.ref('finance.vouchers_summary_tree').id
 
         title = self.period_begin_id.name
@@ -940,55 +1101,8 @@ class CreateVouchersSummaryWizard(models.TransientModel):
         if last_period and not last_period.is_closed:
             raise UserError('期间%s未结账，无法取到%s期初余额' %
                             (last_period.name, self.period_begin_id.name))
-        # period_end = self.env['create.trial.balance.wizard'].compute_next_period_id(self.period_end_id)
-        vouchers_summary_ids = []
-        subject_ids = self.env['finance.account'].search([('code', '>=', self.subject_name_id.code),
-                                                         ('code', '<=', self.subject_name_end_id.code)])
-        account_ids = []
-        for subject_id in subject_ids:
-            child_subject_ids = self.env['finance.account'].search([('id', 'child_of', subject_id.id)])
-            account_ids.extend(child_subject_ids)
-
-        new_account_ids =[]
-
-        for account in account_ids:
-            if account not in new_account_ids:
-                new_account_ids.append(account)
-
-        for account_line in new_account_ids:
-            local_last_period = last_period
-            local_currcy_period = self.period_begin_id
-            break_flag = True
-            while break_flag:
-                create_vals = []
-                initial_balance = self.get_initial_balance(
-                    local_last_period, account_line)
-                create_vals.append(initial_balance)
-                if local_currcy_period.is_closed:
-                    cumulative_year_occurrence = self.get_year_balance(
-                        local_currcy_period, account_line)
-                else:
-                    cumulative_year_occurrence = self.get_unclose_year_balance(copy.deepcopy(initial_balance),
-                                                                               local_currcy_period, account_line)
-                create_vals += cumulative_year_occurrence
-                if local_currcy_period.id == self.period_end_id.id:
-                    break_flag = False
-                local_last_period = local_currcy_period
-                local_currcy_period = self.env['create.trial.balance.wizard'].compute_next_period_id(
-                    local_currcy_period)
-                if not local_currcy_period:  # 无下一期间，退出循环。
-                    break_flag = False
-                # 无余额不显示
-                if self.no_balance \
-                        and cumulative_year_occurrence[0].get('credit') == 0 \
-                        and cumulative_year_occurrence[0].get('debit') == 0 \
-                        and cumulative_year_occurrence[1].get('credit') == 0 \
-                        and cumulative_year_occurrence[1].get('debit') == 0:
-                    continue
-                for vals in create_vals:
-                    del vals['date']
-                    vouchers_summary_ids.append(
-                        (self.env['general.ledger.account'].create(vals)).id)
+        vouchers_summary_ids = self.env['general.ledger.account'].create(
+            list(self._iter_ledger_vals(last_period, general=True))).ids
 
         view_id = self.env.ref('finance.general_ledger_account_tree').id
 
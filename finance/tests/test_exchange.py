@@ -1,4 +1,5 @@
 from odoo.tests.common import TransactionCase
+from odoo import fields
 from odoo.exceptions import UserError, ValidationError
 
 
@@ -75,3 +76,40 @@ class TestExchange(TransactionCase):
         date_wizard.create_exchange()
 
 
+
+    def test_get_rate_silent_by_date(self):
+        ''' 测试 按日期取汇率 及 批量取汇率 '''
+        usd = self.env.ref('base.USD')
+        currency_obj = self.env['res.currency']
+        self.env['res.currency.rate'].search(
+            [('currency_id', '=', usd.id)]).unlink()
+        self.env['res.currency.rate'].create([
+            {'currency_id': usd.id, 'name': '2015-01-01', 'rate': 6.1},
+            {'currency_id': usd.id, 'name': '2016-01-01', 'rate': 6.5},
+        ])
+        # 取日期(含)之前最近的汇率，早于所有汇率时为 1
+        self.assertEqual(currency_obj.get_rate_silent('2015-12-08', usd.id), 6.1)
+        self.assertEqual(currency_obj.get_rate_silent('2016-01-01', usd.id), 6.5)
+        self.assertEqual(currency_obj.get_rate_silent('2014-12-31', usd.id), 1.0)
+        # 无币别时为 0
+        self.assertEqual(currency_obj.get_rate_silent('2015-12-08', False), 0)
+        # 批量取汇率
+        rates = currency_obj.get_rates_silent(
+            [('2015-06-01', usd.id), ('2016-06-01', usd.id)])
+        self.assertEqual(rates[(usd.id, fields.Date.to_date('2015-06-01'))], 6.1)
+        self.assertEqual(rates[(usd.id, fields.Date.to_date('2016-06-01'))], 6.5)
+        # 修改汇率后缓存失效
+        self.env['res.currency.rate'].search(
+            [('currency_id', '=', usd.id), ('name', '=', '2015-01-01')]).rate = 6.2
+        self.assertEqual(currency_obj.get_rate_silent('2015-12-08', usd.id), 6.2)
+        # 保存点回滚后，不能取到已回滚的汇率
+        try:
+            with self.env.cr.savepoint():
+                self.env['res.currency.rate'].search(
+                    [('currency_id', '=', usd.id), ('name', '=', '2015-01-01')]).rate = 7.0
+                self.assertEqual(currency_obj.get_rate_silent('2015-12-08', usd.id), 7.0)
+                raise UserError('回滚')
+        except UserError:
+            pass
+        self.env['res.currency.rate'].invalidate_cache()
+        self.assertEqual(currency_obj.get_rate_silent('2015-12-08', usd.id), 6.2)
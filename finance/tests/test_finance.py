@@ -344,6 +344,30 @@ class TestFinanceAccount(TransactionCase):
     #     real_name = '%s %s %s' % (self.cash.code, self.cash.name, self.cash.balance)
     #     self.assertTrue(name[0][1] == real_name)
 
+    def test_account_balance(self):
+        '''凭证确认、撤销确认时增量更新科目期间发生额'''
+        voucher = self.env.ref('finance.voucher_1')
+        line = voucher.line_ids.filtered(lambda l: l.debit)[0]
+        account = line.account_id
+        before = account.get_balance(voucher.period_id.id)
+        voucher.voucher_done()
+        after = account.get_balance(voucher.period_id.id)
+        self.assertAlmostEqual(after['debit'] - before['debit'],
+                               sum(voucher.line_ids.filtered(
+                                   lambda l: l.account_id == account).mapped('debit')))
+        # 上级科目按下级科目汇总
+        if account.parent_id:
+            self.assertTrue(account.parent_id.debit >= account.debit)
+        voucher.voucher_draft()
+        self.assertAlmostEqual(
+            account.get_balance(voucher.period_id.id)['debit'], before['debit'])
+        # 重建后与增量结果一致
+        voucher.voucher_done()
+        account_balance = self.env['finance.account.balance']
+        expected = account_balance.get_account_balance(account)
+        account_balance.rebuild_balance()
+        self.assertEqual(account_balance.get_account_balance(account), expected)
+
     def test_name_search(self):
         '''会计科目按名字和编号搜索'''
         result = self.env['finance.account'].name_search('库存现金')
@@ -559,6 +583,24 @@ class TestCheckoutWizard(TransactionCase):
         self.env.ref('finance.period_201512').is_closed = True
         checkout_wizard_obj.recreate_voucher_name(period_id)
 
+    def test_recreate_voucher_name_bulk(self):
+        ''' 测试 按月重排凭证号 一次写回，并记录变化的凭证号 '''
+        checkout_wizard_obj = self.env['checkout.wizard']
+        period_id = self.env.ref('finance.period_201601')
+        self.env['ir.default'].set('finance.config.settings', 'defaul_auto_reset', True)
+        self.env['ir.default'].set('finance.config.settings', 'defaul_reset_init_number', 1)
+        self.env.ref('finance.period_201512').is_closed = True
+        vouchers = self.env['voucher'].search([('period_id', '=', period_id.id),
+                                               ('state', '=', 'done')], order='create_date, id')
+        changed = checkout_wizard_obj._renumber_vouchers(period_id, 1, 5, log_change=True)
+        self.assertEqual(vouchers.mapped('name'),
+                         ['%05d' % i for i in range(1, len(vouchers) + 1)])
+        self.assertEqual(self.env['change.voucher.name'].search_count(
+            [('period_id', '=', period_id.id)]), changed)
+        # 凭证号已连续时不再改动
+        self.assertEqual(
+            checkout_wizard_obj._renumber_vouchers(period_id, 1, 5, log_change=True), 0)
+
     def test_get_last_date(self):
         ''' Test: _get_last_date '''
         datetime_str_list = datetime.now().strftime("%Y-%m-%d").split('-')
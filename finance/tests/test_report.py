@@ -53,6 +53,30 @@ class TestReport(TransactionCase):
             last_period.is_closed = True
         report_default_period.create_trial_balance()
 
+    def test_trial_balance_rollup(self):
+        ''' 测试科目余额表 上级科目金额等于末级科目汇总 '''
+        report = self.env['create.trial.balance.wizard'].create(
+            {'period_id': self.period_201512.id})
+        report.create_trial_balance()
+        items = self.env['trial.balance'].search(
+            [('period_id', '=', self.period_201512.id)])
+        balance = dict((item.subject_name_id, item) for item in items)
+        for item in items.filtered(lambda t: t.account_type == 'view'):
+            children = items.filtered(
+                lambda t: t.account_type == 'normal' and
+                t.subject_name_id.parent_path.startswith(item.subject_name_id.parent_path))
+            self.assertAlmostEqual(item.current_occurrence_debit,
+                                   sum(children.mapped('current_occurrence_debit')))
+            self.assertAlmostEqual(item.ending_balance_credit,
+                                   sum(children.mapped('ending_balance_credit')))
+        # 本期发生额与凭证行汇总一致
+        period_balance = report.get_period_balance(self.period_201512.id)
+        for data in period_balance:
+            account = self.env['finance.account'].browse(data['account_id'])
+            if account.account_type == 'normal' and account in balance:
+                self.assertAlmostEqual(
+                    data['debit'], balance[account].current_occurrence_debit)
+
     def test_button_change_number(self):
         ''' 测试 调整累计数 弹窗'''
         report = self.env['create.trial.balance.wizard'].create(
@@ -360,6 +384,36 @@ class TestReport(TransactionCase):
         # get_initial_balance period 不存在
         wizard.get_initial_balance(False, wizard.subject_name_id)
 
+    def test_ledger_builder_matches_single_account(self):
+        '''批量生成的明细账与逐个科目计算的结果一致'''
+        month_end = self.env['checkout.wizard'].create({'date': '2015-12-31'})
+        month_end.onchange_period_id()
+        month_end.button_checkout()
+        bank = self.env.ref('finance.account_bank')
+        period = self.env.ref('finance.period_201601')
+        wizard = self.env['create.vouchers.summary.wizard'].create(
+            {'period_begin_id': period.id,
+             'period_end_id': period.id,
+             'subject_name_id': bank.id,
+             'subject_name_end_id': bank.id,
+             })
+        last_period = self.period_201512
+        rows = []
+        for vals in wizard._iter_ledger_vals(last_period):
+            rows.append(vals)
+            if vals['summary'] == bank.code + ' ' + bank.name + ":" + '本年累计':
+                break
+        initial_balance = wizard.get_initial_balance(last_period, bank)
+        details = wizard.get_current_occurrence_amount(period, bank)
+        totals = wizard.get_unclose_year_balance(dict(initial_balance), period, bank)
+        if totals[0]['debit'] or totals[0]['credit'] or totals[0]['balance']:
+            expected = [initial_balance] + details + totals
+            self.assertEqual(len(rows), len(expected))
+            self.assertEqual(rows[-2]['balance'], totals[0]['balance'])
+            self.assertEqual(rows[-2]['direction'], totals[0]['direction'])
+            self.assertEqual([r['balance'] for r in rows[1:-2]],
+                             [r['balance'] for r in details])
+
     def test_get_current_occurrence_amount(self):
         '''测试 本期的科目的 voucher_line的明细记录'''
         wizard = self.env['create.vouchers.summary.wizard'].create(
@@ -435,6 +489,34 @@ class TestReport(TransactionCase):
             balance_sheet_obj.cumulative_occurrence_balance_formula = ''
         report.create_profit_statement()
 
+    def test_compute_statement_values(self):
+        ''' 测试资产负债表和利润表公式一次编译、多期间一次计算 '''
+        month_end = self.env['checkout.wizard'].create({'date': '2015-12-31'})
+        month_end.onchange_period_id()
+        month_end.button_checkout()
+        report = self.env['create.balance.sheet.wizard'].create(
+            {'period_id': self.period_id})
+        report.create_balance_sheet()
+        periods = self.env['finance.period'].browse(
+            [self.period_id, self.period_201512.id])
+        values = report.compute_statement_values(periods)
+        period = report.period_id
+        for line in self.env['balance.sheet'].search([]):
+            self.assertAlmostEqual(
+                values['balance.sheet'][period.id][line.id]['ending_balance'],
+                report.deal_with_balance_formula(
+                    line.balance_formula, period,
+                    ['ending_balance_debit', 'ending_balance_credit']))
+            self.assertAlmostEqual(line.ending_balance,
+                                   values['balance.sheet'][period.id][line.id]['ending_balance'])
+        for line in self.env['profit.statement'].search([]):
+            self.assertAlmostEqual(
+                values['profit.statement'][period.id][line.id]['cumulative_occurrence_balance'],
+                report.deal_with_profit_formula(
+                    line.occurrence_balance_formula, period,
+                    ['cumulative_occurrence_debit', 'cumulative_occurrence_credit']))
+        self.assertIn(self.period_201512.id, values['balance.sheet'])
+
     def test_balance_sheet_default_period(self):
         ''' 测试资产负债表  wizard no period'''
         self.env['create.balance.sheet.wizard'].create({})
@@ -524,6 +606,25 @@ class TestCheckoutWizard(TransactionCase):
         with self.assertRaises(UserError):
             wizard.button_checkout()
 
+    def test_button_checkout_profit_lines_and_dupont(self):
+        '''结账时损益科目一次汇总，财务指标只为缺少指标的已结账期间计算'''
+        self.voucher_15_12.voucher_done()
+        self.checkout_voucher.voucher_done()
+        wizard = self.env['checkout.wizard'].create({'date': '2015-12-31'})
+        wizard.onchange_period_id()
+        lines, revenue_total, expense_total = \
+            wizard._get_profit_voucher_lines(self.period_15_12)
+        self.assertEqual(sum(l['debit'] for l in lines) - sum(l['credit'] for l in lines),
+                         revenue_total - expense_total)
+        wizard.button_checkout()
+        dupont = self.env['dupont'].search([('period_id', '=', self.period_15_12.id)])
+        self.assertTrue(dupont)
+        # 再次计算不会重复生成
+        self.env['dupont'].fill_missing()
+        self.assertEqual(
+            self.env['dupont'].search_count([('period_id', '=', self.period_15_12.id)]),
+            len(dupont))
+
     def test_button_checkout_period_month_notEuqal_12(self):
         ''' 结账按钮, 下一个期间不存在  month 不等于 12 '''
         wizard = self.env['checkout.wizard'].create({'date': '2016-05-13'})
@@ -1,6 +1,11 @@
+import logging
+import time
+
 from odoo import models, fields, api
 from odoo.exceptions import UserError
 
+_logger = logging.getLogger(__name__)
+
 
 class CheckoutWizard(models.TransientModel):
     '''月末结账的向导'''
@@ -30,10 +35,76 @@ class CheckoutWizard(models.TransientModel):
             wizard.period_id = self.env['finance.period'].with_context(
                 module_name='checkout_wizard').get_period(wizard.date)
 
+    def _log_stage(self, period, stage, start):
+        '''记录结账各阶段用时，返回当前时间作为下一阶段的开始时间'''
+        now = time.time()
+        _logger.info('月末结账 %s %s 用时 %.3fs', period.name, stage, now - start)
+        return now
+
+    def _get_profit_voucher_lines(self, period):
+        '''
+        一条分组查询取出本期收入类、费用类科目的发生额，生成结转到本年利润的凭证行
+        :return: 凭证行列表, 收入类科目合计, 费用类科目合计
+        '''
+        account_obj = self.env['finance.account']
+        accounts = account_obj.search([('costs_types', 'in', ('in', 'out'))])
+        self.env['voucher.line'].flush(['account_id', 'period_id', 'state', 'debit', 'credit'])
+        self.env.cr.execute('''
+            SELECT account_id, SUM(debit), SUM(credit)
+            FROM voucher_line
+            WHERE period_id = %s
+              AND state = 'done'
+              AND account_id IN %s
+            GROUP BY account_id
+        ''', (period.id, tuple(accounts.ids or [0])))
+        amounts = {account_id: (debit or 0, credit or 0)
+                   for account_id, debit, credit in self.env.cr.fetchall()}
+
+        voucher_line = []  # 生成的结账凭证行
+        revenue_total = 0  # 收入类科目合计
+        expense_total = 0  # 费用类科目合计
+        for account in accounts.filtered(lambda a: a.costs_types == 'in'):
+            debit, credit = amounts.get(account.id, (0, 0))
+            credit_total = credit - debit
+            revenue_total += credit_total
+            if credit_total != 0:  # 贷方冲借方
+                voucher_line.append({
+                    'name': '月末结账',
+                    'account_id': account.id,
+                    'debit': credit_total,
+                    'credit': 0,
+                })
+        for account in accounts.filtered(lambda a: a.costs_types == 'out'):
+            debit, credit = amounts.get(account.id, (0, 0))
+            debit_total = debit - credit
+            expense_total += debit_total
+            if debit_total != 0:  # 借方冲贷方
+                voucher_line.append({
+                    'name': '月末结账',
+                    'account_id': account.id,
+                    'debit': 0,
+                    'credit': debit_total,
+                })
+        return voucher_line, revenue_total, expense_total
+
+    def _get_year_profit_total(self, period, year_profit_account):
+        '''本年利润科目全年贷方减借方的合计'''
+        self.env['voucher.line'].flush(['account_id', 'period_id', 'state', 'debit', 'credit'])
+        self.env.cr.execute('''
+            SELECT COALESCE(SUM(line.credit - line.debit), 0)
+            FROM voucher_line line
+            JOIN finance_period period ON period.id = line.period_id
+            WHERE line.account_id = %s
+              AND period.year = %s
+              AND line.state = 'done'
+        ''', (year_profit_account.id, period.year))
+        return self.env.cr.fetchone()[0]
+
     def button_checkout(self):
         ''' 月末结账：结账 按钮 '''
         for balance in self:
             if balance.period_id:
+                start = time.time()
                 if balance.period_id.is_closed:
                     raise UserError('本期间%s已结账' % balance.period_id.name)
                 # 调用 生成科目余额表 向导的 计算上一个会计期间方法，得到 上一个会计期间
@@ -42,173 +113,112 @@ class CheckoutWizard(models.TransientModel):
                 if last_period:
                     if not last_period.is_closed:
                         raise UserError('上一个会计期间%s未结账' % last_period.name)
-                if balance.period_id.is_closed:
-                    # TODO 此处重复，应去掉
-                    raise UserError('本期间%s已结账' % balance.period_id.name)
-                else:
-                    voucher_obj = self.env['voucher']
-                    voucher_ids = voucher_obj.search(
-                        [('period_id', '=', balance.period_id.id),
-                         ('state', '!=', 'cancel')])
-                    draft_voucher_count = 0  # 未确认凭证个数
-                    for voucher_id in voucher_ids:
-                        if voucher_id.state != 'done':
-                            draft_voucher_count += 1
-                    if draft_voucher_count != 0:
-                        raise UserError('该期间有%s张凭证未确认' % draft_voucher_count)
-                    else:
-                        voucher_line = []  # 生成的结账凭证行
-                        account_obj = self.env['finance.account']
-                        company_obj = self.env['res.company']
-                        voucher_line_obj = self.env['voucher.line']
-                        revenue_account_ids = account_obj.search(
-                            [('costs_types', '=', 'in')])  # 收入类科目
-                        expense_account_ids = account_obj.search(
-                            [('costs_types', '=', 'out')])  # 费用类科目
-                        revenue_total = 0  # 收入类科目合计
-                        expense_total = 0  # 费用类科目合计
-                        for revenue_account_id in revenue_account_ids:
-                            voucher_line_ids = voucher_line_obj.search([
-                                ('account_id', '=', revenue_account_id.id),
-                                ('voucher_id.period_id', '=', balance.period_id.id),
-                                ('state', '=', 'done')])
-                            credit_total = 0
-                            for voucher_line_id in voucher_line_ids:
-                                credit_total += voucher_line_id.credit - voucher_line_id.debit
-                            revenue_total += credit_total
-                            if credit_total != 0:  # 贷方冲借方
-                                res = {
-                                    'name': '月末结账',
-                                    'account_id': revenue_account_id.id,
-                                    'debit': credit_total,
-                                    'credit': 0,
-                                }
-                                voucher_line.append(res)
-                        for expense_account_id in expense_account_ids:
-                            voucher_line_ids = voucher_line_obj.search([
-                                ('account_id', '=', expense_account_id.id),
-                                ('voucher_id.period_id', '=', balance.period_id.id),
-                                ('state', '=', 'done')])
-                            debit_total = 0
-                            for voucher_line_id in voucher_line_ids:
-                                debit_total += voucher_line_id.debit - voucher_line_id.credit
-                            expense_total += debit_total
-                            if debit_total != 0:  # 借方冲贷方
-                                res = {
-                                    'name': '月末结账',
-                                    'account_id': expense_account_id.id,
-                                    'debit': 0,
-                                    'credit': debit_total,
-                                }
-                                voucher_line.append(res)
-                        # 利润结余
-                        year_profit_account = self.env.user.company_id.profit_account
-                        remain_account = self.env.user.company_id.remain_account
-                        if not year_profit_account:
-                            raise UserError('公司本年利润科目未配置')
-                        if not remain_account:
-                            raise UserError('公司未分配利润科目未配置')
-                        if (revenue_total - expense_total) > 0:
-                            res = {
-                                'name': '利润结余',
-                                'account_id': year_profit_account.id,
-                                'debit': 0,
-                                'credit': revenue_total - expense_total,
-                            }
-                            voucher_line.append(res)
-                        if (revenue_total - expense_total) < 0:
-                            res = {
-                                'name': '利润结余',
-                                'account_id': year_profit_account.id,
-                                'debit': expense_total - revenue_total,
-                                'credit': 0,
-                            }
-                            voucher_line.append(res)
-                        # 生成凭证
-                        if voucher_line:
-                            valus = {
-                                'is_checkout': True,
-                                'date': self.date,
-                                'line_ids': [
-                                    (0, 0, line) for line in voucher_line],
-                            }
-                            voucher_profit = voucher_obj.create(valus)
-                            voucher_profit.voucher_done()
-                    year_account = None
-                    if balance.period_id.month == '12':
-                        year_profit_ids = voucher_line_obj.search([
-                            ('account_id', '=', year_profit_account.id),
-                            ('voucher_id.period_id.year', '=', balance.period_id.year),
-                            ('state', '=', 'done')])
-                        year_total = 0
-                        for year_profit_id in year_profit_ids:
-                            year_total += (year_profit_id.credit -
-                                           year_profit_id.debit)
-                        precision = self.env['decimal.precision'].precision_get(
-                            'Amount')
-                        year_total = round(year_total, precision)
-                        if year_total != 0:
-                            year_line_ids = [{
-                                'name': '年度结余',
-                                'account_id': remain_account.id,
-                                'debit': 0,
-                                'credit': year_total,
-                            }, {
-                                'name': '年度结余',
-                                'account_id': year_profit_account.id,
-                                'debit': year_total,
-                                'credit': 0,
-                            }]
-                            value = {'is_checkout': True,
-                                     'date': balance.date,
-                                     'line_ids': [
-                                         (0, 0, line) for line in year_line_ids],
-                                     }
-                            year_account = voucher_obj.create(value)  # 创建结转凭证
-                            year_account.voucher_done()  # 凭证确认
-                    # 生成科目余额表
-                    trial_wizard = self.env['create.trial.balance.wizard'].create({
-                        'period_id': balance.period_id.id,
+                voucher_obj = self.env['voucher']
+                # 未确认凭证个数
+                draft_voucher_count = voucher_obj.search_count(
+                    [('period_id', '=', balance.period_id.id),
+                     ('state', 'not in', ('cancel', 'done'))])
+                if draft_voucher_count != 0:
+                    raise UserError('该期间有%s张凭证未确认' % draft_voucher_count)
+                start = self._log_stage(balance.period_id, '检查', start)
+
+                voucher_line, revenue_total, expense_total = \
+                    self._get_profit_voucher_lines(balance.period_id)
+                # 利润结余
+                year_profit_account = self.env.user.company_id.profit_account
+                remain_account = self.env.user.company_id.remain_account
+                if not year_profit_account:
+                    raise UserError('公司本年利润科目未配置')
+                if not remain_account:
+                    raise UserError('公司未分配利润科目未配置')
+                if (revenue_total - expense_total) > 0:
+                    voucher_line.append({
+                        'name': '利润结余',
+                        'account_id': year_profit_account.id,
+                        'debit': 0,
+                        'credit': revenue_total - expense_total,
                     })
-                    trial_wizard.create_trial_balance()
-                    # 按用户设置重排结账会计期间凭证号（会计要求凭证号必须连续）
-                    self.recreate_voucher_name(balance.period_id)
-                    # 关闭会计期间
-                    balance.period_id.is_closed = True
-                    self.env['dupont'].fill(balance.period_id)
-                    pre_period = last_period
-                    while pre_period:
-                        self.env['dupont'].fill(pre_period)
-                        pre_period = self.env['create.trial.balance.wizard'].compute_last_period_id(
-                            pre_period)
-                    # 如果下一个会计期间没有，则创建。
-                    next_period = self.env['create.trial.balance.wizard'].compute_next_period_id(
-                        balance.period_id)
-                    if not next_period:
-                        if balance.period_id.month == '12':
-                            self.env['finance.period'].create({'year': str(int(balance.period_id.year) + 1),
-                                                               'month': '1', })
-                        else:
-                            self.env['finance.period'].create({'year': balance.period_id.year,
-                                                               'month': str(int(balance.period_id.month) + 1), })
-                    # 显示凭证
-                    view = self.env.ref('finance.voucher_form')
-                    if voucher_line or year_account:
-                        # 因重置凭证号，查找最后一张结转凭证
-                        voucher = self.env['voucher'].search(
-                            [('is_checkout', '=', True),
-                             ('period_id', '=', balance.period_id.id),
-                             ('state', '=', 'done')], order="create_date desc",
-                            limit=1)
-                        return {
-                            'name': '月末结账',
-                            
-                            'view_mode': 'form',
-                            'views': [(view.id, 'form')],
-                            'res_model': 'voucher',
-                            'type': 'ir.actions.act_window',
-                            'res_id': voucher_profit.id,
-                        }
+                if (revenue_total - expense_total) < 0:
+                    voucher_line.append({
+                        'name': '利润结余',
+                        'account_id': year_profit_account.id,
+                        'debit': expense_total - revenue_total,
+                        'credit': 0,
+                    })
+                # 生成凭证
+                voucher_profit = None
+                if voucher_line:
+                    valus = {
+                        'is_checkout': True,
+                        'date': self.date,
+                        'line_ids': [
+                            (0, 0, line) for line in voucher_line],
+                    }
+                    voucher_profit = voucher_obj.create(valus)
+                    voucher_profit.voucher_done()
+                start = self._log_stage(balance.period_id, '结转损益', start)
+
+                year_account = None
+                if balance.period_id.month == '12':
+                    precision = self.env['decimal.precision'].precision_get(
+                        'Amount')
+                    year_total = round(self._get_year_profit_total(
+                        balance.period_id, year_profit_account), precision)
+                    if year_total != 0:
+                        year_line_ids = [{
+                            'name': '年度结余',
+                            'account_id': remain_account.id,
+                            'debit': 0,
+                            'credit': year_total,
+                        }, {
+                            'name': '年度结余',
+                            'account_id': year_profit_account.id,
+                            'debit': year_total,
+                            'credit': 0,
+                        }]
+                        value = {'is_checkout': True,
+                                 'date': balance.date,
+                                 'line_ids': [
+                                     (0, 0, line) for line in year_line_ids],
+                                 }
+                        year_account = voucher_obj.create(value)  # 创建结转凭证
+                        year_account.voucher_done()  # 凭证确认
+                    start = self._log_stage(balance.period_id, '年度结余', start)
+                # 生成科目余额表
+                trial_wizard = self.env['create.trial.balance.wizard'].create({
+                    'period_id': balance.period_id.id,
+                })
+                trial_wizard.create_trial_balance()
+                start = self._log_stage(balance.period_id, '科目余额表', start)
+                # 按用户设置重排结账会计期间凭证号（会计要求凭证号必须连续）
+                self.recreate_voucher_name(balance.period_id)
+                start = self._log_stage(balance.period_id, '重排凭证号', start)
+                # 关闭会计期间
+                balance.period_id.is_closed = True
+                # 只计算还没有财务指标的已结账期间
+                self.env['dupont'].fill_missing()
+                start = self._log_stage(balance.period_id, '财务指标', start)
+                # 如果下一个会计期间没有，则创建。
+                next_period = self.env['create.trial.balance.wizard'].compute_next_period_id(
+                    balance.period_id)
+                if not next_period:
+                    if balance.period_id.month == '12':
+                        self.env['finance.period'].create({'year': str(int(balance.period_id.year) + 1),
+                                                           'month': '1', })
+                    else:
+                        self.env['finance.period'].create({'year': balance.period_id.year,
+                                                           'month': str(int(balance.period_id.month) + 1), })
+                # 显示凭证
+                view = self.env.ref('finance.voucher_form')
+                if voucher_line or year_account:
+                    return {
+                        'name': '月末结账',
+                        'view_mode': 'form',
+                        'views': [(view.id, 'form')],
+                        'res_model': 'voucher',
+                        'type': 'ir.actions.act_window',
+                        'res_id': (voucher_profit or year_account).id,
+                    }
 
     # 反结账
     def button_counter_checkout(self):
@@ -238,12 +248,62 @@ class CheckoutWizard(models.TransientModel):
                 for o in old:
                     o.unlink()
 
+    def _renumber_vouchers(self, period_id, start_number, padding, log_change=False):
+        '''
+        按创建时间顺序一次算出期间内已确认凭证的新凭证号，用一条 UPDATE 语句写回，
+        log_change 为真时把变化的凭证号一次写入 change.voucher.name
+        '''
+        voucher_obj = self.env['voucher']
+        voucher_obj.flush(['name', 'period_id', 'state'])
+        self.env.cr.execute('''
+            SELECT id, name
+            FROM voucher
+            WHERE period_id = %s
+              AND state = 'done'
+            ORDER BY create_date, id
+        ''', (period_id.id,))
+        changed_ids, before_names, after_names = [], [], []
+        number = start_number
+        for voucher_id, name in self.env.cr.fetchall():
+            # 产生凭证号
+            next_voucher_name = '%%0%sd' % padding % number
+            number += 1
+            if name != next_voucher_name:
+                changed_ids.append(voucher_id)
+                before_names.append(name)
+                after_names.append(next_voucher_name)
+        if not changed_ids:
+            return 0
+
+        # 更新凭证号
+        self.env.cr.execute('''
+            UPDATE voucher
+            SET name = new.name,
+                write_uid = %s,
+                write_date = (now() at time zone 'UTC')
+            FROM unnest(%s::int[], %s::varchar[]) AS new(id, name)
+            WHERE voucher.id = new.id
+        ''', (self.env.uid, changed_ids, after_names))
+        voucher_obj.invalidate_cache(['name'], changed_ids)
+
+        # 将老号写到变化表中去！
+        if log_change:
+            self.env['change.voucher.name'].flush()
+            self.env.cr.execute('''
+                INSERT INTO change_voucher_name
+                    (period_id, before_voucher_name, after_voucher_name, company_id,
+                     create_uid, create_date, write_uid, write_date)
+                SELECT %s, old_name, new_name, %s,
+                       %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC')
+                FROM unnest(%s::varchar[], %s::varchar[]) AS change(old_name, new_name)
+            ''', (period_id.id, self.env.company.id, self.env.uid, self.env.uid,
+                  before_names, after_names))
+        return len(changed_ids)
+
     # 按用户设置重排结账会计期间凭证号（会计要求凭证号必须连续）
     def recreate_voucher_name(self, period_id):
         # 取重排凭证设置
         # 是否重置凭证号
-        context = dict(self.env.context or {})
-        context['call_module'] = "checkout_wizard"
         auto_reset = self.env['ir.default'].get(
             'finance.config.settings', 'defaul_auto_reset')
         # 重置凭证间隔:年  月
@@ -284,39 +344,15 @@ class CheckoutWizard(models.TransientModel):
                             # 凭证号转换为数字
                             if last_period_voucher_name:  # 上一期间是否有凭证？
                                 last_voucher_number = int(
-                                    list(filter(str.isdigit, last_period_voucher_name.encode("utf-8")))) + 1
-                            # else:
-                            #    raise UserError(u'请核实上一个期间：%s是否有凭证！' % last_period.name)
+                                    ''.join(filter(str.isdigit, last_period_voucher_name)) or 0) + 1
                             last_period = self.env['create.trial.balance.wizard'].compute_last_period_id(
                                 last_period)
                 else:
                     last_voucher_number = reset_init_number
-                voucher_ids = voucher_obj.search(
-                    [('period_id', '=', period_id.id), ('state', '=', 'done')], order='create_date')
-                for voucher_id in voucher_ids:
-                    # 产生凭证号
-                    next_voucher_name = '%%0%sd' % seq_id.padding % last_voucher_number
-                    last_voucher_number += 1
-                    # 更新凭证号
-                    voucher_id.with_context(context).write(
-                        {'name': next_voucher_name})
+                self._renumber_vouchers(period_id, last_voucher_number, seq_id.padding)
             # 按月重置
             else:
                 if last_period and not last_period.is_closed:
                     raise UserError('上一个期间%s未结账' % last_period.name)
-                last_voucher_number = reset_init_number
-                voucher_ids = voucher_obj.search(
-                    [('period_id', '=', period_id.id), ('state', '=', 'done')], order='create_date')
-                for voucher_id in voucher_ids:
-                    # 产生凭证号
-                    next_voucher_name = '%%0%sd' % seq_id.padding % last_voucher_number
-                    # 更新凭证号,将老号写到变化表中去！
-                    if voucher_id.name != next_voucher_name:
-                        self.env['change.voucher.name'].create({
-                            'period_id': self.period_id.id,
-                            'before_voucher_name': voucher_id.name,
-                            'after_voucher_name': next_voucher_name,
-                        })
-                    voucher_id.with_context(context).write(
-                        {'name': next_voucher_name})
-                    last_voucher_number += 1
+                self._renumber_vouchers(period_id, reset_init_number, seq_id.padding,
+                                        log_change=True)
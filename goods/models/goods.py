@@ -1,5 +1,5 @@
 
-from odoo import models, fields, api
+from odoo import models, fields, api, tools
 from odoo.exceptions import UserError
 
 
@@ -11,11 +11,52 @@ class Goods(models.Model):
 
     def get_parent_tax_rate(self, parent_id):
         # 逐级取商品分类上的税率
-        tax_rate = parent_id.tax_rate
-        if not tax_rate and parent_id.parent_id:
-            tax_rate = self.get_parent_tax_rate(parent_id.parent_id)
+        return self.env['goods.class'].get_class_tax_rates().get(parent_id.id, False)
 
-        return tax_rate
+    @tools.ormcache()
+    def _get_goods_tax_rates(self):
+        """
+        缓存商品自身解析后的税率 {商品id: 税率}
+        商品上没有税率的取商品分类（逐级向上）的税率，都没有的不在结果中
+        """
+        class_rates = self.env['goods.class'].get_class_tax_rates()
+        self.env.cr.execute("""
+            SELECT id, tax_rate, goods_class_id
+            FROM goods
+            WHERE COALESCE(tax_rate, 0) != 0 OR goods_class_id IS NOT NULL
+        """)
+        res = {}
+        for goods_id, tax_rate, goods_class_id in self.env.cr.fetchall():
+            rate = tax_rate or class_rates.get(goods_class_id, False)
+            if rate:
+                res[goods_id] = rate
+        return res
+
+    def get_tax_rates(self, goods_ids, partner, type):
+        """
+        批量获得税率，返回 {商品id: 税率}
+        规则同 get_tax_rate，商品及商品分类上的税率从缓存中取
+        """
+        self.flush(['tax_rate', 'goods_class_id'])
+        self.env['goods.class'].flush(['tax_rate', 'parent_id'])
+        goods_rates = self._get_goods_tax_rates()
+        partner_tax_rate = partner and partner.tax_rate or False
+        if type == 'buy':
+            company_tax_rate = self.env.user.company_id.import_tax_rate
+        elif type == 'sell':
+            company_tax_rate = self.env.user.company_id.output_tax_rate
+        else:
+            company_tax_rate = None
+
+        res = {}
+        for goods_id in goods_ids:
+            goods_tax_rate = goods_rates.get(goods_id, False)
+            # 商品税率和业务伙伴税率做比较：如果都存在，取小的；其中一个存在取该值；都不存在取公司上的进/销项税
+            if goods_tax_rate and partner_tax_rate:
+                res[goods_id] = min(goods_tax_rate, partner_tax_rate)
+            else:
+                res[goods_id] = goods_tax_rate or partner_tax_rate or company_tax_rate
+        return res
 
     def get_tax_rate(self, goods, partner, type):
         """
@@ -25,34 +66,18 @@ class Goods(models.Model):
         """
         if not goods:
             return
-        goods_tax_rate, partner_tax_rate = False, False
-        # 如果商品上没有税率，则取商品分类上的税率
-        if goods.tax_rate:
-            goods_tax_rate = goods.tax_rate
-        elif goods.goods_class_id.tax_rate:
-            goods_tax_rate = goods.goods_class_id.tax_rate
-        elif goods.goods_class_id.parent_id:  # 逐级取商品分类上的税率
-            goods_tax_rate = self.get_parent_tax_rate(goods.goods_class_id.parent_id)
-
-        # 取业务伙伴税率
-        if partner:
-            partner_tax_rate = partner.tax_rate
-
-        # 商品税率和业务伙伴税率做比较，并根据情况返回
-        if goods_tax_rate and partner_tax_rate:
-            if goods_tax_rate >= partner_tax_rate:
-                return partner_tax_rate
-            else:
-                return goods_tax_rate
-        elif goods_tax_rate and not partner_tax_rate:
-            return goods_tax_rate
-        elif not goods_tax_rate and partner_tax_rate:
-            return partner_tax_rate
-        else:
-            if type == 'buy':
-                return self.env.user.company_id.import_tax_rate
-            elif type == 'sell':
-                return self.env.user.company_id.output_tax_rate
+        return self.get_tax_rates([goods.id], partner, type)[goods.id]
+
+    @api.model
+    def create(self, vals):
+        if vals.get('tax_rate') or vals.get('goods_class_id'):
+            self.clear_caches()
+        return super(Goods, self).create(vals)
+
+    def write(self, vals):
+        if 'tax_rate' in vals or 'goods_class_id' in vals:
+            self.clear_caches()
+        return super(Goods, self).write(vals)
 
     no_stock = fields.Boolean(u'虚拟商品')
     using_batch = fields.Boolean(u'管理批号')
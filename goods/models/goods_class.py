@@ -1,5 +1,5 @@
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 from odoo.exceptions import ValidationError, UserError
 
 class GoodsClass(models.Model):
@@ -12,6 +12,59 @@ class GoodsClass(models.Model):
         if not self._check_recursion():
             raise ValidationError(u'错误 ! 您不能创建循环分类')
 
+    @tools.ormcache()
+    def _get_class_tax_rates(self):
+        """
+        一次取出所有商品分类，沿上级分类解析出每个分类的税率 {分类id: 税率}
+        分类上没有税率的逐级取上级分类的税率，都没有的不在结果中
+        """
+        self.env.cr.execute("SELECT id, parent_id, tax_rate FROM goods_class")
+        rows = {class_id: (parent_id, tax_rate)
+                for class_id, parent_id, tax_rate in self.env.cr.fetchall()}
+        res = {}
+
+        def resolve(class_id):
+            if class_id in res:
+                return res[class_id]
+            chain = []
+            rate = False
+            while class_id and class_id in rows:
+                if class_id in res:
+                    rate = res[class_id]
+                    break
+                chain.append(class_id)
+                parent_id, tax_rate = rows[class_id]
+                if tax_rate:
+                    rate = tax_rate
+                    break
+                class_id = parent_id
+            for item in chain:
+                res[item] = rate
+            return rate
+
+        for class_id in rows:
+            resolve(class_id)
+        return {class_id: rate for class_id, rate in res.items() if rate}
+
+    def get_class_tax_rates(self):
+        '''取解析后的商品分类税率 {分类id: 税率}'''
+        self.flush(['tax_rate', 'parent_id'])
+        return self._get_class_tax_rates()
+
+    @api.model
+    def create(self, vals):
+        self.clear_caches()
+        return super(GoodsClass, self).create(vals)
+
+    def write(self, vals):
+        if 'tax_rate' in vals or 'parent_id' in vals:
+            self.clear_caches()
+        return super(GoodsClass, self).write(vals)
+
+    def unlink(self):
+        self.clear_caches()
+        return super(GoodsClass, self).unlink()
+
     name = fields.Char(required=True, string=u'名字')
     parent_id = fields.Many2one('goods.class', string=u'上级分类', index=True)
     child_id = fields.One2many('goods.class', 'parent_id', string=u'子分类')
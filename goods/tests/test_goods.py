@@ -121,6 +121,32 @@ class TestGoods(TransactionCase):
         # no goods
         self.goods_mouse.get_tax_rate(False, False, 'buy')
 
+    def test_get_tax_rates(self):
+        ''' Test: 批量取税率及缓存失效 '''
+        fruits_vegetables = self.env.ref('goods.fruits_vegetables')
+        keyboard = self.env.ref('goods.keyboard')
+        self.goods_mouse.tax_rate = False
+        keyboard.tax_rate = 6.0
+        self.goods_mouse.goods_class_id = fruits_vegetables.id
+        fruits_vegetables.tax_rate = 10.0
+        goods_ids = [self.goods_mouse.id, keyboard.id]
+        rates = self.env['goods'].get_tax_rates(goods_ids, False, 'buy')
+        self.assertEqual(rates, {self.goods_mouse.id: 10.0, keyboard.id: 6.0})
+
+        # 修改分类税率后缓存失效
+        fruits_vegetables.tax_rate = 9.0
+        rates = self.env['goods'].get_tax_rates(goods_ids, False, 'buy')
+        self.assertEqual(rates[self.goods_mouse.id], 9.0)
+
+        # 业务伙伴税率更小时取业务伙伴税率
+        partner = self.env.ref('core.jd')
+        partner.tax_rate = 5.0
+        rates = self.env['goods'].get_tax_rates(goods_ids, partner, 'sell')
+        self.assertEqual(rates, {self.goods_mouse.id: 5.0, keyboard.id: 5.0})
+        for goods in (self.goods_mouse, keyboard):
+            self.assertEqual(goods.get_tax_rate(goods, partner, 'sell'),
+                             rates[goods.id])
+
 
 class TestAttributes(TransactionCase):
 
@@ -31,6 +31,8 @@
         'views/other_money_order_view.xml',
         'views/money_transfer_order_view.xml',
         'views/reconcile_order_view.xml',
+        'wizard/auto_reconcile_wizard_view.xml',
+        'data/auto_reconcile_data.xml',
         'data/money_sequence.xml',
         'wizard/partner_statements_wizard_view.xml',
         'report/bank_statements_view.xml',
@@ -43,6 +45,8 @@
         'wizard/cash_flow_wizard_view.xml',
         'report/customer_statements_view.xml',
         'report/supplier_statements_view.xml',
+        'report/money_invoice_aging_view.xml',
+        'data/money_invoice_aging_data.xml',
         'security/ir.model.access.csv',
         'views/partner_view.xml',
         'views/generate_accounting.xml',
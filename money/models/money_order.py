@@ -21,10 +21,19 @@
 from odoo.exceptions import UserError, ValidationError
 
 from odoo import fields, models, api
-from odoo.tools import float_compare, float_is_zero
+from odoo.tools import float_compare, float_is_zero, float_round
 import datetime
+import logging
 #from datetime import datetime
 
+_logger = logging.getLogger(__name__)
+
+# 自动核销支持的业务类型：(收付款单类型, 结算单类别类型, 结算单行字段)
+AUTO_RECONCILE_TYPES = {
+    'adv_pay_to_get': ('get', 'income', 'receivable_source_ids'),
+    'adv_get_to_pay': ('pay', 'expense', 'payable_source_ids'),
+}
+
 
 class MoneyOrder(models.Model):
     _name = 'money.order'
@@ -255,8 +264,8 @@ class MoneyOrder(models.Model):
             source_lines.append((0,0,self._get_source_line(invoice)))
         self.source_ids = source_lines
 
-    def money_order_done(self):
-        '''对收付款单的审核按钮'''
+    def _check_money_order_done(self, decimal_amount):
+        '''审核前检查收付款单及其待核销行'''
         for order in self:
             if order.state == 'done':
                 raise UserError(u'请不要重复确认')
@@ -269,67 +278,151 @@ class MoneyOrder(models.Model):
             if order.advance_payment < 0 and order.source_ids:
                 raise UserError(u'本次核销金额不能大于付款金额。\n差额: %s' %
                                 (order.advance_payment))
+            for line in order.line_ids:
+                if not line.bank_id.account_id:
+                    raise UserError(u'请配置%s的会计科目' % (line.bank_id.name))
+            for source in order.source_ids:
+                '''float_compare(value1,value2): return -1, 0 or 1,
+                if 'value1' is lower than, equal to, or greater than 'value2' at the given precision'''
+                if float_compare(source.this_reconcile, abs(source.to_reconcile), precision_digits=decimal_amount.digits) == 1:
+                    raise UserError(u'本次核销金额不能大于未核销金额。\n 核销金额:%s 未核销金额:%s'
+                                    % (abs(source.to_reconcile), source.this_reconcile))
+
+    @api.model
+    def _lock_bank_balances(self, bank_ids):
+        '''
+        按 id 顺序锁定账户并返回锁定后的余额，多个收付款单并发审核同一账户时按相同顺序加锁，不会死锁
+        :return: {账户id: [余额, 外币金额]}
+        '''
+        if not bank_ids:
+            return {}
+        self.env.cr.execute('''
+            SELECT id, COALESCE(balance, 0), COALESCE(currency_amount, 0)
+              FROM bank_account
+             WHERE id IN %s
+          ORDER BY id
+               FOR UPDATE
+        ''', (tuple(bank_ids),))
+        return {bank_id: [balance, currency_amount]
+                for bank_id, balance, currency_amount in self.env.cr.fetchall()}
+
+    @api.model
+    def _lock_rows(self, table, ids):
+        '''按 id 顺序锁定记录'''
+        if ids:
+            self.env.cr.execute(
+                'SELECT id FROM %s WHERE id IN %%s ORDER BY id FOR UPDATE' % table,
+                (tuple(ids),))
+
+    @api.model
+    def _update_balances(self, model, deltas):
+        '''
+        按增量原子更新余额字段：UPDATE ... SET 字段 = 字段 + 增量
+        :param model: 模型名
+        :param deltas: {记录id: {字段名: 增量}}
+        '''
+        records = self.env[model].browse(sorted(deltas))
+        fnames = sorted(set(fname for vals in deltas.values() for fname in vals))
+        if not records or not fnames:
+            return
+        params = [records.ids]
+        for fname in fnames:
+            params.append([deltas[record_id].get(fname, 0.0) for record_id in records.ids])
+        self.env.cr.execute('''
+            UPDATE %(table)s t
+               SET %(sets)s,
+                   write_uid = %%s,
+                   write_date = (now() at time zone 'UTC')
+              FROM unnest(%%s::int[], %(arrays)s) AS d(id, %(columns)s)
+             WHERE t.id = d.id
+        ''' % {
+            'table': records._table,
+            'sets': ', '.join('%s = COALESCE(t.%s, 0) + d.%s' % (f, f, f) for f in fnames),
+            'arrays': ', '.join('%s::float8[]' for f in fnames),
+            'columns': ', '.join(fnames),
+        }, [self.env.uid] + params)
+        records.invalidate_cache(fnames + ['write_uid', 'write_date'])
+        # 触发依赖这些字段的存储计算字段重算，如入库单/发货单的付款状态
+        records.modified(fnames)
 
+    def money_order_done(self):
+        '''对收付款单的审核按钮，支持批量审核'''
+        decimal_amount = self.env.ref('core.decimal_amount')
+        company_currency = self.env.user.company_id.currency_id
+        self._check_money_order_done(decimal_amount)
+        self.flush()
+
+        # 固定按 账户、业务伙伴、结算单 的顺序加锁，每张表内按 id 排序
+        balances = self._lock_bank_balances(self.mapped('line_ids.bank_id').ids)
+        self._lock_rows('partner', sorted(self.mapped('partner_id').ids))
+        self._lock_rows('money_invoice', sorted(self.mapped('source_ids.name').ids))
+
+        bank_deltas = {}
+        partner_deltas = {}
+        invoice_deltas = {}
+        zero_sources = self.env['source.order.line']
+        for order in self:
             total = 0
             for line in order.line_ids:
                 rate_silent = self.env['res.currency'].get_rate_silent(
                     order.date, line.currency_id.id)
+                foreign = line.currency_id != company_currency
+                balance = balances[line.bank_id.id]
+                delta = bank_deltas.setdefault(
+                    line.bank_id.id, {'balance': 0.0, 'currency_amount': 0.0})
                 if order.type == 'pay':  # 付款账号余额减少, 退款账号余额增加
-                    decimal_amount = self.env.ref('core.decimal_amount')
-                    balance = line.currency_id != self.env.user.company_id.currency_id \
-                        and line.bank_id.currency_amount or line.bank_id.balance
-                    if float_compare(balance, line.amount,
+                    current = foreign and balance[1] or balance[0]
+                    if float_compare(current, line.amount,
                                      precision_digits=decimal_amount.digits) == -1:
                         raise UserError(u'账户余额不足。\n账户余额:%s 付款行金额:%s' %
-                                        (balance, line.amount))
-                    if line.currency_id != self.env.user.company_id.currency_id:  # 外币
-                        line.bank_id.currency_amount -= line.amount
-                        line.bank_id.balance -= line.amount * rate_silent
-                    else:
-                        line.bank_id.balance -= line.amount
+                                        (current, line.amount))
+                    sign = -1
                 else:  # 收款账号余额增加, 退款账号余额减少
-                    if line.currency_id != self.env.user.company_id.currency_id:    # 外币
-                        line.bank_id.currency_amount += line.amount
-                        line.bank_id.balance += line.amount * rate_silent
-                    else:
-                        line.bank_id.balance += line.amount
+                    sign = 1
+                if foreign:  # 外币
+                    delta['currency_amount'] += sign * line.amount
+                    delta['balance'] += sign * line.amount * rate_silent
+                    balance[1] += sign * line.amount
+                    balance[0] += sign * line.amount * rate_silent
+                else:
+                    delta['balance'] += sign * line.amount
+                    balance[0] += sign * line.amount
                 total += line.amount
 
+            delta = partner_deltas.setdefault(
+                order.partner_id.id, {'receivable': 0.0, 'payable': 0.0})
             if order.type == 'pay':
-                order.partner_id.payable -= total - order.discount_amount
+                delta['payable'] -= total - order.discount_amount
             else:
-                order.partner_id.receivable -= total + order.discount_amount
+                delta['receivable'] -= total + order.discount_amount
 
             # 更新结算单的未核销金额、已核销金额
             for source in order.source_ids:
-                '''float_compare(value1,value2): return -1, 0 or 1,
-                if 'value1' is lower than, equal to, or greater than 'value2' at the given precision'''
-                decimal_amount = self.env.ref('core.decimal_amount')
-                if float_compare(source.this_reconcile, abs(source.to_reconcile), precision_digits=decimal_amount.digits) == 1:
-                    raise UserError(u'本次核销金额不能大于未核销金额。\n 核销金额:%s 未核销金额:%s'
-                                    % (abs(source.to_reconcile), source.this_reconcile))
-
-                source.name.to_reconcile -= source.this_reconcile
-                source.name.reconciled += source.this_reconcile
-
-                if source.this_reconcile == 0: # 如果核销行的本次付款金额为0，删除
-                    source.unlink()
-
-            # 生成凭证并审核
-            if order.type == 'get':
-                voucher = order.create_money_order_get_voucher(
-                    order.line_ids, order.source_ids, order.partner_id, order.name, order.note or '')
-            else:
-                voucher = order.create_money_order_pay_voucher(
-                    order.line_ids, order.source_ids, order.partner_id, order.name, order.note or '')
-            voucher.voucher_done()
-
-            return order.write({
+                delta = invoice_deltas.setdefault(
+                    source.name.id, {'to_reconcile': 0.0, 'reconciled': 0.0})
+                delta['to_reconcile'] -= source.this_reconcile
+                delta['reconciled'] += source.this_reconcile
+                if source.this_reconcile == 0:  # 如果核销行的本次付款金额为0，删除
+                    zero_sources |= source
+
+        self._update_balances('bank.account', bank_deltas)
+        self._update_balances('partner', partner_deltas)
+        self._update_balances('money.invoice', invoice_deltas)
+        zero_sources.unlink()
+
+        # 一次生成所有凭证并审核
+        vouchers = self.env['voucher'].create(
+            [order._prepare_money_order_voucher() for order in self])
+        vouchers.voucher_done()
+
+        for order, voucher in zip(self, vouchers):
+            order.write({
                 'to_reconcile': order.advance_payment,
                 'reconciled': order.amount - order.advance_payment,
                 'voucher_id': voucher.id,
                 'state': 'done',
             })
+        return True
 
     def money_order_draft(self):
         """
@@ -412,128 +505,118 @@ class MoneyOrder(models.Model):
             'rate_silent': rate_silent or ''
         }
 
-    def _create_voucher_line(self, line, name, account_id, debit, credit, voucher_id, partner_id, currency_id):
-        line_data = self._prepare_vouch_line_data(
-            line, name, account_id, debit, credit, voucher_id, partner_id, currency_id)
-        voucher_line = self.env['voucher.line'].create(line_data)
-        return voucher_line
+    def _prepare_money_order_voucher(self):
+        """
+        准备收付款单对应凭证的数据
+        :return: 凭证 create 的 vals，含凭证行
+        """
+        self.ensure_one()
+        name = u"%s %s" % (self.name, self.note or '')
+        if self.type == 'get':
+            line_vals = self._prepare_money_order_get_voucher_lines(name)
+        else:
+            line_vals = self._prepare_money_order_pay_voucher_lines(name)
+        return {
+            'date': self.date,
+            'ref': '%s,%s' % (self._name, self.id),
+            'line_ids': [(0, 0, vals) for vals in line_vals],
+        }
+
+    def _prepare_voucher_line(self, line, name, account_id, debit, credit, partner_id, currency_id):
+        vals = self._prepare_vouch_line_data(
+            line, name, account_id, debit, credit, False, partner_id, currency_id)
+        del vals['voucher_id']
+        return vals
 
-    def create_money_order_get_voucher(self, line_ids, source_ids, partner, name, note):
+    def _prepare_money_order_get_voucher_lines(self, name):
         """
-        为收款单创建凭证
-        :param line_ids: 收款单明细
-        :param source_ids: 没用到
-        :param partner: 客户
-        :param name: 收款单名称
-        :return: 创建的凭证
+        为收款单准备凭证行
+        :param name: 收款单名称 备注
+        :return: 凭证行 vals 列表
         """
-        vouch_obj = self.env['voucher'].create({'date': self.date, 'ref': '%s,%s' % (self._name, self.id)})
-        # self.write({'voucher_id': vouch_obj.id})
+        res = []
         amount_all = 0.0
         line_data = False
-        for line in line_ids:
+        for line in self.line_ids:
             line_data = line
-            if not line.bank_id.account_id:
-                raise UserError(u'请配置%s的会计科目' % (line.bank_id.name))
             # 生成借方明细行
-            # param: line, name, account_id, debit, credit, voucher_id, partner_id
-            self._create_voucher_line(line,
-                                      u"%s %s" % (name, note),
-                                      line.bank_id.account_id.id,
-                                      line.amount,
-                                      0,
-                                      vouch_obj.id,
-                                      '',
-                                      line.currency_id.id
-                                      )
-
+            # param: line, name, account_id, debit, credit, partner_id
+            res.append(self._prepare_voucher_line(line,
+                                                  name,
+                                                  line.bank_id.account_id.id,
+                                                  line.amount,
+                                                  0,
+                                                  '',
+                                                  line.currency_id.id
+                                                  ))
             amount_all += line.amount
+        currency_id = line_data and line_data.currency_id.id or self.currency_id.id
         if self.discount_amount != 0:
             # 生成借方明细行
-            # param: False, name, account_id, debit, credit, voucher_id, partner_id
-            self._create_voucher_line(False,
-                                      u"%s 现金折扣 %s" % (name, note),
-                                      self.discount_account_id.id,
-                                      self.discount_amount,
-                                      0,
-                                      vouch_obj.id,
-                                      self.partner_id.id,
-                                      line_data and line_data.currency_id.id or self.currency_id.id
-                                      )
-
-        if partner.c_category_id:
-            partner_account_id = partner.c_category_id.account_id.id
+            res.append(self._prepare_voucher_line(False,
+                                                  u"%s 现金折扣 %s" % (self.name, self.note or ''),
+                                                  self.discount_account_id.id,
+                                                  self.discount_amount,
+                                                  0,
+                                                  self.partner_id.id,
+                                                  currency_id
+                                                  ))
 
         # 生成贷方明细行
-        # param: source, name, account_id, debit, credit, voucher_id, partner_id
-        self._create_voucher_line('',
-                                  u"%s %s" % (name, note),
-                                  partner_account_id,
-                                  0,
-                                  amount_all + self.discount_amount,
-                                  vouch_obj.id,
-                                  self.partner_id.id,
-                                  line_data and line.currency_id.id or self.currency_id.id
-                                  )
-        return vouch_obj
-
-    def create_money_order_pay_voucher(self, line_ids, source_ids, partner, name, note):
+        res.append(self._prepare_voucher_line('',
+                                              name,
+                                              self.partner_id.c_category_id.account_id.id,
+                                              0,
+                                              amount_all + self.discount_amount,
+                                              self.partner_id.id,
+                                              currency_id
+                                              ))
+        return res
+
+    def _prepare_money_order_pay_voucher_lines(self, name):
         """
-        为付款单创建凭证
-        :param line_ids: 付款单明细
-        :param source_ids: 没用到
-        :param partner: 供应商
-        :param name: 付款单名称
-        :return: 创建的凭证
+        为付款单准备凭证行
+        :param name: 付款单名称 备注
+        :return: 凭证行 vals 列表
         """
-        vouch_obj = self.env['voucher'].create({'date': self.date, 'ref': '%s,%s' % (self._name, self.id)})
-        # self.write({'voucher_id': vouch_obj.id})
-
+        res = []
         amount_all = 0.0
         line_data = False
-        for line in line_ids:
+        for line in self.line_ids:
             line_data = line
-            if not line.bank_id.account_id:
-                raise UserError(u'请配置%s的会计科目' % (line.bank_id.name))
             # 生成贷方明细行 credit
-            # param: line, name, account_id, debit, credit, voucher_id, partner_id
-            self._create_voucher_line(line,
-                                      u"%s %s" % (name, note),
-                                      line.bank_id.account_id.id,
-                                      0,
-                                      line.amount,
-                                      vouch_obj.id,
-                                      '',
-                                      line.currency_id.id
-                                      )
+            res.append(self._prepare_voucher_line(line,
+                                                  name,
+                                                  line.bank_id.account_id.id,
+                                                  0,
+                                                  line.amount,
+                                                  '',
+                                                  line.currency_id.id
+                                                  ))
             amount_all += line.amount
-        partner_account_id = partner.s_category_id.account_id.id
+        currency_id = line_data and line_data.currency_id.id or self.currency_id.id
 
         # 生成借方明细行 debit
-        # param: source, name, account_id, debit, credit, voucher_id, partner_id
-        self._create_voucher_line('',
-                                  u"%s %s" % (name, note),
-                                  partner_account_id,
-                                  amount_all - self.discount_amount,
-                                  0,
-                                  vouch_obj.id,
-                                  self.partner_id.id,
-                                  line_data and line.currency_id.id or self.currency_id.id
-                                  )
+        res.append(self._prepare_voucher_line('',
+                                              name,
+                                              self.partner_id.s_category_id.account_id.id,
+                                              amount_all - self.discount_amount,
+                                              0,
+                                              self.partner_id.id,
+                                              currency_id
+                                              ))
 
         if self.discount_amount != 0:
             # 生成借方明细行 debit
-            # param: False, name, account_id, debit, credit, voucher_id, partner_id
-            self._create_voucher_line(line_data and line_data or False,
-                                      u"%s 手续费 %s" % (name, note),
-                                      self.discount_account_id.id,
-                                      self.discount_amount,
-                                      0,
-                                      vouch_obj.id,
-                                      self.partner_id.id,
-                                      line_data and line.currency_id.id or self.currency_id.id
-                                      )
-        return vouch_obj
+            res.append(self._prepare_voucher_line(line_data and line_data or False,
+                                                  u"%s 手续费 %s" % (self.name, self.note or ''),
+                                                  self.discount_account_id.id,
+                                                  self.discount_amount,
+                                                  0,
+                                                  self.partner_id.id,
+                                                  currency_id
+                                                  ))
+        return res
 
 
 class MoneyOrderLine(models.Model):
@@ -634,7 +717,7 @@ class MoneyInvoice(models.Model):
                                  ondelete='restrict',
                                  help=u'该单据对应的业务伙伴')
     name = fields.Char(string=u'前置单据编号', copy=False,
-                       readonly=True, required=True,
+                       readonly=True, required=True, index=True,
                        help=u'该结算单编号，取自生成结算单的采购入库单和销售入库单')
     category_id = fields.Many2one('core.category', string=u'类别',
                                   ondelete='restrict',
@@ -650,7 +733,7 @@ class MoneyInvoice(models.Model):
                               digits='Amount',
                               help=u'原始单据已核销掉的金额')
     to_reconcile = fields.Float(string=u'未核销金额', readonly=True,
-                                digits='Amount',
+                                digits='Amount', index=True,
                                 help=u'原始单据未核销掉的金额')
     tax_amount = fields.Float(u'税额',
                               digits='Amount',
@@ -663,7 +746,7 @@ class MoneyInvoice(models.Model):
     pay_method = fields.Many2one('pay.method',
                                  string='付款方式',
                                  ondelete='restrict')
-    date_due = fields.Date(string=u'到期日',
+    date_due = fields.Date(string=u'到期日', index=True,
                            help=u'结算单的到期日')
     currency_id = fields.Many2one('res.currency', u'外币币别',
                                   help=u'原始单据对应的外币币别')
@@ -684,6 +767,14 @@ class MoneyInvoice(models.Model):
     note = fields.Char(u'备注',
                        help=u'可填入到期日计算的依据')
 
+    def init(self):
+        # 账龄分析只看未核销的结算单，按业务伙伴、到期日建部分索引
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS money_invoice_open_due_index
+                ON money_invoice (partner_id, date_due)
+             WHERE to_reconcile != 0
+        """)
+
     def money_invoice_done(self):
         """
         结算单审核方法
@@ -1184,6 +1275,238 @@ class ReconcileOrder(models.Model):
         return True
 
 
+    @api.model
+    def _get_auto_reconcile_partners(self, business_types):
+        '''有未核销预收/预付款的业务伙伴'''
+        self.env['money.order'].flush(['partner_id', 'type', 'state', 'to_reconcile'])
+        self.env.cr.execute('''
+            SELECT DISTINCT partner_id
+              FROM money_order
+             WHERE state = 'done'
+               AND to_reconcile > 0
+               AND type IN %s
+          ORDER BY partner_id
+        ''', (tuple(AUTO_RECONCILE_TYPES[t][0] for t in business_types),))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _get_open_reconcile_items(self, partner_ids, business_types, match_by, lock=False):
+        '''
+        一次取出一批业务伙伴所有未核销的预收/预付款单和结算单
+        预收/付款单按单据日期先后排序；结算单按到期日先后排序，match_by 为 bill_number 时先按纸质发票号排序
+        :param lock: 为 True 时先按 收付款单、结算单 的顺序锁定这些单据，再读取加锁后的未核销金额，
+                     避免生成核销方案后、更新金额前其他事务核销同一单据造成超额核销
+        :return: {(业务伙伴id, 业务类型): {'order': [行], 'invoice': [行]}}
+        '''
+        self.env['money.order'].flush(
+            ['partner_id', 'type', 'state', 'amount', 'date', 'reconciled', 'to_reconcile'])
+        self.env['money.invoice'].flush(
+            ['partner_id', 'category_id', 'amount', 'date', 'date_due',
+             'bill_number', 'reconciled', 'to_reconcile'])
+        order_types = {}
+        invoice_types = {}
+        for business_type in business_types:
+            order_type, invoice_type, _field = AUTO_RECONCILE_TYPES[business_type]
+            order_types[order_type] = business_type
+            invoice_types[invoice_type] = business_type
+        params = {
+            'by_bill': match_by == 'bill_number',
+            'partner_ids': tuple(partner_ids),
+            'invoice_types': tuple(invoice_types),
+            'order_types': tuple(order_types),
+        }
+        invoice_where = order_where = ''
+        if lock:
+            self.env.cr.execute('''
+                SELECT mo.id
+                  FROM money_order mo
+                 WHERE mo.partner_id IN %(partner_ids)s
+                   AND mo.type IN %(order_types)s
+                   AND mo.state = 'done'
+                   AND mo.to_reconcile > 0
+              ORDER BY mo.id
+                   FOR UPDATE
+            ''', params)
+            params['order_ids'] = [row[0] for row in self.env.cr.fetchall()]
+            self.env.cr.execute('''
+                SELECT mi.id
+                  FROM money_invoice mi
+                  JOIN core_category c ON c.id = mi.category_id
+                 WHERE mi.partner_id IN %(partner_ids)s
+                   AND c.type IN %(invoice_types)s
+                   AND mi.to_reconcile > 0
+              ORDER BY mi.id
+                   FOR UPDATE OF mi
+            ''', params)
+            params['invoice_ids'] = [row[0] for row in self.env.cr.fetchall()]
+            # 只核销已锁定的单据，读取的是加锁后最新提交的金额
+            invoice_where = 'AND mi.id = ANY(%(invoice_ids)s)'
+            order_where = 'AND mo.id = ANY(%(order_ids)s)'
+        self.env.cr.execute('''
+            SELECT 'invoice' AS kind, mi.id, mi.partner_id, c.type AS type,
+                   mi.category_id, mi.amount, mi.date, mi.date_due,
+                   COALESCE(mi.reconciled, 0) AS reconciled, mi.to_reconcile,
+                   CASE WHEN %(by_bill)s THEN mi.bill_number END AS sort_bill,
+                   COALESCE(mi.date_due, mi.date) AS sort_date
+              FROM money_invoice mi
+              JOIN core_category c ON c.id = mi.category_id
+             WHERE mi.partner_id IN %(partner_ids)s
+               AND c.type IN %(invoice_types)s
+               AND mi.to_reconcile > 0
+               ''' + invoice_where + '''
+            UNION ALL
+            SELECT 'order' AS kind, mo.id, mo.partner_id, mo.type AS type,
+                   NULL, mo.amount, mo.date, NULL,
+                   COALESCE(mo.reconciled, 0), mo.to_reconcile,
+                   NULL, mo.date
+              FROM money_order mo
+             WHERE mo.partner_id IN %(partner_ids)s
+               AND mo.type IN %(order_types)s
+               AND mo.state = 'done'
+               AND mo.to_reconcile > 0
+               ''' + order_where + '''
+          ORDER BY partner_id, kind, sort_bill NULLS LAST, sort_date, id
+        ''', params)
+        res = {}
+        for row in self.env.cr.dictfetchall():
+            types = row['kind'] == 'order' and order_types or invoice_types
+            key = (row['partner_id'], types[row['type']])
+            res.setdefault(key, {'order': [], 'invoice': []})[row['kind']].append(row)
+        return res
+
+    @api.model
+    def _match_reconcile_items(self, orders, invoices, digits):
+        '''
+        先进先出地用预收/付款单核销结算单
+        :return: ({收付款单id: 本次核销金额}, {结算单id: 本次核销金额})
+        '''
+        order_amounts = {}
+        invoice_amounts = {}
+        orders = [[row['id'], row['to_reconcile']] for row in orders]
+        invoices = [[row['id'], row['to_reconcile']] for row in invoices]
+        i = j = 0
+        while i < len(orders) and j < len(invoices):
+            amount = float_round(min(orders[i][1], invoices[j][1]),
+                                 precision_digits=digits)
+            if not float_is_zero(amount, precision_digits=digits):
+                order_amounts[orders[i][0]] = order_amounts.get(orders[i][0], 0) + amount
+                invoice_amounts[invoices[j][0]] = invoice_amounts.get(invoices[j][0], 0) + amount
+            orders[i][1] -= amount
+            invoices[j][1] -= amount
+            if float_is_zero(orders[i][1], precision_digits=digits):
+                i += 1
+            if float_is_zero(invoices[j][1], precision_digits=digits):
+                j += 1
+        return order_amounts, invoice_amounts
+
+    @api.model
+    def auto_reconcile(self, partner_ids=None, business_types=None,
+                       match_by='date_due', dry_run=False, batch_size=200):
+        '''
+        自动核销：为多个业务伙伴批量用预收冲应收、预付冲应付
+        :param partner_ids: 业务伙伴id列表，为空时取所有有未核销预收/预付款的业务伙伴
+        :param business_types: 业务类型，默认 预收冲应收 和 预付冲应付
+        :param match_by: date_due 按到期日先后核销；bill_number 按纸质发票号顺序核销
+        :param dry_run: 为 True 时只返回核销方案，不生成核销单
+        :param batch_size: 每批处理的业务伙伴个数，每批只查一次库
+        :return: 核销方案列表，每项为 {'partner_id', 'business_type', 'amount', 'orders', 'invoices'}，
+                 orders/invoices 为 {单据id: 本次核销金额}；非 dry_run 时带 'reconcile_id'
+        '''
+        business_types = business_types or list(AUTO_RECONCILE_TYPES)
+        digits = self.env.ref('core.decimal_amount').digits
+        if partner_ids is None:
+            partner_ids = self._get_auto_reconcile_partners(business_types)
+        plans = []
+        for start in range(0, len(partner_ids), batch_size):
+            batch_ids = partner_ids[start:start + batch_size]
+            items = self._get_open_reconcile_items(
+                batch_ids, business_types, match_by, lock=not dry_run)
+            batch_plans = []
+            for (partner_id, business_type), rows in sorted(items.items()):
+                order_amounts, invoice_amounts = self._match_reconcile_items(
+                    rows['order'], rows['invoice'], digits)
+                if not order_amounts:
+                    continue
+                batch_plans.append({
+                    'partner_id': partner_id,
+                    'business_type': business_type,
+                    'amount': sum(order_amounts.values()),
+                    'orders': order_amounts,
+                    'invoices': invoice_amounts,
+                    'rows': rows,
+                })
+            if not dry_run and batch_plans:
+                self._create_auto_reconcile_orders(batch_plans)
+            for plan in batch_plans:
+                del plan['rows']
+            plans += batch_plans
+        return plans
+
+    @api.model
+    def _create_auto_reconcile_orders(self, plans):
+        '''按核销方案生成已确认的核销单，并批量更新收付款单、结算单的已核销/未核销金额'''
+        order_deltas = {}
+        invoice_deltas = {}
+        vals_list = []
+        for plan in plans:
+            advance_lines = []
+            for row in plan['rows']['order']:
+                amount = plan['orders'].get(row['id'])
+                if not amount:
+                    continue
+                advance_lines.append((0, 0, {
+                    'name': row['id'],
+                    'amount': row['amount'],
+                    'date': row['date'],
+                    'reconciled': row['reconciled'],
+                    'to_reconcile': row['to_reconcile'],
+                    'this_reconcile': amount,
+                }))
+                order_deltas[row['id']] = {'to_reconcile': -amount, 'reconciled': amount}
+            source_lines = []
+            for row in plan['rows']['invoice']:
+                amount = plan['invoices'].get(row['id'])
+                if not amount:
+                    continue
+                source_lines.append((0, 0, {
+                    'name': row['id'],
+                    'category_id': row['category_id'],
+                    'amount': row['amount'],
+                    'date': row['date'],
+                    'reconciled': row['reconciled'],
+                    'to_reconcile': row['to_reconcile'],
+                    'date_due': row['date_due'],
+                    'this_reconcile': amount,
+                }))
+                invoice_deltas[row['id']] = {'to_reconcile': -amount, 'reconciled': amount}
+            vals_list.append({
+                'partner_id': plan['partner_id'],
+                'business_type': plan['business_type'],
+                'note': u'自动核销',
+                'state': 'done',
+                'advance_payment_ids': advance_lines,
+                AUTO_RECONCILE_TYPES[plan['business_type']][2]: source_lines,
+            })
+
+        money_order = self.env['money.order']
+        # 单据已在 _get_open_reconcile_items 读取金额前锁定
+        money_order._update_balances('money.order', order_deltas)
+        money_order._update_balances('money.invoice', invoice_deltas)
+        reconciles = self.create(vals_list)
+        for plan, reconcile in zip(plans, reconciles):
+            plan['reconcile_id'] = reconcile.id
+        return reconciles
+
+    @api.model
+    def cron_auto_reconcile(self, match_by='date_due', dry_run=False):
+        '''定时任务：自动核销所有业务伙伴的预收/预付款'''
+        plans = self.auto_reconcile(match_by=match_by, dry_run=dry_run)
+        _logger.info(u'自动核销%s：%s 个业务伙伴/业务类型，合计核销金额 %s',
+                     dry_run and u'(试算)' or '', len(plans),
+                     sum(plan['amount'] for plan in plans))
+        return True
+
+
 class AdvancePayment(models.Model):
     _name = 'advance.payment'
     _description = u'核销单预收付款行'
@@ -3,3 +3,4 @@ from . import other_money_statements
 from . import money_get_pay
 from . import customer_statements
 from . import supplier_statements
+from . import money_invoice_aging
@@ -9,15 +9,6 @@ class BankStatementsReport(models.Model):
     _auto = False
     _order = 'date'
 
-    @api.depends('get', 'pay', 'bank_id')
-    def _compute_balance(self):
-        # 相邻的两条记录，bank_id不同，重新计算账户余额
-        for bsr in self:
-            pre_record = bsr.search(
-                [('id', '<=', bsr.id), ('bank_id', '=', bsr.bank_id.id)])
-            for pre in pre_record:
-                bsr.balance += pre.get - pre.pay
-
     bank_id = fields.Many2one('bank.account', string=u'账户名称', readonly=True)
     date = fields.Date(string=u'日期', readonly=True)
     name = fields.Char(string=u'单据编号', readonly=True)
@@ -25,8 +16,8 @@ class BankStatementsReport(models.Model):
                        digits='Amount')
     pay = fields.Float(string=u'支出', readonly=True,
                        digits='Amount')
-    balance = fields.Float(string=u'账户余额',
-                           compute='_compute_balance', readonly=True,
+    # 账户余额在视图中按账户累计，bank_id不同重新计算
+    balance = fields.Float(string=u'账户余额', readonly=True,
                            digits='Amount')
     partner_id = fields.Many2one('partner', string=u'往来单位', readonly=True)
     note = fields.Char(string=u'备注', readonly=True)
@@ -37,13 +28,15 @@ class BankStatementsReport(models.Model):
         tools.drop_view_if_exists(cr, 'bank_statements_report')
         cr.execute("""
             CREATE or REPLACE VIEW bank_statements_report AS (
-            SELECT  ROW_NUMBER() OVER(ORDER BY bank_id,date) AS id,
+            SELECT  ROW_NUMBER() OVER(ORDER BY bank_id, date, name) AS id,
                     bank_id,
                     date,
                     name,
                     get,
                     pay,
-                    balance,
+                    SUM(get - pay) OVER(
+                        PARTITION BY bank_id ORDER BY date, name
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS balance,
                     partner_id,
                     note
             FROM
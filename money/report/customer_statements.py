@@ -10,15 +10,6 @@ class CustomerStatementsReport(models.Model):
     _auto = False
     _order = 'id, date'
 
-    @api.depends('amount', 'pay_amount', 'partner_id')
-    def _compute_balance_amount(self):
-        # 相邻的两条记录，partner不同，应收款余额重新计算
-        for cba in self:
-            pre_record = cba.search(
-                [('id', '<=', cba.id), ('partner_id', '=', cba.partner_id.id)])
-            for pre in pre_record:
-                cba.balance_amount += pre.amount - pre.pay_amount - pre.discount_money
-
     partner_id = fields.Many2one('partner', string=u'业务伙伴', readonly=True)
     name = fields.Char(string=u'单据编号', readonly=True)
     date = fields.Date(string=u'单据日期', readonly=True)
@@ -27,8 +18,8 @@ class CustomerStatementsReport(models.Model):
                           digits='Amount')
     pay_amount = fields.Float(string=u'实际收款金额', readonly=True,
                               digits='Amount')
-    balance_amount = fields.Float(string=u'应收款余额',
-                                  compute='_compute_balance_amount',
+    # 应收款余额在视图中按业务伙伴累计，partner不同重新计算
+    balance_amount = fields.Float(string=u'应收款余额', readonly=True,
                                   digits='Amount')
     discount_money = fields.Float(string=u'收款折扣', readonly=True,
                                   digits='Amount')
@@ -40,7 +31,7 @@ class CustomerStatementsReport(models.Model):
         tools.drop_view_if_exists(cr, 'customer_statements_report')
         cr.execute("""
             CREATE or REPLACE VIEW customer_statements_report AS (
-            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc) AS id,
+            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc, done_date, name) AS id,
                     partner_id,
                     name,
                     date,
@@ -48,7 +39,9 @@ class CustomerStatementsReport(models.Model):
                     amount,
                     pay_amount,
                     discount_money,
-                    balance_amount,
+                    SUM(amount - pay_amount - discount_money) OVER(
+                        PARTITION BY partner_id ORDER BY date, amount desc, done_date, name
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS balance_amount,
                     note
             FROM
                 (
@@ -0,0 +1,137 @@
+
+from odoo import fields, models, api, tools
+
+AGING_BUCKETS = [
+    ('not_due', u'未到期'),
+    ('0_30', u'逾期1-30天'),
+    ('31_60', u'逾期31-60天'),
+    ('61_90', u'逾期61-90天'),
+    ('90_plus', u'逾期90天以上'),
+]
+
+INVOICE_TYPE = [
+    ('income', u'应收'),
+    ('expense', u'应付'),
+]
+
+
+def aging_query(date_expr):
+    '''
+    未核销结算单账龄明细的 SQL，逾期天数和账龄区间在数据库中计算
+    :param date_expr: 计算账龄的日期表达式，如 CURRENT_DATE 或 %(date)s
+    '''
+    return """
+        SELECT mi.id,
+               mi.partner_id,
+               mi.category_id,
+               c.type AS type,
+               mi.name,
+               mi.date,
+               mi.date_due,
+               mi.to_reconcile,
+               a.overdue_days,
+               CASE WHEN a.overdue_days = 0 THEN 'not_due'
+                    WHEN a.overdue_days <= 30 THEN '0_30'
+                    WHEN a.overdue_days <= 60 THEN '31_60'
+                    WHEN a.overdue_days <= 90 THEN '61_90'
+                    ELSE '90_plus' END AS bucket,
+               CASE WHEN a.overdue_days = 0 THEN mi.to_reconcile ELSE 0 END AS amount_not_due,
+               CASE WHEN a.overdue_days BETWEEN 1 AND 30 THEN mi.to_reconcile ELSE 0 END AS amount_0_30,
+               CASE WHEN a.overdue_days BETWEEN 31 AND 60 THEN mi.to_reconcile ELSE 0 END AS amount_31_60,
+               CASE WHEN a.overdue_days BETWEEN 61 AND 90 THEN mi.to_reconcile ELSE 0 END AS amount_61_90,
+               CASE WHEN a.overdue_days > 90 THEN mi.to_reconcile ELSE 0 END AS amount_90_plus
+          FROM money_invoice mi
+          JOIN core_category c ON c.id = mi.category_id
+          CROSS JOIN LATERAL (
+              SELECT GREATEST(%(date)s::date - COALESCE(mi.date_due, %(date)s::date), 0) AS overdue_days
+          ) a
+         WHERE mi.state = 'done'
+           AND mi.to_reconcile != 0
+           AND c.type IN ('income', 'expense')
+    """ % {'date': date_expr}
+
+
+class MoneyInvoiceAgingReport(models.Model):
+    _name = 'money.invoice.aging.report'
+    _description = u'应收应付账龄分析表'
+    _auto = False
+    _order = 'partner_id, date_due'
+    _depends = {
+        'money.invoice': ['partner_id', 'category_id', 'name', 'date', 'date_due',
+                          'to_reconcile', 'state'],
+        'core.category': ['type'],
+    }
+
+    partner_id = fields.Many2one('partner', u'往来单位')
+    category_id = fields.Many2one('core.category', u'类别')
+    type = fields.Selection(INVOICE_TYPE, u'应收/应付')
+    name = fields.Char(u'前置单据编号')
+    date = fields.Date(u'日期')
+    date_due = fields.Date(u'到期日')
+    to_reconcile = fields.Float(u'未核销金额', digits='Amount')
+    overdue_days = fields.Integer(u'逾期天数')
+    bucket = fields.Selection(AGING_BUCKETS, u'账龄')
+    amount_not_due = fields.Float(u'未到期', digits='Amount')
+    amount_0_30 = fields.Float(u'1-30天', digits='Amount')
+    amount_31_60 = fields.Float(u'31-60天', digits='Amount')
+    amount_61_90 = fields.Float(u'61-90天', digits='Amount')
+    amount_90_plus = fields.Float(u'90天以上', digits='Amount')
+
+    def init(self):
+        cr = self._cr
+        tools.drop_view_if_exists(cr, 'money_invoice_aging_report')
+        cr.execute("""
+            CREATE or REPLACE VIEW money_invoice_aging_report AS (%s)
+        """ % aging_query('CURRENT_DATE'))
+
+
+class MoneyInvoiceAgingSnapshot(models.Model):
+    _name = 'money.invoice.aging.snapshot'
+    _description = u'账龄快照'
+    _order = 'date desc, partner_id'
+
+    date = fields.Date(u'快照日期', required=True, index=True)
+    partner_id = fields.Many2one('partner', u'往来单位', index=True,
+                                 ondelete='cascade')
+    type = fields.Selection(INVOICE_TYPE, u'应收/应付')
+    invoice_count = fields.Integer(u'结算单数')
+    to_reconcile = fields.Float(u'未核销金额', digits='Amount')
+    amount_not_due = fields.Float(u'未到期', digits='Amount')
+    amount_0_30 = fields.Float(u'1-30天', digits='Amount')
+    amount_31_60 = fields.Float(u'31-60天', digits='Amount')
+    amount_61_90 = fields.Float(u'61-90天', digits='Amount')
+    amount_90_plus = fields.Float(u'90天以上', digits='Amount')
+
+    @api.model
+    def take_snapshot(self, date=None):
+        '''
+        按业务伙伴、应收/应付汇总账龄，写入某一天的快照；同一天重复执行时覆盖
+        :return: 快照行数
+        '''
+        date = fields.Date.to_date(date) or fields.Date.context_today(self)
+        self.env['money.invoice'].flush(
+            ['partner_id', 'category_id', 'date_due', 'to_reconcile', 'state'])
+        self.env['core.category'].flush(['type'])
+        cr = self.env.cr
+        cr.execute('DELETE FROM money_invoice_aging_snapshot WHERE date = %(date)s',
+                   {'date': date})
+        cr.execute("""
+            INSERT INTO money_invoice_aging_snapshot
+                   (date, partner_id, type, invoice_count, to_reconcile,
+                    amount_not_due, amount_0_30, amount_31_60, amount_61_90, amount_90_plus,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT %%(date)s, aging.partner_id, aging.type, COUNT(*), SUM(aging.to_reconcile),
+                   SUM(aging.amount_not_due), SUM(aging.amount_0_30), SUM(aging.amount_31_60),
+                   SUM(aging.amount_61_90), SUM(aging.amount_90_plus),
+                   %%(uid)s, now() at time zone 'UTC', %%(uid)s, now() at time zone 'UTC'
+              FROM (%s) aging
+          GROUP BY aging.partner_id, aging.type
+        """ % aging_query('%(date)s'), {'date': date, 'uid': self.env.uid})
+        self.invalidate_cache()
+        return cr.rowcount
+
+    @api.model
+    def cron_take_snapshot(self):
+        '''定时任务：每晚生成账龄快照'''
+        self.take_snapshot()
+        return True
@@ -7,15 +7,6 @@ class SupplierStatementsReport(models.Model):
     _auto = False
     _order = 'id, date'
 
-    @api.depends('amount', 'pay_amount', 'partner_id')
-    def _compute_balance_amount(self):
-        # 相邻的两条记录，partner不同，应付款余额要清零并重新计算
-        for ssp in self:
-            pre_record = ssp.search(
-                [('id', '<=', ssp.id), ('partner_id', '=', ssp.partner_id.id)])
-            for pre in pre_record:
-                ssp.balance_amount += pre.amount - pre.pay_amount + pre.discount_money
-
     partner_id = fields.Many2one('partner', string=u'业务伙伴', readonly=True)
     name = fields.Char(string=u'单据编号', readonly=True)
     date = fields.Date(string=u'单据日期', readonly=True)
@@ -26,9 +17,9 @@ class SupplierStatementsReport(models.Model):
                               digits='Amount')
     discount_money = fields.Float(string=u'付款折扣', readonly=True,
                                   digits='Amount')
+    # 应付款余额在视图中按业务伙伴累计，partner不同重新计算
     balance_amount = fields.Float(
         string=u'应付款余额',
-        compute='_compute_balance_amount',
         readonly=True,
         digits='Amount')
     note = fields.Char(string=u'备注', readonly=True)
@@ -39,7 +30,7 @@ class SupplierStatementsReport(models.Model):
         tools.drop_view_if_exists(cr, 'supplier_statements_report')
         cr.execute("""
             CREATE or REPLACE VIEW supplier_statements_report AS (
-            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc) AS id,
+            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc, done_date, name) AS id,
                     partner_id,
                     name,
                     date,
@@ -47,7 +38,9 @@ class SupplierStatementsReport(models.Model):
                     amount,
                     pay_amount,
                     discount_money,
-                    balance_amount,
+                    SUM(amount - pay_amount + discount_money) OVER(
+                        PARTITION BY partner_id ORDER BY date, amount desc, done_date, name
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS balance_amount,
                     note
             FROM
                 (
@@ -1,4 +1,6 @@
 from odoo.tests.common import TransactionCase
+from odoo import fields
+from datetime import timedelta
 from odoo.exceptions import UserError
 
 
@@ -201,3 +203,48 @@ class TestInvoice(TransactionCase):
         })
         invoice.date_due = '2016-04-10'
         self.assertEqual(invoice.overdue_amount, 117)
+
+    def test_money_invoice_aging(self):
+        """
+        账龄分析表按逾期天数分区间，账龄快照按业务伙伴汇总
+        """
+        today = fields.Date.context_today(self.env['money.invoice'])
+        partner = self.env['partner'].create({
+            'name': 'Aging',
+            'c_category_id': self.cate.id,
+            'main_mobile': '14957236659',
+        })
+        invoices = self.env['money.invoice']
+        for name, amount, days in [('aging_1', 100, 45), ('aging_2', 50, 100), ('aging_3', 20, -5)]:
+            invoice = self.env['money.invoice'].create({
+                'name': name, 'date': today - timedelta(days=120),
+                'partner_id': partner.id,
+                'category_id': self.env.ref('money.core_category_sale').id,
+                'amount': amount,
+            })
+            if invoice.state == 'draft':
+                invoice.money_invoice_done()
+            invoice.date_due = today - timedelta(days=days)
+            invoices |= invoice
+
+        rows = self.env['money.invoice.aging.report'].search(
+            [('id', 'in', invoices.ids)], order='id')
+        self.assertEqual(rows.mapped('bucket'), ['31_60', '90_plus', 'not_due'])
+        self.assertEqual(rows.mapped('overdue_days'), [45, 100, 0])
+        self.assertEqual(rows[0].amount_31_60, 100)
+        self.assertEqual(rows[1].amount_90_plus, 50)
+        self.assertEqual(rows[2].amount_not_due, 20)
+
+        snapshot_obj = self.env['money.invoice.aging.snapshot']
+        snapshot_obj.take_snapshot()
+        # 同一天重复生成快照时覆盖
+        snapshot_obj.take_snapshot()
+        snapshot = snapshot_obj.search([('date', '=', today),
+                                        ('partner_id', '=', partner.id)])
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(snapshot.type, 'income')
+        self.assertEqual(snapshot.invoice_count, 3)
+        self.assertEqual(snapshot.to_reconcile, 170)
+        self.assertEqual(snapshot.amount_31_60, 100)
+        self.assertEqual(snapshot.amount_90_plus, 50)
+        self.assertEqual(snapshot.amount_not_due, 20)
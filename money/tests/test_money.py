@@ -48,6 +48,30 @@ class TestMoneyOrder(TransactionCase):
         with self.assertRaises(UserError):
             self.env.ref('money.pay_2000').money_order_draft()
 
+    def test_money_order_done_batch(self):
+        ''' 测试批量审核收付款单：余额按增量更新，每张单据生成各自的凭证 '''
+        last_balance = self.env.ref('core.comm').balance
+        jd_receivable = self.env.ref('core.jd').receivable
+        lenovo_payable = self.env.ref('core.lenovo').payable
+        orders = self.env.ref('money.get_40000') | self.env.ref('money.pay_2000')
+        # 先收后付，同一批内付款可以使用本批收到的款项
+        orders.money_order_done()
+        self.assertEqual(orders.mapped('state'), ['done', 'done'])
+        self.assertEqual(len(orders.mapped('voucher_id')), 2)
+        self.assertEqual(orders.mapped('voucher_id.state'), ['done', 'done'])
+        self.assertEqual(
+            self.env.ref('core.comm').balance,
+            last_balance + 40000 - 2000)
+        self.assertEqual(
+            self.env.ref('core.jd').receivable,
+            jd_receivable - 40000)
+        self.assertEqual(
+            self.env.ref('core.lenovo').payable,
+            lenovo_payable - 2000)
+        # 已审核的单据不能再次审核
+        with self.assertRaises(UserError):
+            orders.money_order_done()
+
     def test_money_order_draft_voucher_done(self):
         ''' 测试收付款反审核 ：审核后的凭证先反审核再删除 '''
         self.env.ref('money.get_40000').money_order_done()
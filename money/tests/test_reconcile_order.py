@@ -42,6 +42,38 @@ class TestReconcileOrder(TransactionCase):
         reconcile.receivable_source_ids[0].this_reconcile = 300.0
         reconcile.reconcile_order_done()
 
+    def test_auto_reconcile(self):
+        '''测试自动核销: 试算不改数据，核销后生成已确认的核销单'''
+        jd = self.env.ref('core.jd')
+        money_order = self.env.ref('money.get_40000')
+        order_to_reconcile = money_order.to_reconcile
+        reconcile_obj = self.env['reconcile.order']
+        plans = reconcile_obj.auto_reconcile(partner_ids=[jd.id], dry_run=True)
+        self.assertEqual([(p['partner_id'], p['business_type']) for p in plans],
+                         [(jd.id, 'adv_pay_to_get')])
+        plan = plans[0]
+        self.assertAlmostEqual(sum(plan['orders'].values()),
+                               sum(plan['invoices'].values()))
+        self.assertIn(self.get_invoice.id, plan['invoices'])
+        # 试算不核销
+        self.assertEqual(self.get_invoice.to_reconcile, 300.0)
+        self.assertFalse('reconcile_id' in plan)
+
+        plans = reconcile_obj.auto_reconcile(partner_ids=[jd.id])
+        reconcile = reconcile_obj.browse(plans[0]['reconcile_id'])
+        self.assertEqual(reconcile.state, 'done')
+        self.assertEqual(reconcile.business_type, 'adv_pay_to_get')
+        self.assertEqual(reconcile.receivable_source_ids.mapped('name'),
+                         self.env['money.invoice'].browse(list(plan['invoices'])))
+        amount = plan['invoices'][self.get_invoice.id]
+        self.assertAlmostEqual(self.get_invoice.reconciled, amount)
+        self.assertAlmostEqual(self.get_invoice.to_reconcile, 300.0 - amount)
+        self.assertAlmostEqual(money_order.to_reconcile,
+                               order_to_reconcile - plan['orders'].get(money_order.id, 0))
+        # 再次核销时已无可核销的结算单或预收款
+        plans = reconcile_obj.auto_reconcile(partner_ids=[jd.id], dry_run=True)
+        self.assertFalse(plans)
+
     def test_adv_get_to_pay(self):
         '''测试核销单: 预付冲应付'''
         self.env.ref('money.pay_2000').money_order_done()
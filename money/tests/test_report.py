@@ -51,6 +51,17 @@ class TestReport(TransactionCase):
             self.assertNotEqual(str(money.balance), 'kaihe')
             money.find_source_order()
 
+    def test_bank_report_running_balance(self):
+        ''' 测试 银行对账单报表 账户余额按账户逐行累计 '''
+        self.env.ref('money.get_40000').money_order_done()
+        self.env.ref('money.other_get_60').other_money_done()
+        self.env.ref('money.transfer_300').money_transfer_done()
+        balance = {}
+        for money in self.env['bank.statements.report'].search([], order='id'):
+            balance[money.bank_id.id] = balance.get(
+                money.bank_id.id, 0) + money.get - money.pay
+            self.assertAlmostEqual(money.balance, balance[money.bank_id.id])
+
     def test_other_money_report(self):
         ''' 测试其他收支单明细表'''
         # 执行向导
@@ -3,3 +3,4 @@ from . import bank_statements_wizard
 from . import other_money_statements_wizard
 from . import money_get_pay_wizard
 from . import cash_flow_wizard
+from . import auto_reconcile_wizard
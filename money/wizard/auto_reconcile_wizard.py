@@ -0,0 +1,77 @@
+from odoo.exceptions import UserError
+from odoo import fields, models, api
+
+MATCH_BY = [
+    ('date_due', u'按到期日'),
+    ('bill_number', u'按纸质发票号'),
+]
+
+
+class AutoReconcileWizard(models.TransientModel):
+    _name = 'auto.reconcile.wizard'
+    _description = u'自动核销向导'
+
+    partner_ids = fields.Many2many('partner', string=u'往来单位',
+                                   help=u'为空时核销所有有未核销预收/预付款的业务伙伴')
+    match_by = fields.Selection(MATCH_BY, string=u'核销顺序',
+                                required=True, default='date_due',
+                                help=u'按到期日：先核销到期日早的结算单；按纸质发票号：同一发票号的结算单一起核销')
+    line_ids = fields.One2many('auto.reconcile.wizard.line', 'wizard_id',
+                               string=u'核销方案', readonly=True)
+
+    def _run(self, dry_run):
+        return self.env['reconcile.order'].auto_reconcile(
+            partner_ids=self.partner_ids.ids or None,
+            match_by=self.match_by,
+            dry_run=dry_run)
+
+    def button_preview(self):
+        """试算：只生成核销方案，不核销"""
+        self.ensure_one()
+        plans = self._run(dry_run=True)
+        self.line_ids = [(5, 0, 0)] + [(0, 0, {
+            'partner_id': plan['partner_id'],
+            'business_type': plan['business_type'],
+            'amount': plan['amount'],
+            'order_count': len(plan['orders']),
+            'invoice_count': len(plan['invoices']),
+        }) for plan in plans]
+        return {
+            'name': u'自动核销',
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def button_confirm(self):
+        """核销并打开生成的核销单"""
+        self.ensure_one()
+        plans = self._run(dry_run=False)
+        if not plans:
+            raise UserError(u'没有可以自动核销的预收/预付款和结算单')
+        view = self.env.ref('money.reconcile_order_tree')
+        return {
+            'name': u'核销单',
+            'view_mode': 'tree,form',
+            'res_model': 'reconcile.order',
+            'views': [(view.id, 'tree'), (False, 'form')],
+            'type': 'ir.actions.act_window',
+            'domain': [('id', 'in', [plan['reconcile_id'] for plan in plans])],
+        }
+
+
+class AutoReconcileWizardLine(models.TransientModel):
+    _name = 'auto.reconcile.wizard.line'
+    _description = u'自动核销方案'
+
+    wizard_id = fields.Many2one('auto.reconcile.wizard', u'自动核销向导',
+                                ondelete='cascade')
+    partner_id = fields.Many2one('partner', u'往来单位')
+    business_type = fields.Selection(
+        lambda self: self.env['reconcile.order'].TYPE_SELECTION,
+        string=u'业务类型')
+    amount = fields.Float(u'核销金额', digits='Amount')
+    order_count = fields.Integer(u'预收/付款单数')
+    invoice_count = fields.Integer(u'结算单数')
@@ -76,112 +76,21 @@ class PartnerStatementsReportWizard(models.TransientModel):
                 'domain': [('partner_id', '=', s.partner_id.id), ('date', '>=', s.from_date), ('date', '<=', s.to_date)]
             }
 
-    def _create_statements_report_with_goods(self, partner_id, name, date, done_date, order_amount,
-                                             benefit_amount, fee, amount, pay_amount, discount_money,
-                                             balance_amount, note, move_id, ptype):
-        """
-        生成无商品明细的对账单记录
-        """
-        if ptype == 'customer':
-            model = self.env['customer.statements.report.with.goods']
-        else:
-            model = self.env['supplier.statements.report.with.goods']
-        record_id = model.create({
-            'partner_id': partner_id,
-            'name': name,
-            'date': date,
-            'done_date': done_date,
-            'order_amount': order_amount,
-            'benefit_amount': benefit_amount,
-            'fee': fee,
-            'amount': amount,
-            'pay_amount': pay_amount,
-            'discount_money': discount_money,
-            'balance_amount': balance_amount,
-            'note': note,
-            'move_id': move_id}).id
-
-        return record_id
-
-    def _create_statements_report_with_goods_line(self, goods_code, goods_name, attribute_id, uom_id,
-                                                  quantity, price, discount_amount, without_tax_amount,
-                                                  tax_amount, order_amount, balance_amount, ptype):
-        """
-        生成带商品明细的对账单记录
-        """
-        if ptype == 'customer':
-            model = self.env['customer.statements.report.with.goods']
-        else:
-            model = self.env['supplier.statements.report.with.goods']
-
-        record_id = model.create({
-            'goods_code': goods_code,
-            'goods_name': goods_name,
-            'attribute_id': attribute_id,
-            'uom_id': uom_id,
-            'quantity': quantity,
-            'price': price,
-            'discount_amount': discount_amount,
-            'without_tax_amount': without_tax_amount,
-            'tax_amount': tax_amount,
-            'order_amount': order_amount,
-            'balance_amount': balance_amount}).id
-
-        return record_id
-
     def partner_statements_with_goods(self):
         """
         业务伙伴对账单: 带商品明细
+        对账单行及其商品行直接取自数据库视图，不再逐行生成临时记录
         :return: action
         """
         for s in self:
-            res_ids = []
             if s.from_date > s.to_date:
                 raise UserError(u'结束日期不能小于开始日期。\n开始日期:%s 结束日期:%s ' %
                                 (s.from_date, s.to_date))
 
+            domain = [('partner_id', '=', s.partner_id.id),
+                      ('statement_date', '>=', s.from_date),
+                      ('statement_date', '<=', s.to_date)]
             if self.env.context.get('default_customer'):  # 客户
-                reports = self.env['customer.statements.report'].search([('partner_id', '=', s.partner_id.id),
-                                                                         ('date', '>=',
-                                                                          s.from_date),
-                                                                         ('date', '<=', s.to_date)])
-                for report in reports:
-                    # 生成无商品明细的对账单记录
-                    record_id = self._create_statements_report_with_goods(report.partner_id.id,
-                                                                          report.name,
-                                                                          report.date,
-                                                                          report.done_date,
-                                                                          report.sale_amount,
-                                                                          report.benefit_amount,
-                                                                          report.fee,
-                                                                          report.amount,
-                                                                          report.pay_amount,
-                                                                          report.discount_money,
-                                                                          report.balance_amount,
-                                                                          report.note,
-                                                                          report.move_id.id,
-                                                                          'customer')
-                    res_ids.append(record_id)
-
-                    # 生成带商品明细的对账单记录
-                    if report.move_id:
-                        # report.amount<0时为销售退货单，否则为销售发货单
-                        line_ids = (report.amount < 0 and report.move_id.line_in_ids
-                                    or report.move_id.line_out_ids)
-                        for line in line_ids:
-                            record_id = self._create_statements_report_with_goods_line(line.goods_id.code,
-                                                                                       line.goods_id.name,
-                                                                                       line.attribute_id.id,
-                                                                                       line.uom_id.id,
-                                                                                       line.goods_qty,
-                                                                                       line.price,
-                                                                                       line.discount_amount,
-                                                                                       line.amount,
-                                                                                       line.tax_amount,
-                                                                                       line.subtotal,
-                                                                                       report.balance_amount,
-                                                                                       'customer')
-                            res_ids.append(record_id)
                 view = self.env.ref(
                     'sell.customer_statements_report_with_goods_tree')
 
@@ -193,52 +102,10 @@ class PartnerStatementsReportWizard(models.TransientModel):
                     'views': [(view.id, 'tree')],
                     'limit': 65535,
                     'type': 'ir.actions.act_window',
-                    'domain': [('id', 'in', res_ids)],
+                    'domain': domain,
                     'context': {'is_customer': True, 'is_supplier': False},
                 }
             else:  # 供应商
-                reports = self.env['supplier.statements.report'].search([('partner_id', '=', s.partner_id.id),
-                                                                         ('date', '>=',
-                                                                          s.from_date),
-                                                                         ('date', '<=', s.to_date)])
-                for report in reports:
-                    # 生成带商品明细的对账单记录
-                    record_id = self._create_statements_report_with_goods(report.partner_id.id,
-                                                                          report.name,
-                                                                          report.date,
-                                                                          report.done_date,
-                                                                          report.purchase_amount,
-                                                                          report.benefit_amount,
-                                                                          0,
-                                                                          report.amount,
-                                                                          report.pay_amount,
-                                                                          report.discount_money,
-                                                                          report.balance_amount,
-                                                                          report.note,
-                                                                          report.move_id.id,
-                                                                          'supplier')
-                    res_ids.append(record_id)
-
-                    # 生成带商品明细的对账单记录
-                    if report.move_id:
-                        # report.amount<0时为采购退货单，否则为采购入库单
-                        line_ids = (report.amount < 0 and report.move_id.line_out_ids
-                                    or report.move_id.line_in_ids)
-                        for line in line_ids:
-                            record_id = self._create_statements_report_with_goods_line(line.goods_id.code,
-                                                                                       line.goods_id.name,
-                                                                                       line.attribute_id.id,
-                                                                                       line.uom_id.id,
-                                                                                       line.goods_qty,
-                                                                                       line.price,
-                                                                                       line.discount_amount,
-                                                                                       line.amount,
-                                                                                       line.tax_amount,
-                                                                                       line.subtotal,
-                                                                                       report.balance_amount,
-                                                                                       'supplier')
-                            res_ids.append(record_id)
-
                 view = self.env.ref(
                     'buy.supplier_statements_report_with_goods_tree')
 
@@ -250,7 +117,7 @@ class PartnerStatementsReportWizard(models.TransientModel):
                     'views': [(view.id, 'tree')],
                     'limit': 65535,
                     'type': 'ir.actions.act_window',
-                    'domain': [('id', 'in', res_ids)],
+                    'domain': domain,
                     'context': {'is_customer': False, 'is_supplier': True},
                 }
 
@@ -41,130 +41,140 @@ class StockRequest(models.Model):
         string='公司',
         change_default=True,
         default=lambda self: self.env.company)
+    supplier_id = fields.Many2one('partner', '供应商',
+                                  domain=[('s_category_id', '!=', False)],
+                                  states={'done': [('readonly', True)]},
+                                  help='只查询默认供应商为该供应商的商品')
+    goods_class_id = fields.Many2one('goods.class', '商品分类',
+                                     states={'done': [('readonly', True)]},
+                                     help='只查询该分类及其下级分类的商品')
+    warehouse_id = fields.Many2one('warehouse', '仓库',
+                                   domain=[('type', '=', 'stock')],
+                                   states={'done': [('readonly', True)]},
+                                   help='只统计该仓库的库存及出入库数量')
+
+    def _get_query_goods(self):
+        ''' 按供应商、商品分类过滤需要补货的商品 '''
+        domain = [('no_stock', '=', False)]
+        if self.supplier_id:
+            domain.append(('supplier_id', '=', self.supplier_id.id))
+        if self.goods_class_id:
+            domain.append(('goods_class_id', 'child_of', self.goods_class_id.id))
+        return self.env['goods'].search(domain)
+
+    def _get_grouped_qty(self, sql, params):
+        ''' 执行按 商品、属性 分组汇总数量的 SQL，返回 {(商品id, 属性id): 数量} '''
+        self.env.cr.execute(sql, params)
+        return {(goods_id, attribute_id or False): qty
+                for goods_id, attribute_id, qty in self.env.cr.fetchall()}
+
+    def _get_replenish_qty(self, goods):
+        '''
+        用分组汇总 SQL 一次算出所有商品、属性的
+        当前数量、未发货数量、未到货数量、未确认销货数量、未确认购货数量
+        '''
+        self.flush()
+        goods_ids = tuple(goods.ids)
+        warehouse_id = self.warehouse_id.id or None
+
+        # 当前数量：库存余额中库存库位的数量
+        qty = self._get_grouped_qty('''
+            SELECT quant.goods_id, quant.attribute_id, sum(quant.qty)
+            FROM wh_stock_quant quant
+            JOIN warehouse wh ON quant.warehouse_id = wh.id
+            WHERE wh.type = 'stock'
+              AND quant.goods_id IN %s
+              AND (%s IS NULL OR quant.warehouse_id = %s)
+            GROUP BY quant.goods_id, quant.attribute_id
+        ''', (goods_ids, warehouse_id, warehouse_id))
+        # 未发货数量
+        to_delivery_qty = self._get_grouped_qty('''
+            SELECT line.goods_id, line.attribute_id, sum(line.goods_qty)
+            FROM wh_move_line line
+            WHERE line.state != 'done'
+              AND line.type = 'out'
+              AND line.goods_id IN %s
+              AND (%s IS NULL OR line.warehouse_id = %s)
+            GROUP BY line.goods_id, line.attribute_id
+        ''', (goods_ids, warehouse_id, warehouse_id))
+        # 未到货数量
+        to_receipt_qty = self._get_grouped_qty('''
+            SELECT line.goods_id, line.attribute_id, sum(line.goods_qty)
+            FROM wh_move_line line
+            WHERE line.state != 'done'
+              AND line.type != 'out'
+              AND line.goods_id IN %s
+              AND (%s IS NULL OR line.warehouse_dest_id = %s)
+            GROUP BY line.goods_id, line.attribute_id
+        ''', (goods_ids, warehouse_id, warehouse_id))
+        # 未确认销货数量
+        to_sell_qty = self._get_grouped_qty('''
+            SELECT line.goods_id, line.attribute_id, sum(line.quantity)
+            FROM sell_order_line line
+            JOIN sell_order so ON line.order_id = so.id
+            WHERE so.state = 'draft'
+              AND line.goods_id IN %s
+              AND (%s IS NULL OR so.warehouse_id = %s)
+            GROUP BY line.goods_id, line.attribute_id
+        ''', (goods_ids, warehouse_id, warehouse_id))
+        # 未确认购货数量
+        to_buy_qty = self._get_grouped_qty('''
+            SELECT line.goods_id, line.attribute_id, sum(line.quantity)
+            FROM buy_order_line line
+            JOIN buy_order bo ON line.order_id = bo.id
+            WHERE bo.state = 'draft'
+              AND line.goods_id IN %s
+              AND (%s IS NULL OR bo.warehouse_dest_id = %s)
+            GROUP BY line.goods_id, line.attribute_id
+        ''', (goods_ids, warehouse_id, warehouse_id))
+        return qty, to_delivery_qty, to_receipt_qty, to_sell_qty, to_buy_qty
+
+    def _get_assembly_goods_ids(self):
+        ''' 存在组装单模板的组合件商品 '''
+        self.env.cr.execute('''
+            SELECT DISTINCT line.goods_id
+            FROM wh_bom_line line
+            JOIN wh_bom bom ON line.bom_id = bom.id
+            WHERE bom.type = 'assembly'
+              AND bom.active = TRUE
+              AND line.type = 'parent'
+        ''')
+        return set(row[0] for row in self.env.cr.fetchall())
 
     def stock_query(self):
         ''' 点击 查询库存 按钮 生成补货申请行
                                     每行一个商品一个属性的 数量，补货数量
          '''
         self.ensure_one()
-        goods = self.env['goods'].search([('no_stock', '=', False)])
+        goods = self._get_query_goods()
+        if not goods:
+            self.state = 'draft'
+            return
 
-        for good in goods:
-            qty = 0  # 当前数量
-            to_delivery_qty = 0  # 未发货数量
-            to_receipt_qty = 0  # 未到货数量
-            to_sell_qty = 0  # 未确认销货数量
-            to_buy_qty = 0  # 未确认购货数量
-
-            wh_move_lines = self.env['wh.move.line'].search(
-                [('goods_id', '=', good.id)])
-
-            attribute_dict = {}
-            to_delivery_dict = {}
-            to_receipt_dict = {}
-            to_sell_dict = {}
-            to_buy_dict = {}
-            for wh_move_line in wh_move_lines:
-                # 计算当前数量
-                if wh_move_line.state == 'done':
-                    if wh_move_line.warehouse_dest_id.type == 'stock':  # 目的库位为库存库位
-                        if wh_move_line.attribute_id:  # 商品存在属性
-                            if wh_move_line.attribute_id not in attribute_dict:
-                                attribute_dict.update(
-                                    {wh_move_line.attribute_id: wh_move_line.qty_remaining})
-                            else:
-                                attribute_dict[wh_move_line.attribute_id] += wh_move_line.qty_remaining
-                        else:  # 商品不存在属性
-                            qty += wh_move_line.qty_remaining
-                # 计算未发货和未到货数量
-                else:
-                    if wh_move_line.type == 'out':
-                        if wh_move_line.attribute_id:  # 商品存在属性
-                            if wh_move_line.attribute_id not in to_delivery_dict:
-                                to_delivery_dict.update(
-                                    {wh_move_line.attribute_id: wh_move_line.goods_qty})
-                            else:
-                                to_delivery_dict[wh_move_line.attribute_id] += wh_move_line.goods_qty
-                        else:  # 商品不存在属性
-                            to_delivery_qty += wh_move_line.goods_qty
-                    else:
-                        if wh_move_line.attribute_id:  # 商品存在属性
-                            if wh_move_line.attribute_id not in to_receipt_dict:
-                                to_receipt_dict.update(
-                                    {wh_move_line.attribute_id: wh_move_line.goods_qty})
-                            else:
-                                to_receipt_dict[wh_move_line.attribute_id] += wh_move_line.goods_qty
-                        else:  # 商品不存在属性
-                            to_receipt_qty += wh_move_line.goods_qty
-            # 计算未销货数量
-            sell_order_lines = self.env['sell.order.line'].search([('goods_id', '=', good.id),
-                                                                   ('order_id.state', '=', 'draft')])
-            for line in sell_order_lines:
-                if line.attribute_id:  # 商品存在属性
-                    if line.attribute_id not in to_sell_dict:
-                        to_sell_dict.update({line.attribute_id: line.quantity})
-                    else:
-                        to_sell_dict[line.attribute_id] += line.quantity
-                else:  # 商品不存在属性
-                    to_sell_qty += line.quantity
-            # 计算未购货数量
-            buy_order_lines = self.env['buy.order.line'].search([('goods_id', '=', good.id),
-                                                                 ('order_id.state', '=', 'draft')])
-            for line in buy_order_lines:
-                if line.attribute_id:  # 商品存在属性
-                    if line.attribute_id not in to_buy_dict:
-                        to_buy_dict.update({line.attribute_id: line.quantity})
-                    else:
-                        to_buy_dict[line.attribute_id] += line.quantity
-                else:  # 商品不存在属性
-                    to_buy_qty += line.quantity
+        qty_dict, to_delivery_dict, to_receipt_dict, to_sell_dict, to_buy_dict = \
+            self._get_replenish_qty(goods)
+        assembly_goods_ids = self._get_assembly_goods_ids()
 
+        line_vals = []
+        for good in goods:
             # 如果组装单模板存在，is_buy置为False
-            bom_line = self.env['wh.bom.line'].search([('goods_id', '=', good.id),
-                                                       ('bom_id.type',
-                                                        '=', 'assembly'),
-                                                       ('type', '=', 'parent')])
-            if bom_line:
-                is_buy = False
-            else:
-                is_buy = True
-
-            # 生成补货申请行
-            qty_available = 0  # 可用库存
-            if good.attribute_ids:  # 商品存在属性
-                for attribute in good.attribute_ids:
-                    qty = attribute in attribute_dict and attribute_dict[attribute] or 0
-                    to_sell_qty = attribute in to_sell_dict and to_sell_dict[attribute] or 0
-                    to_delivery_qty = attribute in to_delivery_dict and to_delivery_dict[
-                        attribute] or 0
-                    to_buy_qty = attribute in to_buy_dict and to_buy_dict[attribute] or 0
-                    to_receipt_qty = attribute in to_receipt_dict and to_receipt_dict[
-                        attribute] or 0
-                    qty_available = qty + to_receipt_qty + \
-                        to_buy_qty - to_delivery_qty - to_sell_qty
-                    if qty_available < good.min_stock_qty:
-                        self.env['stock.request.line'].create({
-                            'request_id': self.id,
-                            'goods_id': good.id,
-                            'attribute_id': attribute.id,
-                            'qty': qty,
-                            'to_sell_qty': to_sell_qty,
-                            'to_delivery_qty': to_delivery_qty,
-                            'to_buy_qty': to_buy_qty,
-                            'to_receipt_qty': to_receipt_qty,
-                            'min_stock_qty': good.min_stock_qty,
-                            'request_qty': good.min_stock_qty - qty_available,
-                            'uom_id': good.uom_id.id,
-                            'supplier_id': good.supplier_id and good.supplier_id.id or False,
-                            'is_buy': is_buy,
-                        })
-            else:  # 商品不存在属性
+            is_buy = good.id not in assembly_goods_ids
+            # 商品存在属性时每个属性一行，否则商品一行
+            keys = [(good.id, attribute.id) for attribute in good.attribute_ids] \
+                or [(good.id, False)]
+            for key in keys:
+                qty = qty_dict.get(key, 0)
+                to_sell_qty = to_sell_dict.get(key, 0)
+                to_delivery_qty = to_delivery_dict.get(key, 0)
+                to_buy_qty = to_buy_dict.get(key, 0)
+                to_receipt_qty = to_receipt_dict.get(key, 0)
                 qty_available = qty + to_receipt_qty + \
-                    to_buy_qty - to_delivery_qty - to_sell_qty
+                    to_buy_qty - to_delivery_qty - to_sell_qty  # 可用库存
                 if qty_available < good.min_stock_qty:
-                    self.env['stock.request.line'].create({
+                    line_vals.append({
                         'request_id': self.id,
                         'goods_id': good.id,
+                        'attribute_id': key[1],
                         'qty': qty,
                         'to_sell_qty': to_sell_qty,
                         'to_delivery_qty': to_delivery_qty,
@@ -177,6 +187,7 @@ class StockRequest(models.Model):
                         'is_buy': is_buy,
                     })
 
+        self.env['stock.request.line'].create(line_vals)
         self.state = 'draft'
 
     def _get_buy_order_line_data(self, line, buy_order):
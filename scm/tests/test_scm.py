@@ -58,6 +58,16 @@ class TestScm(TransactionCase):
 
         self.stock_request.stock_query()
 
+    def test_stock_query_filter(self):
+        ''' 测试 按供应商过滤查询库存 '''
+        self.goods_keyboard.supplier_id = self.env.ref('core.zt')
+        self.stock_request.supplier_id = self.env.ref('core.zt')
+        self.stock_request.stock_query()
+        self.assertTrue(self.stock_request.line_ids)
+        self.assertEqual(self.stock_request.line_ids.mapped('goods_id'),
+                         self.goods_keyboard)
+        self.assertEqual(self.stock_request.state, 'draft')
+
     def test_stock_request_done(self):
         ''' 测试 审核 方法'''
         self.wh_move_in_1.approve_order()
@@ -2,7 +2,7 @@
 from odoo import fields, models, api
 
 import datetime
-from odoo.exceptions import UserError
+from odoo.exceptions import UserError, ValidationError
 from odoo.tools import float_compare, float_is_zero
 
 # 字段只读状态
@@ -138,8 +138,10 @@ class SellDelivery(models.Model):
                     [('partner_id', '=', self.partner_id.id)], order='id')
                 self.address_id = partners_add[0].id
 
+            tax_rates = self.env['goods'].get_tax_rates(
+                self.line_out_ids.mapped('goods_id').ids, self.partner_id, 'sell')
             for line in self.line_out_ids:
-                line.tax_rate = line.goods_id.get_tax_rate(line.goods_id, self.partner_id, 'sell')
+                line.tax_rate = tax_rates.get(line.goods_id.id)
 
             address_list = [
                 child_list.id for child_list in self.partner_id.child_ids]
@@ -312,40 +314,46 @@ class SellDelivery(models.Model):
         })
         return money_order
 
-    def _create_voucher_line(self, account_id, debit, credit, voucher, goods_id, goods_qty):
+    def _prepare_voucher_line(self, account_id, debit, credit, goods_id, goods_qty):
         """
-        创建凭证明细行
+        凭证明细行的数据
         :param account_id: 科目
         :param debit: 借方
         :param credit: 贷方
-        :param voucher: 凭证
         :param goods_id: 商品
-        :return:
+        :return: dict
         """
-        voucher_line = self.env['voucher.line'].create({
+        return {
             'name': '%s %s' % (self.name, self.note or ''),
             'account_id': account_id and account_id.id,
             'debit': debit,
             'credit': credit,
-            'voucher_id': voucher and voucher.id,
             'goods_qty': goods_qty,
             'goods_id': goods_id and goods_id.id,
-        })
+        }
+
+    def _create_voucher_line(self, account_id, debit, credit, voucher, goods_id, goods_qty):
+        """
+        创建凭证明细行
+        :param account_id: 科目
+        :param debit: 借方
+        :param credit: 贷方
+        :param voucher: 凭证
+        :param goods_id: 商品
+        :return:
+        """
+        vals = self._prepare_voucher_line(account_id, debit, credit, goods_id, goods_qty)
+        vals['voucher_id'] = voucher and voucher.id
+        voucher_line = self.env['voucher.line'].create(vals)
         return voucher_line
 
-    def create_voucher(self):
+    def _get_voucher_line_vals(self):
         '''
-        销售发货单、退货单审核时生成会计凭证
-        借：主营业务成本（核算分类上会计科目）
-        贷：库存商品（商品分类上会计科目）
-
-        当一张发货单有多个商品的时候，按对应科目汇总生成多个贷方凭证行。
-
-        退货单生成的金额为负
+        发货单/退货单出库凭证的明细行
+        贷方按商品逐行生成，借方为贷方合计，退货单金额为负
         '''
         self.ensure_one()
-        voucher = self.env['voucher'].create({'date': self.date, 'ref': '%s,%s' % (self._name, self.id)})
-
+        line_vals = []
         sum_amount = 0
         line_ids = self.is_return and self.line_in_ids or self.line_out_ids
         for line in line_ids:   # 发货单/退货单明细
@@ -354,17 +362,45 @@ class SellDelivery(models.Model):
                 continue    # 缺货审核发货单时不产生出库凭证
             else:  # 贷方明细
                 sum_amount += cost
-                self._create_voucher_line(line.goods_id.category_id.account_id,
-                                          0, cost, voucher, line.goods_id, line.goods_qty)
+                line_vals.append(self._prepare_voucher_line(
+                    line.goods_id.category_id.account_id, 0, cost, line.goods_id, line.goods_qty))
         if sum_amount:  # 借方明细
-            self._create_voucher_line(self.sell_move_id.finance_category_id.account_id,
-                                      sum_amount, 0, voucher, False, 0)
+            line_vals.append(self._prepare_voucher_line(
+                self.sell_move_id.finance_category_id.account_id, sum_amount, 0, False, 0))
+        return line_vals
 
-        if len(voucher.line_ids) > 0:
-            voucher.voucher_done()
-            return voucher
-        else:
-            voucher.unlink()
+    def _create_vouchers(self):
+        '''
+        一次创建多张发货单/退货单的出库凭证并确认
+        :return: {发货单id: 凭证}
+        '''
+        vals_list = []
+        record_ids = []
+        for record in self:
+            line_vals = record._get_voucher_line_vals()
+            if line_vals:
+                vals_list.append({
+                    'date': record.date,
+                    'ref': '%s,%s' % (record._name, record.id),
+                    'line_ids': [(0, 0, vals) for vals in line_vals],
+                })
+                record_ids.append(record.id)
+        vouchers = self.env['voucher'].create(vals_list)
+        vouchers.voucher_done()
+        return dict(zip(record_ids, vouchers))
+
+    def create_voucher(self):
+        '''
+        销售发货单、退货单审核时生成会计凭证
+        借：主营业务成本（核算分类上会计科目）
+        贷：库存商品（商品分类上会计科目）
+
+        当一张发货单有多个商品的时候，按对应科目汇总生成多个贷方凭证行。
+
+        退货单生成的金额为负
+        '''
+        self.ensure_one()
+        return self._create_vouchers().get(self.id)
 
     def auto_reconcile_sell_order(self):
         ''' 预收款与结算单自动核销 '''
@@ -471,6 +507,139 @@ class SellDelivery(models.Model):
                     return True
                 return record.order_id.sell_generate_delivery()
 
+    def _check_delivery_done_batch(self, errors):
+        '''
+        批量审核前逐张检查，客户信用额度按本批次内该客户的发货金额累计检查
+        :param errors: {单据编号: 错误信息}，不能审核的单据记入其中
+        :return: 可以审核的单据
+        '''
+        decimal_amount = self.env.ref('core.decimal_amount')
+        pending_amount = {}
+        todo = self.browse()
+        for record in self:
+            try:
+                record._wrong_delivery_done()
+                if not record.is_return and record.partner_id.credit_limit != 0:
+                    amount = record.amount + record.partner_cost - record.receipt
+                    pending = pending_amount.get(record.partner_id.id, 0) + amount
+                    if float_compare(pending + record.partner_id.receivable, record.partner_id.credit_limit,
+                                     precision_digits=decimal_amount.digits) == 1:
+                        raise UserError('本批次发货金额 + 客户应收余额 - 本批次收款金额 不能大于客户信用额度！')
+                    pending_amount[record.partner_id.id] = pending
+            except UserError as e:
+                errors[record.name] = e.args and e.args[0] or str(e)
+                continue
+            todo |= record
+        return todo
+
+    def _exclude_stock_shortage(self, errors):
+        '''
+        允许负库存时，库存不足的单据需要在确认生成盘盈入库单后单独审核，不参与批量审核
+        本批次前面单据已占用的数量从可用库存中扣除，与 create_zero_wh_in 的判断一致
+        :param errors: {单据编号: 错误信息}，库存不足的单据记入其中
+        :return: 库存充足的单据
+        '''
+        wh_move_obj = self.env['wh.move']
+        available = {}
+        todo = self.browse()
+        for record in self:
+            taken = {}
+            try:
+                for line in record.line_out_ids:
+                    if line.goods_qty <= 0 or line.price_taxed < 0:
+                        raise UserError('商品 %s 的数量和含税单价不能小于0。' % line.goods_id.name)
+                    if line.goods_id.no_stock or line.lot_id or self.env.context.get('wh_in_line_ids'):
+                        continue
+                    key = (line.goods_id.id, line.attribute_id.id, record.warehouse_id.id)
+                    if key not in available:
+                        available[key] = wh_move_obj.check_goods_qty(
+                            line.goods_id, line.attribute_id, record.warehouse_id)[0] or 0
+                    taken[key] = taken.get(key, 0) + line.goods_qty
+                    if taken[key] > available[key]:
+                        raise UserError('库存不足，请单独审核该单据')
+            except UserError as e:
+                errors[record.name] = e.args and e.args[0] or str(e)
+                continue
+            for key, qty in taken.items():
+                available[key] -= qty
+            todo |= record
+        return todo
+
+    def _delivery_done_batch(self):
+        '''
+        整批审核：出入库一次完成，出库凭证一次创建，
+        同一销货订单只自动核销、生成分单一次
+        '''
+        self.mapped('sell_move_id').approve_order()
+        vouchers = {}
+        if not self.env.user.company_id.endmonth_generation_cost:
+            vouchers = self._create_vouchers()
+        orders = {}
+        for record in self:
+            if record.order_id:
+                record._line_qty_write()
+            invoice_id = record._delivery_make_invoice()
+            record._sell_amount_to_invoice()
+            money_order = False
+            if record.receipt:
+                flag = not record.is_return and 1 or -1
+                amount = flag * (record.amount + record.partner_cost)
+                this_reconcile = flag * record.receipt
+                money_order = record._make_money_order(
+                    invoice_id, amount, this_reconcile)
+                money_order.money_order_done()
+
+            voucher = vouchers.get(record.id)
+            record.write({
+                'voucher_id': voucher and voucher.id,
+                'invoice_id': invoice_id and invoice_id.id,
+                'money_order_id': money_order and money_order.id,
+                'state': 'done',
+            })
+            if record.order_id:
+                orders[record.order_id] = record
+
+        for order, record in orders.items():
+            # 先收款后发货订单自动核销
+            record.auto_reconcile_sell_order()
+            # 生成分拆单，如果已退货也已退款，不生成新的分单
+            if not record.modifying and not (record.is_return and record.receipt):
+                order.sell_generate_delivery()
+
+    def sell_delivery_done_batch(self):
+        '''
+        批量审核销售发货单/退货单
+        先整批审核，整批失败时逐张在各自的保存点中审核，出错的单据不影响其他单据
+        :return: {'done': 审核成功的单据, 'errors': {单据编号: 错误信息}}
+        '''
+        errors = {}
+        todo = self._check_delivery_done_batch(errors)
+        if todo and self.env.user.company_id.is_enable_negative_stock:
+            todo = todo._exclude_stock_shortage(errors)
+        done = self.browse()
+        if not todo:
+            return {'done': done, 'errors': errors}
+        try:
+            with self.env.cr.savepoint():
+                todo._delivery_done_batch()
+                self.flush()
+            done = todo
+        except (UserError, ValidationError):
+            self.env.clear()
+            for record in todo:
+                try:
+                    with self.env.cr.savepoint():
+                        record.sell_delivery_done()
+                        self.flush()
+                    # 库存不足时只返回生成盘盈入库单的对话框，单据并未审核
+                    if record.state != 'done':
+                        raise UserError('库存不足，请单独审核该单据')
+                    done |= record
+                except (UserError, ValidationError) as e:
+                    self.env.clear()
+                    errors[record.name] = e.args and e.args[0] or str(e)
+        return {'done': done, 'errors': errors}
+
     def sell_delivery_draft(self):
         '''反审核销售发货单/退货单，更新本单的收款状态/退款状态，并删除生成的结算单、收款单及凭证'''
         self.ensure_one()
@@ -63,16 +63,37 @@ class SellOrder(models.Model):
             return self.env['warehouse'].get_warehouse_by_type(
                 self.env.context.get('warehouse_type'))
 
-    def _get_received_amount(selfs):
-        '''计算销货订单收款/退款状态'''
-        for self in selfs:
-            deliverys = self.env['sell.delivery'].search(
-                [('order_id', '=', self.id)])
-            money_order_rows = self.env['money.order'].search([('sell_id', '=', self.id),
-                                                            ('reconciled', '=', 0),
-                                                            ('state', '=', 'done')])
-            self.received_amount = sum([delivery.invoice_id.reconciled for delivery in deliverys]) +\
-                sum([order_row.amount for order_row in money_order_rows])
+    def _get_received_amount(self):
+        '''计算销货订单收款/退款状态，整批订单对每张关联表只汇总一次'''
+        for order in self:
+            order.received_amount = 0
+        orders = self.filtered('id')
+        if not orders:
+            return
+        self.env['money.invoice'].flush(['reconciled'])
+        self.env['sell.delivery'].flush(['order_id', 'invoice_id'])
+        self.env['money.order'].flush(['sell_id', 'reconciled', 'state', 'amount'])
+        cr = self.env.cr
+        cr.execute('''
+            SELECT d.order_id, COALESCE(SUM(mi.reconciled), 0)
+              FROM sell_delivery d
+              JOIN money_invoice mi ON mi.id = d.invoice_id
+             WHERE d.order_id IN %s
+          GROUP BY d.order_id
+        ''', (tuple(orders.ids),))
+        delivery_received = dict(cr.fetchall())
+        # 销货订单上输入预收款时
+        cr.execute('''
+            SELECT sell_id, COALESCE(SUM(amount), 0)
+              FROM money_order
+             WHERE sell_id IN %s
+               AND reconciled = 0
+               AND state = 'done'
+          GROUP BY sell_id
+        ''', (tuple(orders.ids),))
+        prereceived = dict(cr.fetchall())
+        for order in orders:
+            order.received_amount = delivery_received.get(order.id, 0) + prereceived.get(order.id, 0)
 
     @api.depends('delivery_ids')
     def _compute_delivery(self):
@@ -236,8 +257,10 @@ class SellOrder(models.Model):
                     [('partner_id', '=', self.partner_id.id)], order='id')
                 self.address_id = partners_add[0].id
 
+            tax_rates = self.env['goods'].get_tax_rates(
+                self.line_ids.mapped('goods_id').ids, self.partner_id, 'sell')
             for line in self.line_ids:
-                line.tax_rate = line.goods_id.get_tax_rate(line.goods_id, self.partner_id, 'sell')
+                line.tax_rate = tax_rates.get(line.goods_id.id)
 
             address_list = [
                 child_list.id for child_list in self.partner_id.child_ids]
@@ -42,7 +42,7 @@ class CustomerStatementsReport(models.Model):
         tools.drop_view_if_exists(cr, 'customer_statements_report')
         cr.execute("""
             CREATE or REPLACE VIEW customer_statements_report AS (
-            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc) AS id,
+            SELECT  ROW_NUMBER() OVER(ORDER BY partner_id, date, amount desc, done_date, name) AS id,
                     partner_id,
                     name,
                     date,
@@ -53,7 +53,9 @@ class CustomerStatementsReport(models.Model):
                     amount,
                     pay_amount,
                     discount_money,
-                    balance_amount,
+                    SUM(amount - pay_amount - discount_money) OVER(
+                        PARTITION BY partner_id ORDER BY date, amount desc, done_date, name
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS balance_amount,
                     note,
                     move_id
             FROM
@@ -127,11 +129,15 @@ class CustomerStatementsReport(models.Model):
         raise UserError('期初余额无原始单据可查看。')
 
 
-class CustomerStatementsReportWithGoods(models.TransientModel):
+class CustomerStatementsReportWithGoods(models.Model):
     _name = "customer.statements.report.with.goods"
     _description = "客户对账单带商品明细"
+    _auto = False
+    _order = 'id'
 
+    statement_id = fields.Many2one('customer.statements.report', string='对账单行', readonly=True)
     partner_id = fields.Many2one('partner', string='业务伙伴', readonly=True)
+    statement_date = fields.Date(string='对账单日期', readonly=True)
     name = fields.Char(string='单据编号', readonly=True)
     date = fields.Date(string='单据日期', readonly=True)
     done_date = fields.Datetime(string='完成日期', readonly=True)
@@ -161,6 +167,101 @@ class CustomerStatementsReportWithGoods(models.TransientModel):
     note = fields.Char(string='备注', readonly=True)
     move_id = fields.Many2one('wh.move', string='出入库单', readonly=True)
 
+    def init(self):
+        # 对账单行后紧跟出入库单商品行：amount<0时为销售退货单，否则为销售发货单
+        cr = self._cr
+        tools.drop_view_if_exists(cr, 'customer_statements_report_with_goods')
+        cr.execute("""
+            CREATE or REPLACE VIEW customer_statements_report_with_goods AS (
+            SELECT  ROW_NUMBER() OVER(ORDER BY statement_id, line_id) AS id,
+                    statement_id,
+                    partner_id,
+                    statement_date,
+                    name,
+                    date,
+                    done_date,
+                    category_id,
+                    goods_code,
+                    goods_name,
+                    attribute_id,
+                    uom_id,
+                    quantity,
+                    price,
+                    discount_amount,
+                    without_tax_amount,
+                    tax_amount,
+                    order_amount,
+                    benefit_amount,
+                    fee,
+                    amount,
+                    pay_amount,
+                    discount_money,
+                    balance_amount,
+                    note,
+                    move_id
+            FROM
+                (
+                SELECT  st.id AS statement_id,
+                        0 AS line_id,
+                        st.partner_id,
+                        st.date AS statement_date,
+                        st.name,
+                        st.date,
+                        st.done_date AS done_date,
+                        NULL::integer AS category_id,
+                        NULL AS goods_code,
+                        NULL AS goods_name,
+                        NULL::integer AS attribute_id,
+                        NULL::integer AS uom_id,
+                        0 AS quantity,
+                        0 AS price,
+                        0 AS discount_amount,
+                        0 AS without_tax_amount,
+                        0 AS tax_amount,
+                        st.sale_amount AS order_amount,
+                        st.benefit_amount,
+                        st.fee AS fee,
+                        st.amount,
+                        st.pay_amount,
+                        st.discount_money,
+                        st.balance_amount,
+                        st.note,
+                        NULLIF(st.move_id, 0) AS move_id
+                FROM customer_statements_report AS st
+                UNION ALL
+                SELECT  st.id AS statement_id,
+                        wml.id AS line_id,
+                        st.partner_id,
+                        st.date AS statement_date,
+                        NULL AS name,
+                        NULL AS date,
+                        NULL AS done_date,
+                        goods.category_id,
+                        goods.code AS goods_code,
+                        goods.name AS goods_name,
+                        wml.attribute_id,
+                        wml.uom_id,
+                        wml.goods_qty AS quantity,
+                        wml.price,
+                        wml.discount_amount,
+                        wml.amount AS without_tax_amount,
+                        wml.tax_amount,
+                        wml.subtotal AS order_amount,
+                        0 AS benefit_amount,
+                        0 AS fee,
+                        0 AS amount,
+                        0 AS pay_amount,
+                        0 AS discount_money,
+                        st.balance_amount,
+                        NULL AS note,
+                        st.move_id
+                FROM customer_statements_report AS st
+                JOIN wh_move_line AS wml ON wml.move_id = st.move_id
+                                        AND wml.type = (CASE WHEN st.amount < 0 THEN 'in' ELSE 'out' END)
+                LEFT JOIN goods ON goods.id = wml.goods_id
+                ) AS sg)
+        """)
+
     def find_source_order(self):
         # 查看原始单据，三种情况：收款单、销售退货单、销售发货单
         self.ensure_one()
@@ -8,6 +8,8 @@ class SellSummaryGoods(models.Model):
     _name = 'sell.summary.goods'
     _inherit = 'report.base'
     _description = '销售汇总表（按商品）'
+    _order = 'goods_code ASC'
+    _sql_pushdown = True
 
     id_lists = fields.Text('移动明细行id列表')
     goods_categ = fields.Char('商品类别')
@@ -116,10 +118,6 @@ class SellSummaryGoods(models.Model):
             'warehouse_id': context.get('warehouse_id') and context.get('warehouse_id')[0] or '',
         }
 
-    def _compute_order(self, result, order):
-        order = order or 'goods_code ASC'
-        return super(SellSummaryGoods, self)._compute_order(result, order)
-
     def collect_data_by_sql(self, sql_type='out'):
         collection = self.execute_sql(sql_type='out')
 
@@ -8,6 +8,8 @@ class SellSummaryPartner(models.Model):
     _name = 'sell.summary.partner'
     _inherit = 'report.base'
     _description = '销售汇总表（按客户）'
+    _order = 'partner ASC'
+    _sql_pushdown = True
 
     id_lists = fields.Text('移动明细行id列表')
     c_category = fields.Char('客户类别')
@@ -123,10 +125,6 @@ class SellSummaryPartner(models.Model):
             context.get('warehouse_id')[0] or '',
         }
 
-    def _compute_order(self, result, order):
-        order = order or 'partner ASC'
-        return super(SellSummaryPartner, self)._compute_order(result, order)
-
     def collect_data_by_sql(self, sql_type='out'):
         collection = self.execute_sql(sql_type='out')
 
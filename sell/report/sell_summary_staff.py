@@ -8,6 +8,8 @@ class SellSummaryStaff(models.Model):
     _name = 'sell.summary.staff'
     _inherit = 'report.base'
     _description = '销售汇总表（按销售人员）'
+    _order = 'user_id ASC'
+    _sql_pushdown = True
 
     id_lists = fields.Text('移动明细行id列表')
     user_id = fields.Many2one('res.users', '销售员')
@@ -123,10 +125,6 @@ class SellSummaryStaff(models.Model):
             context.get('warehouse_id')[0] or '',
         }
 
-    def _compute_order(self, result, order):
-        order = order or 'user_id ASC'
-        return super(SellSummaryStaff, self)._compute_order(result, order)
-
     def collect_data_by_sql(self, sql_type='out'):
         collection = self.execute_sql(sql_type='out')
 
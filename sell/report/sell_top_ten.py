@@ -8,6 +8,8 @@ class SellTopTen(models.Model):
     _name = 'sell.top.ten'
     _inherit = 'report.base'
     _description = '销量前十商品'
+    _order = 'qty DESC'
+    _sql_pushdown = True
 
     goods = fields.Char('商品名称')
     warehouse = fields.Char('仓库')
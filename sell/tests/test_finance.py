@@ -46,6 +46,26 @@ class TestMonthProductCost(TransactionCase):
         self.env['month.product.cost'].generate_issue_cost(
             self.period_id, '2016-01-31')
 
+    def test_data_structure_batch(self):
+        """批量取上期结存并合并本期出入库"""
+        cost = self.env['month.product.cost']
+        mouse = self.env.ref('goods.mouse')
+        keyboard = self.env.ref('goods.keyboard')
+        cost.create({'period_id': self.period_id_15.id,
+                     'goods_id': mouse.id,
+                     'current_period_remaining_qty': 5,
+                     'current_period_remaining_cost': 50})
+        res = cost.data_structure([
+            {'goods_id': mouse.id, 'type': 'in', 'qty': 10, 'cost': 100},
+            {'goods_id': mouse.id, 'type': 'out', 'qty': 3, 'cost': 30},
+            {'goods_id': keyboard.id, 'type': 'in', 'qty': 2, 'cost': 20},
+        ], self.period_id)
+        self.assertEqual(res[mouse.id]['period_begin_qty'], 5)
+        self.assertEqual(res[mouse.id]['current_period_remaining_qty'], 12)
+        self.assertEqual(res[mouse.id]['current_period_remaining_cost'], 120)
+        self.assertEqual(res[keyboard.id]['period_begin_qty'], 0)
+        self.assertEqual(res[keyboard.id]['current_period_remaining_qty'], 2)
+
 
 class TestPartner(TransactionCase):
     def test_action_view_sell_history(self):
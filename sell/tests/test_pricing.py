@@ -211,3 +211,26 @@ class TestPricing(TransactionCase):
         cp = all_goods_pricing.copy()
         with self.assertRaises(UserError):
             pricing.get_pricing_id(partner, warehouse, goods, date)
+
+    def test_pricing_index_batch(self):
+        '''测试价格策略索引的批量取数及修改策略后索引失效'''
+        pricing = self.env['pricing']
+        partner = self.env.ref('core.jd')
+        warehouse = self.env.ref('warehouse.bj_stock')
+        mouse = self.env.ref('goods.mouse')
+        keyboard = self.env.ref('goods.keyboard')
+        items = [(partner, warehouse, mouse, 20160415),
+                 (partner, warehouse, keyboard, 20160515),
+                 (partner, warehouse, mouse, '2016-04-15')]
+        res = pricing.get_pricing_ids(items)
+        self.assertEqual(res[0], pricing.get_pricing_id(*items[0]))
+        self.assertEqual(res[1], pricing.get_pricing_id(*items[1]))
+        self.assertEqual(res[0], res[2])
+        self.assertEqual(pricing.get_discount_rates(items)[0],
+                         res[0] and res[0].discount_rate or 0)
+        # 停用策略后，索引应重新构建
+        if res[0]:
+            res[0].active = False
+            self.assertNotEqual(pricing.get_pricing_id(*items[0]), res[0])
+        with self.assertRaises(UserError):
+            pricing.get_pricing_ids([(False, warehouse, mouse, 20160415)])
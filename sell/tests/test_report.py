@@ -92,6 +92,24 @@ class TestCustomerStatements(TransactionCase):
             report.find_source_order()
 
 
+    def test_customer_statements_with_goods_view(self):
+        '''客户对账单带商品明细直接取自视图，商品行紧跟对应的对账单行'''
+        action = self.statement.partner_statements_with_goods()
+        lines = self.env['customer.statements.report.with.goods'].search(
+            action['domain'])
+        headers = lines.filtered(lambda l: not l.goods_name)
+        self.assertEqual(len(headers), self.env['customer.statements.report'].search_count([
+            ('partner_id', '=', self.statement.partner_id.id),
+            ('date', '>=', self.statement.from_date),
+            ('date', '<=', self.statement.to_date)]))
+        statement = False
+        for line in lines:
+            if not line.goods_name:
+                statement = line.statement_id
+            else:
+                self.assertEqual(line.statement_id, statement)
+                self.assertEqual(line.balance_amount, statement.balance_amount)
+
 class TestTrackWizard(TransactionCase):
     '''测试销售订单跟踪表向导'''
 
@@ -273,6 +291,18 @@ class TestGoodsWizard(TransactionCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(len(new_results), 0)
 
+    def test_goods_report_sql_pushdown(self):
+        '''测试销售汇总表（按商品）在数据库中分页、计数'''
+        summary_goods = self.env['sell.summary.goods'].create({})
+        context = self.goods_wizard.button_ok().get('context')
+        summary_goods = summary_goods.with_context(context)
+        results = summary_goods.search_read(domain=[], limit=None)
+        self.assertTrue(results)
+        self.assertEqual(summary_goods.search_read(domain=[], limit=1), results[:1])
+        self.assertEqual(summary_goods.search_count([]), len(results))
+        # like 中的 % 按普通字符匹配
+        self.assertFalse(summary_goods.search_read(domain=[('goods', 'like', '%')], limit=1))
+
     def test_view_detail(self):
         '''销售汇总表（按商品）  查看明细按钮'''
         summary_goods = self.env['sell.summary.goods'].create({})
@@ -50,6 +50,34 @@ class TestSellDelivery(TransactionCase):
         self.county_id = self.env['all.county'].search(
             [('county_name', '=', '正定县')])
 
+    def test_sell_delivery_done_batch(self):
+        '''批量审核发货单，出错的单据不影响其他单据'''
+        delivery_2 = self.delivery.copy()
+        delivery_3 = self.delivery.copy()
+        delivery_3.receipt = delivery_3.amount + 100
+        deliveries = self.delivery | delivery_2 | delivery_3
+        result = deliveries.sell_delivery_done_batch()
+        self.assertEqual(result['done'], self.delivery | delivery_2)
+        self.assertEqual(list(result['errors']), [delivery_3.name])
+        self.assertEqual(set((self.delivery | delivery_2).mapped('state')), {'done'})
+        self.assertEqual(delivery_3.state, 'draft')
+        self.assertTrue(self.delivery.voucher_id != delivery_2.voucher_id)
+
+    def test_sell_delivery_done_batch_stock_shortage(self):
+        '''允许负库存时，批量审核按本批次累计的出库数量判断库存是否不足'''
+        self.env.user.company_id.is_enable_negative_stock = True
+        delivery_2 = self.delivery.copy()
+        line = self.delivery.line_out_ids[0]
+        available = self.env['wh.move'].check_goods_qty(
+            line.goods_id, line.attribute_id, self.delivery.warehouse_id)[0] or 0
+        self.assertTrue(available >= delivery_2.line_out_ids[0].goods_qty)
+        # 单张都不缺货，合计超过库存
+        line.goods_qty = available
+        result = (self.delivery | delivery_2).sell_delivery_done_batch()
+        self.assertEqual(result['done'], self.delivery)
+        self.assertEqual(list(result['errors']), [delivery_2.name])
+        self.assertEqual(delivery_2.state, 'draft')
+
     def test_sell_to_return(self):
         self.delivery.sell_delivery_done()
         self.delivery.sell_to_return()
@@ -62,6 +62,7 @@
         'action/warehouse_action.xml',
         'menu/warehouse_menu.xml',
         'data/sequence.xml',
+        'data/stock_quant_data.xml',
         'security/ir.model.access.csv',
 #        'data/home_page_data.xml',
     ],
@@ -8,3 +8,4 @@ from . import warehouse_move_line
 from . import move_matching
 from . import res_company
 from . import qc_rule
+from . import stock_quant
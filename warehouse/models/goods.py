@@ -33,23 +33,22 @@ class Goods(models.Model):
     avaliable_qty = fields.Float('可用数量', compute='compute_stock_qty', digits='Quantity')
     
 
-    # 使用SQL来取得指定商品情况下的库存数量
+    # 使用SQL从库存余额中取得指定商品情况下的库存数量
     def get_stock_qty(self):
         for Goods in self:
             self.env.cr.execute('''
-                SELECT sum(line.qty_remaining) as qty,
-                       sum(line.qty_remaining * (line.cost / line.goods_qty)) as cost,
+                SELECT sum(quant.qty) as qty,
+                       sum(quant.cost) as cost,
                        wh.name as warehouse
-                FROM wh_move_line line
-                LEFT JOIN warehouse wh ON line.warehouse_dest_id = wh.id
+                FROM wh_stock_quant quant
+                LEFT JOIN warehouse wh ON quant.warehouse_id = wh.id
 
-                WHERE line.qty_remaining > 0
+                WHERE quant.qty > 0
                   AND wh.type = 'stock'
-                  AND line.state = 'done'
-                  AND line.goods_id = %s
+                  AND quant.goods_id = %s
 
                 GROUP BY wh.name
-            ''' % (Goods.id,))
+            ''', (Goods.id,))
             return self.env.cr.dictfetchall()
 
     def compute_stock_qty(self):
@@ -193,29 +193,28 @@ class WhInventory(models.Model):
             sql_text = '''
                 SELECT wh.id as warehouse_id,
                        goods.id as goods_id,
-                       line.attribute_id as attribute_id,
-                       line.lot as lot,
+                       quant.attribute_id as attribute_id,
+                       quant.lot as lot,
                        uom.id as uom_id,
                        uos.id as uos_id,
-                       sum(line.qty_remaining) as qty,
-                       sum(line.uos_qty_remaining) as uos_qty
+                       sum(quant.qty) as qty,
+                       sum(quant.uos_qty) as uos_qty
 
-                FROM wh_move_line line
-                LEFT JOIN goods goods ON line.goods_id = goods.id
+                FROM wh_stock_quant quant
+                LEFT JOIN goods goods ON quant.goods_id = goods.id
                     LEFT JOIN uom uom ON goods.uom_id = uom.id
                     LEFT JOIN uom uos ON goods.uos_id = uos.id
-                LEFT JOIN warehouse wh ON line.warehouse_dest_id = wh.id
+                LEFT JOIN warehouse wh ON quant.warehouse_id = wh.id
 
-                WHERE line.qty_remaining != 0
+                WHERE quant.qty != 0
                   AND wh.type = 'stock'
-                  AND line.state = 'done'
                   %s
 
                 GROUP BY
-                  wh.id, line.lot, line.attribute_id, goods.id, uom.id, uos.id
+                  wh.id, quant.lot, quant.attribute_id, goods.id, uom.id, uos.id
 
                 ORDER BY
-                    goods.id, line.lot
+                    goods.id, quant.lot
             '''
 
             extra_text = ' AND wh.id = %s' % inventory.warehouse_id.id
@@ -35,6 +35,17 @@ class WhMoveMatching(models.Model):
         change_default=True,
         default=lambda self: self.env.company)
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        matchings = super(WhMoveMatching, self).create(vals_list)
+        # 被匹配的入库行剩余数量减少，同步扣减库存余额
+        self.env['wh.stock.quant'].update_by_matchings(matchings)
+        return matchings
+
+    def unlink(self):
+        self.env['wh.stock.quant'].update_by_matchings(self, sign=1)
+        return super(WhMoveMatching, self).unlink()
+
     def create_matching(self, line_in_id, line_out_id, qty, uos_qty, expiration_date):
         res = {
             'line_out_id': line_out_id,
@@ -86,33 +97,147 @@ class WhMoveLine(models.Model):
             matching.get('expiration_date'),
         )
 
+    def _fetch_matching_layers(self):
+        """
+        一次 SQL 取出本批出库行可能匹配到的全部入库行（剩余数量大于0）
+        :return: {(goods_id, warehouse_id): [入库行字典, ...]}，按 库位、过保日、确认时间、id 排序
+        """
+        layers = {}
+        if not self:
+            return layers
+        self.env['wh.move.line'].flush()
+        self.env.cr.execute('''
+            SELECT line.id, line.goods_id, line.warehouse_dest_id,
+                   line.attribute_id, line.location_id, line.expiration_date,
+                   line.qty_remaining, line.cost, line.goods_qty
+            FROM wh_move_line line
+            LEFT JOIN location loc ON line.location_id = loc.id
+            WHERE line.state = 'done'
+              AND line.qty_remaining > 0
+              AND line.goods_id IN %s
+              AND line.warehouse_dest_id IN %s
+            ORDER BY loc.name, line.expiration_date, line.cost_time, line.id
+        ''', (tuple(set(self.mapped('goods_id').ids)),
+              tuple(set(self.mapped('warehouse_id').ids))))
+        for layer in self.env.cr.dictfetchall():
+            layers.setdefault(
+                (layer['goods_id'], layer['warehouse_dest_id']), []).append(layer)
+        return layers
+
+    def _get_wh_in_line(self, line):
+        """
+        库存不足时自动盘盈生成的入库行（上下文 wh_in_line_ids），
+        按 过保日、确认时间、id 取第一条与出库行匹配的入库行
+        """
+        wh_in_line_ids = self.env.context.get('wh_in_line_ids')
+        if not wh_in_line_ids:
+            return self.browse()
+        lines = self.search([('id', 'in', wh_in_line_ids),
+                             ('state', '=', 'done')],
+                            order='expiration_date, cost_time, id')
+        for line_in in lines:
+            if line_in.warehouse_dest_id == line.warehouse_id and \
+                    line_in.goods_id == line.goods_id and \
+                    (not line.attribute_id or line_in.attribute_id == line.attribute_id):
+                return line_in
+        return self.browse()
+
+    def get_batch_matching_records(self):
+        """
+        批量计算出库行的匹配记录：一次取出所有候选入库行，在内存中按
+        库位就近、先到期先出、先进先出 分配数量，效果与逐行调用
+        goods.get_matching_records / get_matching_records_by_lot 相同
+        :return: {出库行id: (匹配记录列表, 成本)}
+        """
+        result = {}
+        lines = self.filtered(
+            lambda l: l.warehouse_id.type == 'stock' and
+            l.goods_id.is_using_matching())
+        lot_lines = lines.filtered(
+            lambda l: l.goods_id.is_using_batch() and l.lot_id)
+        layers = (lines - lot_lines)._fetch_matching_layers()
+        context_location = self.env.context.get('location')
+        remaining = {}      # 入库行id: 本批匹配后的剩余数量
+        for line in lines:
+            goods = line.goods_id
+            if line in lot_lines:
+                lot = line.lot_id
+                if lot.state != 'done':
+                    raise UserError(u'批号%s还没有实际入库，请先确认该入库' % lot.move_id.name)
+                lot_remaining = remaining.setdefault(lot.id, lot.qty_remaining)
+                if line.goods_qty > lot_remaining and not self.env.context.get('wh_in_line_ids'):
+                    raise UserError(u'商品%s的库存数量不够本次出库' % (goods.name,))
+                remaining[lot.id] -= line.goods_qty
+                result[line.id] = ([{'line_in_id': lot.id, 'qty': line.goods_qty,
+                                     'uos_qty': line.goods_uos_qty,
+                                     'expiration_date': lot.expiration_date}],
+                                   lot.get_real_cost_unit() * line.goods_qty)
+                continue
+
+            # 内部移库从源库位取值；出库单行填写了库位则从该库位取值
+            location_id = context_location or line.location_id.id
+            matching_records = []
+            qty_to_go, uos_qty_to_go, cost = line.goods_qty, line.goods_uos_qty, 0
+            for layer in layers.get((goods.id, line.warehouse_id.id), []):
+                if line.attribute_id and layer['attribute_id'] != line.attribute_id.id:
+                    continue
+                if location_id and layer['location_id'] != location_id:
+                    continue
+                layer_remaining = remaining.setdefault(layer['id'], layer['qty_remaining'])
+                if layer_remaining <= 0:
+                    continue
+                if qty_to_go <= 0 and uos_qty_to_go <= 0:
+                    break
+
+                matching_qty = min(layer_remaining, qty_to_go)
+                matching_uos_qty = matching_qty / goods.conversion
+
+                matching_records.append({'line_in_id': layer['id'],
+                                         'expiration_date': layer['expiration_date'],
+                                         'qty': matching_qty, 'uos_qty': matching_uos_qty})
+
+                cost += matching_qty * safe_division(layer['cost'], layer['goods_qty'])
+                remaining[layer['id']] -= matching_qty
+                qty_to_go -= matching_qty
+                uos_qty_to_go -= matching_uos_qty
+            else:
+                if qty_to_go > 0 and not self.env.context.get('wh_in_line_ids'):
+                    raise UserError(u'商品%s的库存数量不够本次出库' % (goods.name,))
+                line_in = self._get_wh_in_line(line)
+                if line_in:
+                    matching_records.append({'line_in_id': line_in.id,
+                                             'expiration_date': line_in.expiration_date,
+                                             'qty': qty_to_go, 'uos_qty': uos_qty_to_go})
+            result[line.id] = (matching_records, cost)
+
+        return result
+
     def prev_action_done(self):
         """
             发货 matching
         """
+        matching_obj = self.env['wh.move.matching']
+        matching_vals = []
+        batch_matching = self.get_batch_matching_records()
         for line in self:
-            if line.warehouse_id.type == 'stock' and \
-                    line.goods_id.is_using_matching():
-                if line.goods_id.is_using_batch() and line.lot_id:
-                    matching_records, cost = \
-                        line.goods_id.get_matching_records_by_lot(
-                            line.lot_id, line.goods_qty, line.goods_uos_qty)
-                    for matching in matching_records:
-                        self.create_matching_obj(line, matching)
-                else:
-                    matching_records, cost = line.goods_id \
-                        .get_matching_records(
-                        line.warehouse_id, line.goods_qty,
-                        uos_qty = line.goods_uos_qty,
-                        attribute = line.attribute_id,
-                        move_line = line)
-                    for matching in matching_records:
-                        self.create_matching_obj(line, matching)
-                line.cost_unit = safe_division(cost, line.goods_qty)
-                line.cost = cost
-                # 将过保日填充到出库明细行
-                line.expiration_date = matching_records and matching_records[0].get(
-                    'expiration_date')
+            if line.id not in batch_matching:
+                continue
+            matching_records, cost = batch_matching[line.id]
+            for matching in matching_records:
+                matching_vals.append({
+                    'line_out_id': line.id,
+                    'line_in_id': matching.get('line_in_id'),
+                    'qty': matching.get('qty'),
+                    'uos_qty': matching.get('uos_qty'),
+                    'expiration_date': matching.get('expiration_date'),
+                })
+            line.cost_unit = safe_division(cost, line.goods_qty)
+            line.cost = cost
+            # 将过保日填充到出库明细行
+            line.expiration_date = matching_records and matching_records[0].get(
+                'expiration_date')
+        if matching_vals:
+            matching_obj.create(matching_vals)
 
         return super(WhMoveLine, self).prev_action_done()
 
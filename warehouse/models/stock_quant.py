@@ -0,0 +1,178 @@
+from odoo import models, fields, api
+from odoo.tools.sql import create_unique_index, index_exists
+
+from .utils import safe_division
+
+# 库存余额的唯一键，属性、库位、批号可以为空
+QUANT_KEY = "goods_id, COALESCE(attribute_id, 0), warehouse_id, " \
+            "COALESCE(location_id, 0), COALESCE(lot, '')"
+
+
+class WhStockQuant(models.Model):
+    _name = 'wh.stock.quant'
+    _description = '库存余额'
+
+    goods_id = fields.Many2one('goods', '商品', required=True, index=True,
+                               ondelete='cascade', readonly=True)
+    attribute_id = fields.Many2one('attribute', '属性', ondelete='cascade',
+                                   readonly=True)
+    warehouse_id = fields.Many2one('warehouse', '仓库', required=True,
+                                   index=True, ondelete='cascade',
+                                   readonly=True)
+    location_id = fields.Many2one('location', '库位', ondelete='set null',
+                                  readonly=True)
+    lot = fields.Char('批号', readonly=True)
+    qty = fields.Float('数量', digits='Quantity', readonly=True)
+    uos_qty = fields.Float('辅助数量', digits='Quantity', readonly=True)
+    cost = fields.Float('成本', digits='Amount', readonly=True)
+    # 每次变动时从序列取新值，任何已提交的变动都会使 count + sum(version) 改变，与提交先后无关
+    version = fields.Integer('版本', readonly=True)
+
+    def init(self):
+        cr = self._cr
+        if not index_exists(cr, 'wh_stock_quant_key_uniq'):
+            create_unique_index(cr, 'wh_stock_quant_key_uniq',
+                                self._table, [QUANT_KEY])
+        # 呆滞料报表用库存余额的版本判断缓存是否失效
+        cr.execute('CREATE SEQUENCE IF NOT EXISTS wh_stock_quant_version_seq')
+        cr.execute('SELECT 1 FROM wh_stock_quant LIMIT 1')
+        if not cr.fetchone():
+            self.rebuild_quant()
+
+    @api.model
+    def update_quant(self, deltas):
+        '''
+        按 (商品, 属性, 仓库, 库位, 批号) 累加库存余额的变化量
+        :param deltas: [(key, qty, uos_qty, cost), ...]
+        '''
+        totals = {}
+        for key, qty, uos_qty, cost in deltas:
+            total = totals.setdefault(key, [0, 0, 0])
+            total[0] += qty
+            total[1] += uos_qty
+            total[2] += cost
+
+        for key, (qty, uos_qty, cost) in totals.items():
+            goods_id, attribute_id, warehouse_id, location_id, lot = key
+            if not goods_id or not warehouse_id:
+                continue
+            self.env.cr.execute('''
+                INSERT INTO wh_stock_quant
+                    (goods_id, attribute_id, warehouse_id, location_id, lot,
+                     qty, uos_qty, cost, version, create_uid, create_date,
+                     write_uid, write_date)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s,
+                        nextval('wh_stock_quant_version_seq'), %s,
+                        clock_timestamp() at time zone 'UTC', %s,
+                        clock_timestamp() at time zone 'UTC')
+                ON CONFLICT (''' + QUANT_KEY + ''')
+                DO UPDATE SET qty = wh_stock_quant.qty + EXCLUDED.qty,
+                              uos_qty = wh_stock_quant.uos_qty + EXCLUDED.uos_qty,
+                              cost = wh_stock_quant.cost + EXCLUDED.cost,
+                              version = EXCLUDED.version,
+                              write_uid = EXCLUDED.write_uid,
+                              write_date = EXCLUDED.write_date
+            ''', (goods_id, attribute_id or None, warehouse_id,
+                  location_id or None, lot or None, qty, uos_qty, cost,
+                  self.env.uid, self.env.uid))
+        if totals:
+            self.invalidate_cache()
+
+    @api.model
+    def get_line_key(self, line):
+        ''' 入库行（库存层）在库存余额上的键 '''
+        return (line.goods_id.id, line.attribute_id.id,
+                line.warehouse_dest_id.id, line.location_id.id, line.lot or None)
+
+    @api.model
+    def update_by_lines(self, lines, sign=1):
+        ''' 移库单行完成（sign=1）或撤销（sign=-1）时，调整其调入仓库的库存余额 '''
+        self.update_quant([(self.get_line_key(line),
+                            sign * line.goods_qty,
+                            sign * line.goods_uos_qty,
+                            sign * line.cost) for line in lines])
+
+    @api.model
+    def update_by_matchings(self, matchings, sign=-1):
+        ''' 匹配记录创建（sign=-1）或删除（sign=1）时，调整被匹配入库行的库存余额 '''
+        self.update_quant([(self.get_line_key(matching.line_in_id),
+                            sign * matching.qty,
+                            sign * matching.uos_qty,
+                            sign * safe_division(matching.line_in_id.cost,
+                                                 matching.line_in_id.goods_qty)
+                            * matching.qty)
+                           for matching in matchings if matching.line_in_id])
+
+    def _ledger_sql(self):
+        ''' 按移库单行明细汇总的库存余额 '''
+        return '''
+            SELECT line.goods_id, line.attribute_id,
+                   line.warehouse_dest_id AS warehouse_id, line.location_id,
+                   NULLIF(line.lot, '') AS lot,
+                   sum(line.qty_remaining) AS qty,
+                   sum(line.uos_qty_remaining) AS uos_qty,
+                   sum(CASE WHEN line.goods_qty != 0
+                            THEN line.qty_remaining * line.cost / line.goods_qty
+                            ELSE 0 END) AS cost
+            FROM wh_move_line line
+            WHERE line.state = 'done'
+              AND line.warehouse_dest_id IS NOT NULL
+            GROUP BY line.goods_id, line.attribute_id, line.warehouse_dest_id,
+                     line.location_id, NULLIF(line.lot, '')
+        '''
+
+    @api.model
+    def rebuild_quant(self):
+        ''' 根据移库单行明细重建库存余额 '''
+        self.env['wh.move.line'].flush()
+        self.env.cr.execute('DELETE FROM wh_stock_quant')
+        self.env.cr.execute('''
+            INSERT INTO wh_stock_quant
+                (goods_id, attribute_id, warehouse_id, location_id, lot,
+                 qty, uos_qty, cost, version, create_uid, create_date,
+                 write_uid, write_date)
+            SELECT ledger.goods_id, ledger.attribute_id, ledger.warehouse_id,
+                   ledger.location_id, ledger.lot, ledger.qty, ledger.uos_qty,
+                   ledger.cost, nextval('wh_stock_quant_version_seq'),
+                   %s, clock_timestamp() at time zone 'UTC',
+                   %s, clock_timestamp() at time zone 'UTC'
+            FROM (''' + self._ledger_sql() + ''') ledger
+        ''', (self.env.uid, self.env.uid))
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def verify_quant(self, repair=False):
+        '''
+        核对库存余额与移库单行明细
+        :param repair: 为 True 时发现差异则重建库存余额
+        :return: 存在差异的键及两边的数量、成本
+        '''
+        self.env['wh.move.line'].flush()
+        # 成本按金额精度比较，避免逐层分摊成本的舍入误差被当作差异
+        cost_tolerance = 0.5 * 10 ** -self.env['decimal.precision'].precision_get('Amount')
+        self.env.cr.execute('''
+            SELECT COALESCE(ledger.goods_id, quant.goods_id) AS goods_id,
+                   COALESCE(ledger.attribute_id, quant.attribute_id) AS attribute_id,
+                   COALESCE(ledger.warehouse_id, quant.warehouse_id) AS warehouse_id,
+                   COALESCE(ledger.location_id, quant.location_id) AS location_id,
+                   COALESCE(ledger.lot, quant.lot) AS lot,
+                   COALESCE(ledger.qty, 0) AS ledger_qty,
+                   COALESCE(quant.qty, 0) AS quant_qty,
+                   COALESCE(ledger.cost, 0) AS ledger_cost,
+                   COALESCE(quant.cost, 0) AS quant_cost
+            FROM (''' + self._ledger_sql() + ''') ledger
+            FULL OUTER JOIN wh_stock_quant quant
+                 ON quant.goods_id = ledger.goods_id
+                AND COALESCE(quant.attribute_id, 0) = COALESCE(ledger.attribute_id, 0)
+                AND quant.warehouse_id = ledger.warehouse_id
+                AND COALESCE(quant.location_id, 0) = COALESCE(ledger.location_id, 0)
+                AND COALESCE(quant.lot, '') = COALESCE(ledger.lot, '')
+            WHERE abs(COALESCE(ledger.qty, 0) - COALESCE(quant.qty, 0)) > 0.000001
+               OR abs(COALESCE(ledger.uos_qty, 0) - COALESCE(quant.uos_qty, 0)) > 0.000001
+               OR abs(COALESCE(ledger.cost, 0) - COALESCE(quant.cost, 0)) >= %s
+        ''', (cost_tolerance,))
+        res = self.env.cr.dictfetchall()
+        if res and repair:
+            self.rebuild_quant()
+        return res
@@ -213,20 +213,19 @@ class WhMove(models.Model):
 
     
     def check_goods_qty(self, goods, attribute, warehouse):
-        '''SQL来取指定商品，属性，仓库，的当前剩余数量'''
+        '''SQL从库存余额中取指定商品，属性，仓库，的当前剩余数量'''
 
         if attribute:
-            change_conditions = "AND line.attribute_id = %s" % attribute.id
+            change_conditions = "AND quant.attribute_id = %s" % attribute.id
         elif goods:
-            change_conditions = "AND line.goods_id = %s" % goods.id
+            change_conditions = "AND quant.goods_id = %s" % goods.id
         else:
             change_conditions = "AND 1 = 0"
         self.env.cr.execute('''
-                       SELECT sum(line.qty_remaining) as qty
-                       FROM wh_move_line line
+                       SELECT sum(quant.qty) as qty
+                       FROM wh_stock_quant quant
 
-                       WHERE line.warehouse_dest_id = %s
-                             AND line.state = 'done'
+                       WHERE quant.warehouse_id = %s
                              %s
                    ''' % (warehouse.id, change_conditions,))
         return self.env.cr.fetchone()
@@ -225,6 +225,19 @@ class WhMoveLine(models.Model):
                               digits='Amount',
                               help='点击分摊按钮或确认时将采购费用进行分摊得出的费用')
 
+    def init(self):
+        # 呆滞料报表只扫描还有剩余数量的库存层
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS wh_move_line_open_layer_index
+                ON wh_move_line (warehouse_dest_id, goods_id, attribute_id, date)
+             WHERE state = 'done' AND qty_remaining != 0
+        """)
+        # 呆滞料报表缓存键取移库单行最后修改时间
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS wh_move_line_write_date_index
+                ON wh_move_line (write_date)
+        """)
+
     @api.model
     def create(self, vals):
         new_id = super(WhMoveLine, self).create(vals)
@@ -328,9 +341,12 @@ class WhMoveLine(models.Model):
 
     
     def action_done(self):
+        todo_lines = self.filtered(lambda l: l.state != 'done')
         for line in self:
             line.check_availability()
-            line.prev_action_done()
+        # 出库匹配整批处理，避免逐行查询入库行
+        self.prev_action_done()
+        for line in self:
             line.write({
                 'state': 'done',
                 'date': line.move_id.date,
@@ -372,6 +388,9 @@ class WhMoveLine(models.Model):
                     dic['move_id'] = wh_internal.move_id.id
                     self.env['wh.move.line'].create(dic)
 
+        # 更新调入仓库的库存余额
+        self.env['wh.stock.quant'].update_by_lines(todo_lines)
+
     def check_cancel(self):
         pass
 
@@ -379,6 +398,7 @@ class WhMoveLine(models.Model):
         pass
 
     def action_draft(self):
+        done_lines = self.filtered(lambda l: l.state == 'done')
         for line in self:
             line.check_cancel()
             line.prev_action_draft()
@@ -386,6 +406,8 @@ class WhMoveLine(models.Model):
                 'state': 'draft',
                 'date': False,
             })
+        # 撤销时扣回调入仓库的库存余额
+        self.env['wh.stock.quant'].update_by_lines(done_lines, sign=-1)
 
     def compute_lot_compatible(self):
         for wml in self:
@@ -3,10 +3,111 @@ from odoo.osv import osv
 from odoo.http import request
 import itertools
 import operator
+import threading
 import time
 import pickle
-from odoo import models, api
+from collections import OrderedDict
+from odoo import models, api, tools
 from odoo.exceptions import UserError
+from odoo.osv import expression
+
+
+class ReportCache(object):
+    '''
+    报表结果缓存
+    按 数据库、报表、公司、查询参数 缓存 collect_data_by_sql 的结果，超过容量时淘汰最久未使用的结果；
+    缓存在各进程内，单据行变动时本进程按日期失效截止日期不早于变动日期的结果；
+    同时通过注册表缓存信号（clear_caches）更换缓存代次，其他进程处理下一个请求时不再命中旧结果。
+    其他进程在变动事务提交前、或收到信号前的最后一个请求中仍可能读到旧结果，最长不超过过期时间（_expired_time 秒）
+    '''
+
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def get(self, key, expired_time):
+        with self.lock:
+            record = self.records.get(key)
+            if record and record['time'] + expired_time >= time.time():
+                self.records.move_to_end(key)
+                self.hits += 1
+                return record['result']
+
+            self.records.pop(key, None)
+            self.misses += 1
+            return None
+
+    def set(self, key, result, date_end=None):
+        with self.lock:
+            self.records[key] = {
+                'result': result,
+                'time': time.time(),
+                'date_end': date_end and str(date_end) or None,
+            }
+            self.records.move_to_end(key)
+            while len(self.records) > self.max_size:
+                self.records.popitem(last=False)
+
+    def invalidate(self, dbname, dates=None):
+        '''
+        失效某个数据库的缓存结果
+        :param dates: 变动单据的日期，为空时失效该数据库全部结果
+        '''
+        min_date = dates and min(str(date) for date in dates) or None
+        with self.lock:
+            for key in list(self.records):
+                if key[0] != dbname:
+                    continue
+                date_end = self.records[key]['date_end']
+                if not min_date or not date_end or min_date <= date_end:
+                    del self.records[key]
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.records)}
+
+
+report_cache = ReportCache()
+
+
+class ReportCacheMixin(models.AbstractModel):
+    '''报表数据来源的单据，新增、修改、删除时失效对应日期的报表缓存'''
+    _name = 'report.cache.mixin'
+    _description = '报表缓存失效'
+
+    _report_cache_date_field = 'date'
+
+    def _invalidate_report_cache(self, vals=None):
+        date_field = self._report_cache_date_field
+        dates = [date for date in self.mapped(date_field) if date]
+        if vals and vals.get(date_field):
+            dates.append(vals[date_field])
+        if dates:
+            report_cache.invalidate(self.env.cr.dbname, dates)
+            # 通知其他进程：清空注册表缓存后报表缓存代次改变，旧结果不再命中
+            self.env['report.base'].clear_caches()
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super(ReportCacheMixin, self).create(vals_list)
+        records._invalidate_report_cache()
+        return records
+
+    def write(self, vals):
+        self._invalidate_report_cache(vals)
+        return super(ReportCacheMixin, self).write(vals)
+
+    def unlink(self):
+        self._invalidate_report_cache()
+        return super(ReportCacheMixin, self).unlink()
 
 
 class ReportBase(models.Model):
@@ -14,9 +115,8 @@ class ReportBase(models.Model):
     _description = '使用search_read来直接生成数据的基本类，其他类可以直接异名继承当前类来重用搜索、过滤、分组等函数'
 
     _expired_time = 60
-    _cache_record = False
-    _cache_env = False
-    _cache_time = False
+    # 报表结果由单个查询语句生成时，过滤、排序、分组和分页直接在数据库中完成
+    _sql_pushdown = False
 
     def select_sql(self, sql_type='out'):
         return ''
@@ -36,7 +136,8 @@ class ReportBase(models.Model):
     def get_context(self, sql_type='out', context=None):
         return {}
 
-    def execute_sql(self, sql_type='out'):
+    def get_sql(self, sql_type='out'):
+        ''' 拼接报表的查询语句 '''
         context = self.get_context(sql_type, context=self.env.context)
         for key, value in list(context.items()):
             if key == "date_end" :
@@ -46,15 +147,149 @@ class ReportBase(models.Model):
             if isinstance(context[key], str):
                 context[key] = value.encode('utf-8')
 
-        self.env.cr.execute((self.select_sql(sql_type) + self.from_sql(sql_type) + self.where_sql(
+        return (self.select_sql(sql_type) + self.from_sql(sql_type) + self.where_sql(
             sql_type) + self.group_sql(sql_type) + self.order_sql(
-            sql_type)).format(**context))
+            sql_type)).format(**context)
+
+    def execute_sql(self, sql_type='out'):
+        self.env.cr.execute(self.get_sql(sql_type))
 
         return self.env.cr.dictfetchall()
 
     def collect_data_by_sql(self, sql_type='out'):
         return []
 
+    def _get_report_column(self, field):
+        ''' 报表查询结果中的列，只允许使用报表上定义的字段 '''
+        if field not in self._fields:
+            raise UserError('不可识别的字段%s，请检查domain或排序条件是否正确' % field)
+
+        return '"report"."%s"' % field
+
+    def _compile_many2one_name_leaf(self, field, column, opto, value):
+        '''
+        多对一字段按名称过滤：先在关联模型上按名称查出 id，再按 id 过滤报表结果
+        否定条件（!=、not like 等）取肯定条件匹配记录之外的行，包括空值
+        '''
+        negative = {'!=': '=', 'not like': 'like', 'not ilike': 'ilike', 'not in': 'in'}
+        comodel = self.env[self._fields[field].comodel_name]
+        ids = comodel._search([(comodel._rec_name, negative.get(opto, opto), value)])
+        if opto in negative:
+            if not ids:
+                return 'TRUE', []
+            return '(%s IS NULL OR %s NOT IN %%s)' % (column, column), [tuple(ids)]
+        if not ids:
+            return 'FALSE', []
+        return '%s IN %%s' % column, [tuple(ids)]
+
+    def _compile_leaf(self, leaf):
+        field, opto, value = leaf
+        column = self._get_report_column(field)
+        field_type = self._fields[field].type
+        opto = opto.lower()
+        if opto in ('=', '!=') and (value is False or value is None):
+            # 与内存过滤一致：空值转为 False 后，False 与 0 也相等
+            empty = {'boolean': 'FALSE', 'integer': '0', 'float': '0',
+                     'monetary': '0'}.get(field_type)
+            if empty is None:
+                return '%s IS %sNULL' % (column, opto == '!=' and 'NOT ' or ''), []
+            if opto == '=':
+                return '(%s IS NULL OR %s = %s)' % (column, column, empty), []
+            return '(%s IS NOT NULL AND %s != %s)' % (column, column, empty), []
+        if field_type == 'many2one' and (
+                isinstance(value, str) or isinstance(value, (list, tuple))
+                and any(isinstance(item, str) for item in value)):
+            # 多对一字段在结果中是 id，传入名称时按关联记录的名称过滤
+            if opto in ('=', '!=', 'like', 'ilike', 'not like', 'not ilike', 'in', 'not in'):
+                return self._compile_many2one_name_leaf(field, column, opto, value)
+        if opto in ('like', 'ilike', 'not like', 'not ilike'):
+            # 与内存过滤一致按子串匹配，值中的 % _ 不作通配符
+            value = str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            return '%s::text %s %%s' % (column, opto.upper()), ['%%%s%%' % value]
+        if opto in ('in', 'not in'):
+            if not value:
+                return opto == 'in' and 'FALSE' or 'TRUE', []
+            return '%s %s %%s' % (column, opto.upper()), [tuple(value)]
+        if opto in ('=', '!=', '>', '<', '>=', '<='):
+            if not self._is_comparable_value(field_type, value):
+                # 与内存过滤一致：类型不同的值永不相等，无法比较大小时报错
+                if opto in ('=', '!='):
+                    return opto == '=' and 'FALSE' or 'TRUE', []
+                raise UserError('暂时无法解析的domain条件%s，请联系管理员' % str(leaf))
+            return '%s %s %%s' % (column, opto), [value]
+
+        raise UserError('暂时无法解析的domain条件%s，请联系管理员' % str(leaf))
+
+    def _is_comparable_value(self, field_type, value):
+        ''' 值能否直接与该类型的列比较，避免数据库类型转换出错 '''
+        if field_type in ('integer', 'float', 'monetary', 'many2one'):
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        if field_type in ('char', 'text', 'selection', 'html'):
+            return isinstance(value, str)
+        return True
+
+    def _compile_domain(self, domain):
+        '''
+        将 domain 转换为查询报表结果的 where 条件
+        :return: (where 条件, 参数列表)
+        '''
+        domain = expression.normalize_domain(domain or [])
+
+        def compile_next(index):
+            token = domain[index]
+            if token in ('&', '|'):
+                left, left_params, index = compile_next(index + 1)
+                right, right_params, index = compile_next(index)
+                return ('(%s %s %s)' % (left, token == '&' and 'AND' or 'OR', right),
+                        left_params + right_params, index)
+            if token == '!':
+                sql, params, index = compile_next(index + 1)
+                return '(NOT %s)' % sql, params, index
+            if token == expression.TRUE_LEAF:
+                return 'TRUE', [], index + 1
+            if token == expression.FALSE_LEAF:
+                return 'FALSE', [], index + 1
+            if not isinstance(token, (list, tuple)) or len(token) != 3:
+                raise UserError('不可识别的domain条件，请检查domain"%s"是否正确' % str(token))
+            sql, params = self._compile_leaf(token)
+            return sql, params, index + 1
+
+        sql, params, _ = compile_next(0)
+        return sql, params
+
+    def _compile_order(self, order):
+        ''' 将排序条件转换为 order by 子句，只允许报表上定义的字段 '''
+        order_by = []
+        for item in (order or self._order or '').split(','):
+            item = item.strip().split()
+            if not item:
+                continue
+            direction = len(item) > 1 and item[1].upper() or 'ASC'
+            if direction not in ('ASC', 'DESC'):
+                raise UserError('不可识别的排序条件%s' % order)
+            order_by.append('%s %s' % (self._get_report_column(item[0]), direction))
+
+        return order_by and ' ORDER BY ' + ', '.join(order_by) or ''
+
+    def _execute_report_query(self, select, domain=None, group='', order='', limit=None, offset=0):
+        '''
+        在数据库中对报表查询结果做过滤、分组、排序和分页
+        报表本身的查询语句作为子查询，domain 等条件以参数方式传入
+        '''
+        where, params = self._compile_domain(domain)
+        # 报表语句中的 % （如 like 'sell.delivery%'）需转义，否则与外层参数占位符冲突
+        query = 'SELECT %s FROM (%s) AS "report" WHERE %s%s%s' % (
+            select, self.get_sql('out').replace('%', '%%'), where, group, order)
+        if limit:
+            query += ' LIMIT %s'
+            params.append(limit)
+        if offset:
+            query += ' OFFSET %s'
+            params.append(offset)
+        self.env.cr.execute(query, params)
+
+        return self.update_result_none_to_false(self.env.cr.dictfetchall())
+
     def check_valid_domain(self, domain):
         if not isinstance(domain, (list, tuple)):
             raise UserError('不可识别的domain条件，请检查domain"%s"是否正确' % str(domain))
@@ -79,10 +314,10 @@ class ReportBase(models.Model):
             field, opto, value = domain
 
             compute_operator = {
-                'ilike': lambda field, value: unicode(value).lower() in unicode(field).lower(),
-                'like': lambda field, value: unicode(value) in unicode(field),
-                'not ilike': lambda field, value: unicode(value).lower() not in unicode(field).lower(),
-                'not like': lambda field, value: unicode(value) not in unicode(field),
+                'ilike': lambda field, value: str(value).lower() in str(field).lower(),
+                'like': lambda field, value: str(value) in str(field),
+                'not ilike': lambda field, value: str(value).lower() not in str(field).lower(),
+                'not like': lambda field, value: str(value) not in str(field),
                 'in': lambda field, value: field in value,
                 'not in': lambda field, value: field not in value,
                 '=': operator.eq,
@@ -127,53 +362,78 @@ class ReportBase(models.Model):
 
     @api.model
     def read_group(self, domain, fields, groupby, offset=0, limit=80, orderby=False, lazy=True):
-
-        def dict_plus(collect, values):
-            for key, value in values.items():
-                if isinstance(value, (int, float)):
-                    if key not in collect:
-                        collect[key] = 0
-                    collect[key] += value
-
-            collect[groupby[0] + '_count'] += 1
-
-            return collect
+        if isinstance(groupby, str):
+            groupby = [groupby]
+        if not groupby:
+            return []
+
+        group_field = groupby[0].split(':')[0]
+        sum_fields = [field.split(':')[0] for field in fields or []]
+        sum_fields = [field for field in sum_fields
+                      if field in self._fields and field not in ('id', group_field)
+                      and self._fields[field].type in ('integer', 'float', 'monetary')]
+
+        # 指定了分组排序或日期粒度（如 date:month）时走内存分组
+        if self._sql_pushdown and not orderby and ':' not in groupby[0]:
+            column = self._get_report_column(group_field)
+            select = ', '.join(['%s AS "%s"' % (column, group_field),
+                                'count(*) AS "%s_count"' % group_field] +
+                               ['sum(%s) AS "%s"' % (self._get_report_column(field), field)
+                                for field in sum_fields])
+            key = (str(domain), group_field, tuple(sum_fields), orderby, limit, offset)
+            values = self._get_cached_result(
+                'out', key, lambda: self._execute_report_query(
+                    select, domain, group=' GROUP BY %s' % column,
+                    order=' ORDER BY %s' % column, limit=limit, offset=offset))
+        else:
+            values = []
+            records = self._compute_domain(self.get_data_from_cache(sql_type='out'), domain)
+            key = operator.itemgetter(group_field)
+            for group, itervalue in itertools.groupby(
+                    sorted(records, key=lambda item: str(key(item))), key):
+                collect = {group_field: group, group_field + '_count': 0}
+                for value in itervalue:
+                    collect[group_field + '_count'] += 1
+                    for field in sum_fields:
+                        collect[field] = collect.get(field, 0) + (value.get(field) or 0)
+                values.append(collect)
+            values = self._compute_limit_and_offset(values, limit, offset)
 
         res = []
-        values = self.search_read(
-            domain=domain, fields=fields, offset=offset, limit=limit or 80, order=orderby)
-
-        if groupby:
-            key = operator.itemgetter(groupby[0])
-            for group, itervalue in itertools.groupby(sorted(values, key=key), key):
-                collect = {'__domain': [
-                    (groupby[0], '=', group)], groupby[0]: group, groupby[0] + '_count': 0}
-                collect = reduce(lambda collect, value: dict_plus(
-                    collect, value), itervalue, collect)
-
-                if len(groupby) > 1:
-                    collect.update({
-                        '__context': {'group_by': groupby[1:]}
-                    })
-
-                if domain:
-                    collect['__domain'].extend(domain)
-
-                res.append(collect)
+        for value in values:
+            collect = dict(value, __domain=[(group_field, '=', value[group_field])] + list(domain or []))
+            if len(groupby) > 1:
+                collect.update({
+                    '__context': {'group_by': groupby[1:]}
+                })
+            res.append(collect)
 
         return res
 
     def _compute_order(self, result, order):
-        # TODO 暂时不支持多重排序
-        if order:
-            order = order.partition(',')[0].partition(' ')
-            list(result).sort(key=lambda item: item.get(
-                order[0]), reverse=order[2] == 'ASC')
+        # 按排序条件从后往前依次稳定排序，实现多重排序
+        result = list(result)
+        order = order or self._order
+        for item in reversed((order or '').split(',')):
+            item = item.strip().split()
+            if not item:
+                continue
+            field, reverse = item[0], len(item) > 1 and item[1].upper() == 'DESC'
+
+            def sort_key(record):
+                # 空值排在最后，且不与其他类型的值比较
+                value = record.get(field)
+                if value is False or value is None:
+                    return (True, 0)
+                return (False, value)
+
+            result.sort(key=sort_key, reverse=reverse)
 
         return result
 
     def _compute_limit_and_offset(self, result, limit, offset):
-        return list(result)[offset:limit + offset]
+        result = list(result)
+        return limit and result[offset:limit + offset] or result[offset:]
 
     def update_result_none_to_false(self, result):
         for val in result:
@@ -183,19 +443,46 @@ class ReportBase(models.Model):
 
         return result
 
-    def get_data_from_cache(self, sql_type='out'):
-        if self._cache_env != (self.env.uid, self.env.context) \
-                or not self._cache_record or self._cache_time + self._expired_time < time.time():
+    @tools.ormcache()
+    def _get_cache_generation(self):
+        '''报表缓存代次，clear_caches 后各进程重新生成，用于跨进程失效报表缓存'''
+        return time.time()
 
-            self.__class__._cache_record = self.update_result_none_to_false(
-                self.collect_data_by_sql(sql_type))
-            self.__class__._cache_time = time.time()
-            self.__class__._cache_env = (self.env.uid, self.env.context)
+    def _get_cache_key(self, sql_type='out', extra=()):
+        context = self.get_context(sql_type, context=self.env.context)
+        params = tuple((key, str(value)) for key, value in sorted(context.items()))
+        return (self.env.cr.dbname, self._name, sql_type, self.env.company.id,
+                self._get_cache_generation(), params) + tuple(extra)
+
+    def _get_cached_result(self, sql_type, extra, compute):
+        key = self._get_cache_key(sql_type, extra)
+        result = report_cache.get(key, self._expired_time)
+        if result is None:
+            result = compute()
+            date_end = self.get_context(sql_type, context=self.env.context).get('date_end')
+            report_cache.set(key, result, date_end)
 
-        return self._cache_record
+        return result
+
+    def get_data_from_cache(self, sql_type='out'):
+        return self._get_cached_result(
+            sql_type, (), lambda: self.update_result_none_to_false(
+                self.collect_data_by_sql(sql_type)))
+
+    @api.model
+    def get_cache_stats(self):
+        ''' 报表缓存的命中、未命中次数及当前缓存条数 '''
+        return report_cache.stats()
 
     @api.model
     def search_read(self, domain=None, fields=None, offset=0, limit=80, order=None):
+        if self._sql_pushdown:
+            key = ('search_read', str(domain), order, limit, offset)
+            return self._get_cached_result(
+                'out', key, lambda: self._execute_report_query(
+                    '"report".*', domain, order=self._compile_order(order),
+                    limit=limit, offset=offset))
+
         result = self.get_data_from_cache(sql_type='out')
 
         result = self._compute_domain(result, domain)
@@ -206,6 +493,12 @@ class ReportBase(models.Model):
 
     @api.model
     def search_count(self, domain):
+        if self._sql_pushdown:
+            key = ('search_count', str(domain))
+            return self._get_cached_result(
+                'out', key, lambda: self._execute_report_query(
+                    'count(*) AS count', domain))[0]['count']
+
         result = self.get_data_from_cache(sql_type='out')
         result = self._compute_domain(result, domain)
 
@@ -217,8 +510,27 @@ class ReportBase(models.Model):
         fields = fields or []
 
         fields.append('id')
-        for record in self.get_data_from_cache():
+        if self._sql_pushdown:
+            records = self.search_read(domain=[('id', 'in', self.ids)], limit=None)
+        else:
+            records = self.get_data_from_cache()
+        for record in records:
             if record.get('id') in self.ids:
                 res.append({field: record.get(field) for field in fields})
 
         return res
+
+
+class WhMoveLine(models.Model):
+    _name = 'wh.move.line'
+    _inherit = ['wh.move.line', 'report.cache.mixin']
+
+
+class MoneyOrder(models.Model):
+    _name = 'money.order'
+    _inherit = ['money.order', 'report.cache.mixin']
+
+
+class MoneyInvoice(models.Model):
+    _name = 'money.invoice'
+    _inherit = ['money.invoice', 'report.cache.mixin']
@@ -29,35 +29,34 @@ class ReportStockBalance(models.Model):
         cr.execute(
             """
             create or replace view report_stock_balance as (
-                SELECT min(line.id) as id,
+                SELECT min(quant.id) as id,
                        goods.name as goods,
                        goods.id as goods_id,
                        goods.brand as brand_id,
                        loc.name as location,
-                       line.lot as lot,
+                       quant.lot as lot,
                        attribute.name as attribute_id,
                        uom.name as uom,
                        uos.name as uos,
                        wh.name as warehouse,
-                       sum(line.qty_remaining) as goods_qty,
-                       sum(line.uos_qty_remaining) as goods_uos_qty,
-                       sum(line.qty_remaining * line.cost_unit) as cost
-
-                FROM wh_move_line line
-                LEFT JOIN warehouse wh ON line.warehouse_dest_id = wh.id
-                LEFT JOIN goods goods ON line.goods_id = goods.id
-                    LEFT JOIN attribute attribute on attribute.id = line.attribute_id
+                       sum(quant.qty) as goods_qty,
+                       sum(quant.uos_qty) as goods_uos_qty,
+                       sum(quant.cost) as cost
+
+                FROM wh_stock_quant quant
+                LEFT JOIN warehouse wh ON quant.warehouse_id = wh.id
+                LEFT JOIN goods goods ON quant.goods_id = goods.id
+                    LEFT JOIN attribute attribute on attribute.id = quant.attribute_id
                     LEFT JOIN uom uom ON goods.uom_id = uom.id
                     LEFT JOIN uom uos ON goods.uos_id = uos.id
-                    LEFT JOIN location loc ON loc.id = line.location_id
+                    LEFT JOIN location loc ON loc.id = quant.location_id
 
                 WHERE  wh.type = 'stock'
-                  AND line.state = 'done'
-                  AND line.qty_remaining != 0
+                  AND quant.qty != 0
                   AND ( goods.no_stock is null or goods.no_stock = FALSE)
 
 
-                GROUP BY wh.name, line.lot, attribute.name, goods.name, goods.id, goods.brand, loc.name, uom.name, uos.name
+                GROUP BY wh.name, quant.lot, attribute.name, goods.name, goods.id, goods.brand, loc.name, uom.name, uos.name
 
                 ORDER BY goods.name, wh.name, goods_qty asc
             )
@@ -8,6 +8,7 @@ class ReportStockTransceive(models.Model):
     _name = 'report.stock.transceive'
     _description = '商品收发明细表'
     _inherit = 'report.base'
+    _sql_pushdown = True
 
     goods = fields.Many2one('goods','商品')
     attribute = fields.Char('属性')
@@ -33,66 +34,90 @@ class ReportStockTransceive(models.Model):
 
     def select_sql(self, sql_type='out'):
         return '''
-        SELECT min(line.id) as id,
-                goods.id as goods,
-                att.name as attribute,
+        SELECT row_number() OVER (ORDER BY line.goods_id, line.warehouse,
+                                          line.attribute, line.uom) as id,
+                line.goods_id as goods,
+                line.attribute as attribute,
                 array_agg(line.id) as id_lists,
-                uom.name as uom,
-                wh.name as warehouse,
+                line.uom as uom,
+                line.warehouse as warehouse,
                 sum(case when
-                    line.date < '{date_start}' THEN line.goods_qty ELSE 0 END)
+                    line.date < '{date_start}' THEN line.sign * line.goods_qty ELSE 0 END)
                     as goods_qty_begain,
                 sum(case when
-                    line.date < '{date_start}' THEN line.cost ELSE 0 END)
+                    line.date < '{date_start}' THEN line.sign * line.cost ELSE 0 END)
                     as cost_begain,
+                sum(line.sign * line.goods_qty) as goods_qty_end,
+                sum(line.sign * line.cost) as cost_end,
                 sum(case when
-                    line.date < '{date_end}' THEN line.goods_qty ELSE 0 END)
-                    as goods_qty_end,
+                    line.sign = -1 AND line.date >= '{date_start}'
+                  THEN
+                    line.goods_qty ELSE 0 END)
+                    as goods_qty_out,
                 sum(case when
-                    line.date < '{date_end}' THEN line.cost ELSE 0 END)
-                    as cost_end,
+                    line.sign = -1 AND line.date >= '{date_start}'
+                  THEN
+                    line.cost ELSE 0 END)
+                    as cost_out,
                 sum(case when
-                    line.date < '{date_end}' AND line.date >= '{date_start}'
+                    line.sign = 1 AND line.date >= '{date_start}'
                   THEN
                     line.goods_qty ELSE 0 END)
-                    as goods_qty,
+                    as goods_qty_in,
                 sum(case when
-                    line.date < '{date_end}' AND line.date >= '{date_start}'
+                    line.sign = 1 AND line.date >= '{date_start}'
                   THEN
                     line.cost ELSE 0 END)
-                    as cost
+                    as cost_in
         '''
 
-    def from_sql(self, sql_type='out'):
-        return '''
-        FROM wh_move_line line
-            LEFT JOIN goods goods ON line.goods_id = goods.id
-            LEFT JOIN attribute att ON line.attribute_id = att.id
-            LEFT JOIN uom uom ON line.uom_id = uom.id
-            LEFT JOIN warehouse wh ON line.%s = wh.id
-        ''' % (sql_type == 'out' and 'warehouse_id' or 'warehouse_dest_id')
-
-    def where_sql(self, sql_type='out'):
+    def _line_sql(self, warehouse_field, sign):
+        ''' 出库（调出仓库）或入库（调入仓库）方向的库存调拨明细 '''
         extra = ''
         if self.env.context.get('warehouse_id'):
-            extra += 'AND wh.id = {warehouse_id}'
+            extra += ' AND wh.id = {warehouse_id}'
         if self.env.context.get('goods_id'):
-            extra += 'AND goods.id = {goods_id}'
+            extra += ' AND line.goods_id = {goods_id}'
+        return '''
+            SELECT line.id,
+                   line.goods_id,
+                   att.name as attribute,
+                   uom.name as uom,
+                   wh.name as warehouse,
+                   line.date,
+                   line.goods_qty,
+                   line.cost,
+                   %s as sign
+            FROM wh_move_line line
+                LEFT JOIN attribute att ON line.attribute_id = att.id
+                LEFT JOIN uom uom ON line.uom_id = uom.id
+                LEFT JOIN warehouse wh ON line.%s = wh.id
+            WHERE line.state = 'done'
+              AND wh.type = 'stock'
+              AND line.date < '{date_end}'
+              %s
+        ''' % (sign, warehouse_field, extra)
+
+    def from_sql(self, sql_type='out'):
+        # 出库和入库明细合并后一次汇总
         return '''
-        WHERE line.state = 'done'
-          AND wh.type = 'stock'
-          AND line.date < '{date_end}'
-          %s
-        ''' % extra
+        FROM (%s
+            UNION ALL
+            %s) AS line
+        ''' % (self._line_sql('warehouse_id', -1),
+               self._line_sql('warehouse_dest_id', 1))
+
+    def where_sql(self, sql_type='out'):
+        return ''
 
     def group_sql(self, sql_type='out'):
         return '''
-        GROUP BY goods.id, att.name, uom.name, wh.name
+        GROUP BY line.goods_id, line.attribute, line.uom, line.warehouse
         '''
 
     def order_sql(self, sql_type='out'):
         return '''
-        ORDER BY goods.id, wh.name
+        ORDER BY line.goods_id, line.warehouse, line.attribute, line.uom
         '''
 
     def get_context(self, sql_type='out', context=None):
@@ -106,76 +131,8 @@ class ReportStockTransceive(models.Model):
             'goods_id': context.get('goods_id') and context.get('goods_id')[0] or '',
         }
 
-    def get_record_key(self, record, sql_type='out'):
-        return (
-            record.get('goods'),
-            record.get('uom'),
-            record.get('warehouse'),
-            record.get('attribute'))
-
-    def unzip_record_key(self, key):
-        return {
-            'goods': key[0],
-            'uom': key[1],
-            'warehouse': key[2],
-            'attribute': key[3],
-        }
-
-    def get_default_value_by_record(self, record, sql_type='out'):
-        return {
-            'id': record.get('id'),
-        }
-
-    def update_record_value(self, value, record, sql_type='out'):
-        tag = sql_type == 'out' and -1 or 1
-
-        value.update({
-            'goods_qty_begain': value.get('goods_qty_begain', 0) +
-                    (tag * record.get('goods_qty_begain', 0)),
-            'cost_begain': value.get('cost_begain', 0) +
-                    (tag * record.get('cost_begain', 0)),
-            'goods_qty_end': value.get('goods_qty_end', 0) +
-                    (tag * record.get('goods_qty_end', 0)),
-            'cost_end': value.get('cost_end', 0) +
-                    (tag * record.get('cost_end', 0)),
-
-            'goods_qty_out': value.get('goods_qty_out', 0) +
-                    (sql_type == 'out' and record.get('goods_qty', 0) or 0),
-            'cost_out': value.get('cost_out', 0) +
-                    (sql_type == 'out' and record.get('cost', 0) or 0),
-            'goods_qty_in': value.get('goods_qty_in', 0) +
-                    (sql_type == 'in' and record.get('goods_qty', 0) or 0),
-            'cost_in': value.get('cost_in', 0) +
-                    (sql_type == 'in' and record.get('cost', 0) or 0),
-            'id_lists': value.get('id_lists', []) + record.get('id_lists', []),
-        })
-
-    def compute_history_stock_by_collect(self, res, records, sql_type='out'):
-        for record in records:
-            record_key = self.get_record_key(record, sql_type=sql_type)
-            if not res.get(record_key):
-                res[record_key] = self.get_default_value_by_record(
-                    record, sql_type=sql_type)
-
-            self.update_record_value(
-                res[record_key], record, sql_type=sql_type)
-
     def collect_data_by_sql(self, sql_type='out'):
-        out_collection = self.execute_sql(sql_type='out')
-        in_collection = self.execute_sql(sql_type='in')
-
-        res = {}
-        self.compute_history_stock_by_collect(
-            res, in_collection, sql_type='in')
-        self.compute_history_stock_by_collect(
-            res, out_collection, sql_type='out')
-
-        result = []
-        for key, value in res.items():
-            value.update(self.unzip_record_key(key))
-            result.append(value)
-
-        return result
+        return self.execute_sql(sql_type='out')
 
     
     def find_source_move_line(self):
@@ -1,5 +1,9 @@
 from odoo.tests.common import TransactionCase
 from odoo.exceptions import UserError, ValidationError
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
 
 
 class TestMoveLine(TransactionCase):
@@ -301,3 +305,59 @@ class TestMoveLine(TransactionCase):
         keyboard_line.attribute_id = False
         with self.assertRaises(UserError):
             keyboard_line.action_done()
+
+    def test_batch_matching(self):
+        '''批量出库匹配与逐行匹配结果一致，并记录两者耗时'''
+        self.env.ref('core.goods_category_1').account_id = self.env.ref(
+            'finance.account_goods').id
+        line_count = 200
+        wh_in = self.env['wh.in'].create({
+            'type': 'others',
+            'warehouse_id': self.env.ref('warehouse.warehouse_others').id,
+            'warehouse_dest_id': self.bj_warehouse.id,
+            'finance_category_id': self.env.ref('core.cat_donate').id,
+            'line_in_ids': [(0, 0, {'goods_id': self.goods_cable.id,
+                                    'type': 'in',
+                                    'goods_qty': 10,
+                                    'cost_unit': i + 1,
+                                    'cost': (i + 1) * 10})
+                            for i in range(line_count)]})
+        wh_in.approve_order()
+        wh_out = self.env['wh.out'].create({
+            'type': 'others',
+            'warehouse_id': self.bj_warehouse.id,
+            'warehouse_dest_id': self.env.ref('warehouse.warehouse_others').id,
+            'finance_category_id': self.env.ref('core.cat_donate').id,
+            'line_out_ids': [(0, 0, {'goods_id': self.goods_cable.id,
+                                     'type': 'out',
+                                     'goods_qty': 7})
+                             for i in range(line_count)]})
+        out_lines = wh_out.line_out_ids
+
+        start = time.time()
+        for line in out_lines:
+            self.goods_cable.get_matching_records(
+                line.warehouse_id, line.goods_qty,
+                uos_qty=line.goods_uos_qty, move_line=line)
+        per_line_time = time.time() - start
+
+        start = time.time()
+        batch_matching = out_lines.get_batch_matching_records()
+        batch_time = time.time() - start
+        _logger.info('matching %s out lines: per line %.3fs, batch %.3fs',
+                     line_count, per_line_time, batch_time)
+
+        # 第一行的匹配结果与逐行匹配一致
+        records, cost = self.goods_cable.get_matching_records(
+            out_lines[0].warehouse_id, out_lines[0].goods_qty,
+            uos_qty=out_lines[0].goods_uos_qty, move_line=out_lines[0])
+        self.assertEqual(batch_matching[out_lines[0].id], (records, cost))
+        # 后续行接着前面的行继续先进先出：第二行取第一条入库行剩余3个和第二条入库行4个
+        records, cost = batch_matching[out_lines[1].id]
+        self.assertEqual([r['qty'] for r in records], [3, 4])
+        self.assertAlmostEqual(cost, 3 * 1 + 4 * 2)
+
+        wh_out.approve_order()
+        self.assertEqual(sum(wh_in.line_in_ids.mapped('qty_remaining')),
+                         line_count * (10 - 7))
+        self.assertAlmostEqual(out_lines[1].cost, 3 * 1 + 4 * 2)
@@ -68,6 +68,38 @@ class TestNonActiveReport(TransactionCase):
 
         self.non_active_report_wizard.open_non_active_report()
 
+    def test_open_non_active_report_cache(self):
+        ''' 呆滞料报表 同一天同一仓库重复打开时复用报表行，阶段天数必须递增 '''
+        self.wh_move_line_13.date = datetime.datetime.now() - datetime.timedelta(days=2)
+        self.wh_move_line_13.state = 'done'
+        first = self.non_active_report_wizard.open_non_active_report()
+        second = self.non_active_report_wizard.open_non_active_report()
+        self.assertTrue(first['domain'][0][2])
+        self.assertEqual(first['domain'], second['domain'])
+        rows = self.env['non.active.report'].browse(first['domain'][0][2])
+        for row in rows:
+            self.assertAlmostEqual(row.first_stage_day_qty + row.second_stage_day_qty +
+                                   row.third_stage_day_qty + row.four_stage_day_qty,
+                                   row.subtotal)
+
+        # 库存余额变动后缓存键改变，即使变动的事务开始得更早
+        cache_key = self.non_active_report_wizard._get_cache_key()
+        self.assertEqual(cache_key, self.non_active_report_wizard._get_cache_key())
+        quant = self.env['wh.stock.quant'].search([], limit=1)
+        self.env['wh.stock.quant'].update_quant([(
+            (quant.goods_id.id, quant.attribute_id.id, quant.warehouse_id.id,
+             quant.location_id.id, quant.lot), 1, 0, 0)])
+        self.assertNotEqual(cache_key, self.non_active_report_wizard._get_cache_key())
+
+        # 阶段天数不同时重新计算
+        self.non_active_report_wizard.third_stage_day = 5
+        third = self.non_active_report_wizard.open_non_active_report()
+        self.assertNotEqual(first['domain'], third['domain'])
+
+        self.non_active_report_wizard.second_stage_day = 1
+        with self.assertRaises(UserError):
+            self.non_active_report_wizard.open_non_active_report()
+
     def test_non_active_report_fields_view_get(self):
         ''' 呆滞料报表 fields_view_get 测试 '''
         self.env['non.active.report'].with_context({
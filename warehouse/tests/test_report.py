@@ -100,6 +100,41 @@ class TestReport(TransactionCase):
 
         stock_transceive.with_context(context).find_source_move_line()
 
+    def test_stock_transceive_cache(self):
+        """
+        商品收发明细表:结果按查询参数缓存，单据行变动后失效
+        """
+        stock_transceive = self.env['report.stock.transceive'].create({})
+        self.transceive_wizard.date_start = '2016-02-01'
+        context = self.transceive_wizard.open_report().get('context')
+        report = stock_transceive.with_context(context)
+        report.search_read(domain=[])
+        stats = report.get_cache_stats()
+        report.search_read(domain=[])
+        self.assertEqual(report.get_cache_stats()['hits'], stats['hits'] + 1)
+
+        # 不同日期范围的查询不会互相覆盖
+        self.transceive_wizard.date_start = '2016-03-01'
+        other_report = stock_transceive.with_context(
+            self.transceive_wizard.open_report().get('context'))
+        other_report.search_read(domain=[])
+        report.search_read(domain=[])
+        self.assertEqual(report.get_cache_stats()['hits'], stats['hits'] + 2)
+
+        # 单据行变动后重新查询
+        self.env['wh.move.line'].search(
+            [('state', '=', 'done')], limit=1).write({'note': 'cache'})
+        misses = report.get_cache_stats()['misses']
+        report.search_read(domain=[])
+        self.assertEqual(report.get_cache_stats()['misses'], misses + 1)
+
+        # 其他进程的变动通过注册表缓存信号清空注册表缓存，本进程的旧结果不再命中
+        report.search_read(domain=[])
+        self.env.registry.clear_caches()
+        misses = report.get_cache_stats()['misses']
+        report.search_read(domain=[])
+        self.assertEqual(report.get_cache_stats()['misses'], misses + 1)
+
     def test_stock_transceive_search_by_goods_warehouse(self):
         """
         商品收发明细表:按商品和仓库查询
@@ -141,6 +176,55 @@ class TestReport(TransactionCase):
         stock_transceive.with_context(context).search_read(
             domain=['|', '|', ('goods', '=', '键盘'), ('warehouse', '=', '上海仓'), ('warehouse', '=', '总仓')])
 
+    def test_stock_transceive_sql_pushdown(self):
+        """
+        商品收发明细表:过滤、排序、分页、分组在数据库中完成
+        """
+        self.transceive_wizard.date_start = '2016-02-01'
+        context = self.transceive_wizard.open_report().get('context')
+        report = self.env['report.stock.transceive'].with_context(context)
+        results = report.search_read(domain=[], order='warehouse desc, goods_qty_in desc', limit=None)
+        keys = [(r.get('warehouse'), r.get('goods_qty_in')) for r in results]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        # 分页结果与完整结果一致
+        page = report.search_read(domain=[], order='warehouse desc, goods_qty_in desc',
+                                  limit=2, offset=1)
+        self.assertEqual([r.get('id') for r in page],
+                         [r.get('id') for r in results[1:3]])
+        # domain 条件以参数方式传入数据库
+        domain = ['|', ('warehouse', 'ilike', '总'), ('goods_qty_in', '>', 100)]
+        self.assertEqual(report.search_count(domain), len(
+            [r for r in results if '总' in (r.get('warehouse') or '') or r.get('goods_qty_in') > 100]))
+        groups = report.read_group(domain=[], fields=['warehouse', 'goods_qty_in'],
+                                   groupby=['warehouse'])
+        self.assertEqual(sum(g['warehouse_count'] for g in groups), len(results))
+        self.assertAlmostEqual(sum(g['goods_qty_in'] for g in groups),
+                               sum(r.get('goods_qty_in') for r in results))
+        with self.assertRaises(UserError):
+            report.search_read(domain=[('no_such_field', '=', 1)])
+
+    def test_stock_transceive_many2one_name_domain(self):
+        """
+        商品收发明细表:多对一字段按名称过滤，数值字段传入字符串不报数据库错误
+        """
+        self.transceive_wizard.date_start = '2016-02-01'
+        context = self.transceive_wizard.open_report().get('context')
+        report = self.env['report.stock.transceive'].with_context(context)
+        keyboard = self.env.ref('goods.keyboard')
+        results = report.search_read(domain=[], limit=None)
+        expected = [r.get('id') for r in results if r.get('goods') == keyboard.id]
+        self.assertTrue(expected)
+        self.assertEqual([r.get('id') for r in report.search_read(
+            domain=[('goods', '=', '键盘')], limit=None)], expected)
+        self.assertEqual([r.get('id') for r in report.search_read(
+            domain=[('goods', 'ilike', '键')], limit=None)], expected)
+        self.assertEqual(report.search_count([('goods', '!=', '键盘')]),
+                         len(results) - len(expected))
+        self.assertEqual(report.search_count([('goods', '=', keyboard.id)]), len(expected))
+        # 数值字段与字符串比较时不相等，与内存过滤一致
+        self.assertEqual(report.search_count([('goods_qty_in', '=', 'abc')]), 0)
+        self.assertEqual(report.search_count([('goods_qty_in', '!=', 'abc')]), len(results))
+
     def test_stock_transceive_read_group(self):
         """
         商品收发明细表: 按商品和仓库分组
@@ -82,6 +82,33 @@ class TestWarehouseOrder(TransactionCase):
         self.assertEqual(self.others_out_2.state, 'done')
         self.assertEqual(self.internal.state, 'done')
 
+    def test_stock_quant(self):
+        ''' 库存余额随出入库及撤销同步更新 '''
+        quant_obj = self.env['wh.stock.quant']
+        hd_stock = self.browse_ref('warehouse.hd_stock')
+        cable = self.browse_ref('goods.cable')
+        self.assertFalse(quant_obj.verify_quant())
+        self.assertEqual(
+            self.env['wh.move'].check_goods_qty(cable, False, hd_stock)[0],
+            12000 + 48 - 120)
+
+        self.others_out.cancel_approved_order()
+        self.internal.cancel_approved_order()
+        self.assertFalse(quant_obj.verify_quant())
+        self.assertEqual(
+            self.env['wh.move'].check_goods_qty(cable, False, hd_stock)[0],
+            12000 + 48)
+
+        # 人为改坏库存余额后，核对可以发现差异并重建
+        self.env.cr.execute('UPDATE wh_stock_quant SET qty = qty + 1')
+        self.assertTrue(quant_obj.verify_quant(repair=True))
+        self.assertFalse(quant_obj.verify_quant())
+
+        # 数量一致但成本不一致时，同样可以发现差异并重建
+        self.env.cr.execute('UPDATE wh_stock_quant SET cost = cost + 1')
+        self.assertTrue(quant_obj.verify_quant(repair=True))
+        self.assertFalse(quant_obj.verify_quant())
+
     def test_approve_create_zero_wh_in(self):
         ''' 测试 create_zero_wh_in '''
         self.others_out.cancel_approved_order()
@@ -1,5 +1,6 @@
 
 from odoo import models, fields, api
+from odoo.exceptions import UserError
 from datetime import datetime
 import pytz
 from lxml import etree
@@ -8,6 +9,8 @@ from lxml import etree
 class NonActiveReport(models.TransientModel):
     _name = 'non.active.report'
     _description = '呆滞料报表'
+    # 报表行按 仓库 + 日期 缓存，保留一天
+    _transient_max_hours = 24.0
 
     warehouse_id = fields.Many2one('warehouse', string='仓库')
     goods_id = fields.Many2one('goods', string='商品')
@@ -19,6 +22,7 @@ class NonActiveReport(models.TransientModel):
     subtotal = fields.Float('合计')
     latest_move_date = fields.Datetime('最后发货日期')
     latest_move_qty = fields.Float('最后发货数量')
+    cache_key = fields.Char('缓存键', index=True)
 
     @api.model
     def fields_view_get(self, view_id=None, view_type='form', toolbar=False, submenu=False):
@@ -65,95 +69,107 @@ class NonActiveReportWizard(models.TransientModel):
         change_default=True,
         default=lambda self: self.env.company)
 
-    
     def get_warehouse_goods_stage_data(self, warehouse_id, first_stage_day, second_stage_day, third_stage_day):
         """
-        用sql 找到 系统 在所输入的时间阶段的对应的商品的 数量
-        :param warehouse_id:  仓库id
+        按剩余库存层（qty_remaining）的入库日期计算各阶段的商品数量，并一次查出每个商品的最后发货
+        :param warehouse_id:  仓库
         :param first_stage_day:  第一阶段天数
-        :param second_stage_day:第一阶段天数
+        :param second_stage_day:第二阶段天数
         :param third_stage_day: 第三阶段天数
         :return: 返回list dict
         """
-        if warehouse_id:
-            wahouse_id_sql = "AND wh_dest.id =%s" % (warehouse_id.id)
-        else:
-            wahouse_id_sql = "AND 1=1"
-        now_date = datetime.strftime(
-            datetime.now(pytz.timezone("UTC")), '%Y-%m-%d')
-        vals = {'now_date': now_date, 'first_stage_day': first_stage_day, 'wahouse_id_sql': wahouse_id_sql,
-                'second_stage_day': second_stage_day, 'third_stage_day': third_stage_day}
-
+        self.env['wh.move.line'].flush(
+            ['state', 'date', 'write_date', 'goods_id', 'attribute_id', 'goods_qty',
+             'qty_remaining', 'warehouse_id', 'warehouse_dest_id'])
         self.env.cr.execute('''
-            select
-                stage_goods_date.warehouse_dest_id as warehouse_id,
-                stage_goods_date.goods_id as goods_id,
-                stage_goods_date.attribute_id as attribute_id,
-                NULL as latest_move_date,
-                NULL as latest_move_qty,
-                COALESCE(sum(stage_goods_date.first_stage),0) as first_stage_day_qty,
-                COALESCE(sum(stage_goods_date.second_stage),0) as second_stage_day_qty,
-                COALESCE(sum(stage_goods_date.third_stage),0) as third_stage_day_qty,
-                COALESCE(sum(stage_goods_date.four_stage),0) as four_stage_day_qty,
-                sum(stage_goods_date.subtotal) as subtotal
-                from  (select
-                          CASE
-                              when ('%(now_date)s' -line.date<=%(first_stage_day)d) then
-                                  sum(line.qty_remaining)
-                              end as first_stage,
-                          CASE
-                              when ('%(now_date)s'-line.date>%(first_stage_day)d and '%(now_date)s' -line.date<=%(second_stage_day)d) then
-                                  sum(line.qty_remaining)
-                              end as second_stage,
-                          CASE
-                              when ('%(now_date)s' -line.date>%(second_stage_day)d AND '%(now_date)s'-line.date<=%(third_stage_day)d) then
-                                  sum(line.qty_remaining)
-                              end as third_stage,
-                          CASE
-                              when ('%(now_date)s'-line.date > %(third_stage_day)d) then
-                                  sum(line.qty_remaining)
-                              end as four_stage,
-                          line.goods_id as goods_id,
-                          line.attribute_id as attribute_id,
-
-                          line.warehouse_dest_id as warehouse_dest_id,
-                          sum(line.qty_remaining) as subtotal
-                      FROM wh_move_line line
-                      LEFT JOIN warehouse wh_dest ON line.warehouse_dest_id = wh_dest.id
-                      LEFT JOIN warehouse wh ON line.warehouse_id = wh.id
-                      where line.state = 'done'
-                        %(wahouse_id_sql)s
-                      AND  wh_dest.type='stock'
-                      GROUP BY line.warehouse_dest_id,line.goods_id,line.attribute_id,line.date) as stage_goods_date
-              GROUP BY  stage_goods_date.warehouse_dest_id,stage_goods_date.goods_id,stage_goods_date.attribute_id
-        ''' % vals)
+            WITH stage AS (
+                SELECT line.warehouse_dest_id AS warehouse_id,
+                       line.goods_id,
+                       line.attribute_id,
+                       COALESCE(SUM(CASE WHEN %(date)s - line.date <= %(first)s
+                                         THEN line.qty_remaining END), 0) AS first_stage_day_qty,
+                       COALESCE(SUM(CASE WHEN %(date)s - line.date > %(first)s
+                                          AND %(date)s - line.date <= %(second)s
+                                         THEN line.qty_remaining END), 0) AS second_stage_day_qty,
+                       COALESCE(SUM(CASE WHEN %(date)s - line.date > %(second)s
+                                          AND %(date)s - line.date <= %(third)s
+                                         THEN line.qty_remaining END), 0) AS third_stage_day_qty,
+                       COALESCE(SUM(CASE WHEN %(date)s - line.date > %(third)s
+                                         THEN line.qty_remaining END), 0) AS four_stage_day_qty,
+                       SUM(line.qty_remaining) AS subtotal
+                  FROM wh_move_line line
+                  JOIN warehouse wh_dest ON line.warehouse_dest_id = wh_dest.id
+                 WHERE line.state = 'done'
+                   AND wh_dest.type = 'stock'
+                   AND line.qty_remaining != 0
+                   AND (%(warehouse_id)s IS NULL OR line.warehouse_dest_id = %(warehouse_id)s)
+              GROUP BY line.warehouse_dest_id, line.goods_id, line.attribute_id
+            ),
+            latest AS (
+                -- 每个商品属性的最后一次发货
+                SELECT DISTINCT ON (line.goods_id, line.attribute_id)
+                       line.goods_id, line.attribute_id,
+                       line.write_date AS latest_move_date,
+                       line.goods_qty AS latest_move_qty
+                  FROM wh_move_line line
+                  JOIN warehouse wh ON line.warehouse_id = wh.id
+                  JOIN warehouse wh_dest ON line.warehouse_dest_id = wh_dest.id
+                 WHERE line.state = 'done'
+                   AND wh.type = 'stock'
+                   AND wh_dest.type = 'customer'
+                   AND line.goods_id IN (SELECT goods_id FROM stage)
+              ORDER BY line.goods_id, line.attribute_id, line.write_date DESC
+            )
+            SELECT stage.*, latest.latest_move_date, latest.latest_move_qty
+              FROM stage
+         LEFT JOIN latest ON latest.goods_id = stage.goods_id
+                         AND latest.attribute_id IS NOT DISTINCT FROM stage.attribute_id
+             WHERE stage.subtotal != 0
+          ORDER BY stage.warehouse_id, stage.goods_id, stage.attribute_id
+        ''', {
+            'date': fields.Date.context_today(self),
+            'first': first_stage_day,
+            'second': second_stage_day,
+            'third': third_stage_day,
+            'warehouse_id': warehouse_id.id or None,
+        })
         return self.env.cr.dictfetchall()
 
-    
+    def _get_cache_key(self):
+        """
+        报表缓存键：日期、仓库、阶段天数，库存余额版本，以及移库单行最后修改时间
+        库存余额每次变动都取新的序列值，count + sum(version) 随任何已提交的变动而改变，不受事务提交先后影响；
+        移库单行最后修改时间覆盖只改发货明细（最后发货日期、数量）而不影响库存余额的情况
+        """
+        self.env['wh.stock.quant'].flush()
+        self.env['wh.move.line'].flush()
+        self.env.cr.execute('''
+            SELECT (SELECT COUNT(*) FROM wh_stock_quant),
+                   (SELECT COALESCE(SUM(version), 0) FROM wh_stock_quant),
+                   (SELECT MAX(write_date) FROM wh_move_line)
+        ''')
+        quant_count, quant_version, line_change = self.env.cr.fetchone()
+        return '%s/%s/%s-%s-%s/%s-%s/%s' % (
+            fields.Date.context_today(self), self.warehouse_id.id or 0,
+            self.first_stage_day, self.second_stage_day, self.third_stage_day,
+            quant_count, quant_version, line_change)
+
     def open_non_active_report(self):
         """
 
         :return:
          返回生成好的 呆滞料报表 记录的tree视图返回，让用户可以直接看到结果
         """
-        data_vals_list = self.get_warehouse_goods_stage_data(self.warehouse_id, self.first_stage_day,
-                                                             self.second_stage_day, self.third_stage_day)
-        non_active_id_list = []
-        for vals in data_vals_list:
-            if vals.get('subtotal', 0) != 0:
-                # 更新最后发货日期和最后发货数量
-                latest_move_line = self.env['wh.move.line'].search([
-                    ('state', '=', 'done'),
-                    ('goods_id', '=', vals.get('goods_id')),
-                    ('attribute_id', '=', vals.get('attribute_id')),
-                    ('warehouse_id.type', '=', 'stock'),
-                    ('warehouse_dest_id.type', '=', 'customer')], order='write_date DESC', limit=1)
-                if latest_move_line:
-                    vals['latest_move_date'] = latest_move_line.write_date
-                    vals['latest_move_qty'] = latest_move_line.goods_qty
-
-                active_row = self.env['non.active.report'].create(vals)
-                non_active_id_list.append(active_row.id)
+        if not 0 <= self.first_stage_day < self.second_stage_day < self.third_stage_day:
+            raise UserError('各阶段天数必须依次递增')
+        cache_key = self._get_cache_key()
+        non_active_rows = self.env['non.active.report'].search(
+            [('cache_key', '=', cache_key)])
+        if not non_active_rows:
+            data_vals_list = self.get_warehouse_goods_stage_data(self.warehouse_id, self.first_stage_day,
+                                                                 self.second_stage_day, self.third_stage_day)
+            non_active_rows = self.env['non.active.report'].create(
+                [dict(vals, cache_key=cache_key) for vals in data_vals_list])
 
         view = self.env.ref('warehouse.non_active_report_tree')
 
@@ -163,7 +179,7 @@ class NonActiveReportWizard(models.TransientModel):
             'views': [(view.id, 'tree')],
             'res_model': 'non.active.report',
             'type': 'ir.actions.act_window',
-            'domain': [('id', 'in', non_active_id_list)],
+            'domain': [('id', 'in', non_active_rows.ids)],
             'limit': 65535,
             'context': {'first_stage_day': self.first_stage_day,
                         'second_stage_day': self.second_stage_day, 'third_stage_day': self.third_stage_day}